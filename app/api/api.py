@@ -7,11 +7,12 @@
 #
 #   Import routers for webhooks skryv and teamleader auth calls
 #   with oauth token support and managing webhook installation and list calls.
-#   health for the healthchecks.
+#   health for the healthchecks. admin for cache maintenance.
+#   metrics for prometheus scraping.
 #
 
 from fastapi import APIRouter
-from app.api.routers import skryv, webhook, health
+from app.api.routers import skryv, webhook, health, admin, metrics
 
 api_router = APIRouter()
 
@@ -33,3 +34,15 @@ api_router.include_router(
     prefix="/health",
     tags=["Health check"]
 )
+
+api_router.include_router(
+    metrics.router,
+    prefix="/metrics",
+    tags=["Prometheus metrics"]
+)
+
+api_router.include_router(
+    admin.router,
+    prefix="/admin",
+    tags=["Cache maintenance"]
+)
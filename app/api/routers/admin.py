@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   app/api/routers/admin.py
+#
+#   Maintenance calls for the process wide caches
+#
+from fastapi import APIRouter
+from app.app import main_app as app
+from app.models.migrate_ids import MigrateIds
+
+router = APIRouter()
+
+
+@router.post("/custom_fields/invalidate")
+def invalidate_custom_fields():
+    """
+    Drops the cached custom field definitions and reloads them from Teamleader
+    """
+    return app.reload_custom_fields()
+
+
+@router.post("/migrate_ids/warm")
+def warm_migrate_ids(migrate_ids: MigrateIds):
+    """
+    Resolves old Teamleader ids with migrate.id and caches the results in redis
+    """
+    return app.warm_migrate_ids(migrate_ids.type, migrate_ids.ids)
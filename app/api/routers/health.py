@@ -27,4 +27,4 @@ async def oauth_check():
     Returns ok if oauth tokens are valid
     or link to refresh authentication if it's invalid
     """
-    return app.oauth_check()
+    return await app.oauth_check()
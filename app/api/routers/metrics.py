@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   app/api/routers/metrics.py
+#
+#   Prometheus scrape endpoint for teamleader, ldap, redis and slack call metrics
+#
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from app.app import main_app as app
+
+router = APIRouter()
+
+
+@router.get("", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """
+    Returns all metrics in the prometheus text format
+    """
+    return PlainTextResponse(
+        app.prometheus_metrics(),
+        media_type='text/plain; version=0.0.4'
+    )
@@ -15,8 +15,12 @@
 
 from app.services.webhook_service import WebhookService
 from app.clients.common_clients import construct_clients
+from app.clients.async_teamleader_client import AsyncTeamleaderClient
 from app.clients.redis_cache import redis_cache
+from app.clients.custom_field_cache import custom_field_cache
 from app.comm.webhook_scheduler import WebhookScheduler
+from app.comm.webhook_queue import create_webhook_queue
+from app.comm.metrics import metrics
 
 from viaa.configuration import ConfigParser
 from viaa.observability import logging
@@ -24,6 +28,12 @@ from viaa.observability import logging
 config = ConfigParser()
 logger = logging.get_logger(__name__, config=config)
 
+CLIENT_STATS = metrics.gauge(
+    'teamleader_client_stats',
+    'Stats kept by the teamleader client (retries, caches, rate limiters, ...)',
+    ('group', 'name')
+)
+
 
 class App:
 
@@ -31,19 +41,75 @@ class App:
         self.clients = None
         self.whs = WebhookScheduler()
         self.redis_cache = redis_cache
+        metrics.add_collector(self.collect_client_stats)
 
     def start_clients(self, start_scheduler=True):
         logger.info("Starting teamleader, ldap, slack clients...")
         self.clients = construct_clients(config.app_cfg, self.redis_cache)
+        custom_field_cache.ttl = int(
+            config.app_cfg['teamleader'].get('custom_fields_ttl', 3600)
+        )
+        custom_field_cache.redis = self.redis_cache
 
         if start_scheduler:
-            self.whs.start(self.clients)
+            skryv_params = config.app_cfg['skryv']
+            self.whs.start(
+                self.clients,
+                create_webhook_queue(skryv_params, self.redis_cache),
+                int(skryv_params.get('webhook_concurrency', 4)),
+                skryv_params.get('handler_threads'),
+                int(skryv_params.get('webhook_idempotency_ttl', 0))
+            )
 
     def auth_callback(self, code, state):
         return self.clients.teamleader.authcode_callback(code, state)
 
-    def oauth_check(self):
-        return self.clients.teamleader.oauth_check()
+    async def oauth_check(self):
+        # awaited so a slow teamleader does not block the event loop
+        tlc = AsyncTeamleaderClient(self.clients.teamleader)
+        return await tlc.oauth_check()
+
+    def warm_caches(self):
+        # loaded in background so startup does not wait on teamleader
+        custom_field_cache.warm(self.clients.teamleader)
+
+    def reload_custom_fields(self):
+        custom_field_cache.invalidate()
+        catalogue = custom_field_cache.get(self.clients.teamleader)
+        return {
+            'status': 'custom field definitions reloaded',
+            'custom_fields': len(catalogue.custom_fields),
+            'business_types': len(catalogue.business_types)
+        }
+
+    def warm_migrate_ids(self, resource_type, old_ids):
+        result = self.clients.teamleader.warm_migrate_uuids(resource_type, old_ids)
+        logger.info(f"migrate.id warm up for {resource_type}: {result}")
+        return result
+
+    def collect_client_stats(self):
+        if not self.clients:
+            return
+
+        tlc = self.clients.teamleader
+        groups = {
+            'retries': tlc.retry_stats(),
+            'company_writes': tlc.company_write_stats(),
+            'token_refreshes': tlc.token_refresh_stats(),
+            'connections': tlc.connection_stats(),
+            'circuit_breaker': tlc.circuit_breaker_stats()
+        }
+        if self.whs.parked_events:
+            groups['circuit_breaker']['parked_events'] = self.whs.parked_events.count()
+        for budget, stats in tlc.rate_limit_stats().items():
+            groups[f"rate_limit_{budget}"] = stats
+
+        for group, stats in groups.items():
+            for name, value in stats.items():
+                CLIENT_STATS.set(value, group=group, name=name)
+
+    def prometheus_metrics(self):
+        return metrics.render()
 
     def process_webhook(self, process_body):
         logger.info(
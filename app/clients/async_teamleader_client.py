@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   app/clients/async_teamleader_client.py
+#
+#   AsyncTeamleaderClient has the same api methods as TeamleaderClient
+#   but every method is awaitable and the iter_* methods are async generators.
+#   The blocking requests calls, token refreshes and rate limit waits of the
+#   wrapped client run in a thread pool, so the uvicorn event loop keeps
+#   serving /skryv and /health routes meanwhile.
+#   Session pooling, rate limiting and tokens stay shared with the sync client.
+#   The token flow internals, stats and event bookkeeping are left out, use
+#   the wrapped client (tlc) for those.
+#
+
+import asyncio
+import functools
+
+from datetime import datetime
+from app.clients.teamleader_client import TeamleaderClient
+
+
+class AsyncTeamleaderClient:
+    def __init__(self, teamleader_client: TeamleaderClient, executor=None):
+        self.tlc = teamleader_client
+        # None means the default executor of the running event loop
+        self.executor = executor
+
+    async def run(self, method, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self.executor,
+            functools.partial(method, *args, **kwargs)
+        )
+
+    async def iterate(self, items):
+        """ async generator over a generator of the sync client, every next
+        page or item is taken in the thread pool """
+        done = object()
+        try:
+            while True:
+                item = await self.run(next, items, done)
+                if item is done:
+                    return
+                yield item
+        finally:
+            await self.run(items.close)
+
+    async def oauth_check(self):
+        return await self.run(self.tlc.oauth_check)
+
+    async def authcode_callback(self, code, state):
+        return await self.run(self.tlc.authcode_callback, code, state)
+
+    async def list_companies(self, page=1, page_size=20, updated_since: datetime = None):
+        return await self.run(
+            self.tlc.list_companies, page, page_size, updated_since
+        )
+
+    def iter_companies(self, updated_since: datetime = None, page_size=50):
+        return self.iterate(self.tlc.iter_companies(updated_since, page_size))
+
+    async def get_company(self, uid):
+        return await self.run(self.tlc.get_company, uid)
+
+    async def update_company(self, company, original=None):
+        return await self.run(self.tlc.update_company, company, original)
+
+    async def list_contacts(self, page=1, page_size=20, updated_since: datetime = None):
+        return await self.run(
+            self.tlc.list_contacts, page, page_size, updated_since
+        )
+
+    def iter_contacts(self, updated_since: datetime = None, page_size=50):
+        return self.iterate(self.tlc.iter_contacts(updated_since, page_size))
+
+    async def linked_contacts(self, company_id, page=1, page_size=20):
+        return await self.run(
+            self.tlc.linked_contacts, company_id, page, page_size
+        )
+
+    def iter_linked_contacts(self, company_id, page_size=20):
+        return self.iterate(self.tlc.iter_linked_contacts(company_id, page_size))
+
+    async def company_contacts(self, company_id):
+        return await self.run(self.tlc.company_contacts, company_id)
+
+    async def get_contact(self, uid):
+        return await self.run(self.tlc.get_contact, uid)
+
+    async def update_contact(self, contact):
+        return await self.run(self.tlc.update_contact, contact)
+
+    async def add_contact(self, contact):
+        return await self.run(self.tlc.add_contact, contact)
+
+    async def link_to_company(self, contact_link):
+        return await self.run(self.tlc.link_to_company, contact_link)
+
+    async def update_company_link(self, contact_link):
+        return await self.run(self.tlc.update_company_link, contact_link)
+
+    async def delete_contact(self, contact_id):
+        return await self.run(self.tlc.delete_contact, contact_id)
+
+    async def list_custom_fields(self, page=1, page_size=50):
+        return await self.run(self.tlc.list_custom_fields, page, page_size)
+
+    def iter_custom_fields(self, page_size=50):
+        return self.iterate(self.tlc.iter_custom_fields(page_size))
+
+    async def list_business_types(self, page=1, page_size=50):
+        return await self.run(self.tlc.list_business_types, page, page_size)
+
+    async def get_custom_field(self, uid):
+        return await self.run(self.tlc.get_custom_field, uid)
+
+    async def get_migrate_uuid(self, resource_type, old_external_id):
+        return await self.run(
+            self.tlc.get_migrate_uuid, resource_type, old_external_id
+        )
+
+    async def warm_migrate_uuids(self, resource_type, old_external_ids):
+        return await self.run(
+            self.tlc.warm_migrate_uuids, resource_type, old_external_ids
+        )
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   app/clients/cassette.py
+#
+#   Record and replay of Teamleader http traffic. The RecordingAdapter is
+#   mounted on the TeamleaderClient session (cassette_mode: record) and writes
+#   every request/response pair with its duration to a gzipped json lines
+#   cassette file. Tokens, secrets and the Authorization header are never
+#   written. The ReplayAdapter (cassette_mode: replay) serves those responses
+#   back without touching Teamleader, sleeping the recorded duration
+#   multiplied by cassette_time_scale (0 replays without delays).
+#
+
+import gzip
+import json
+import threading
+import time
+
+from collections import deque
+from datetime import timedelta
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+from requests import Response
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from viaa.configuration import ConfigParser
+from viaa.observability import logging
+
+config = ConfigParser()
+logger = logging.get_logger(__name__, config=config)
+
+REDACTED = 'REDACTED'
+SENSITIVE_KEYS = (
+    'access_token', 'refresh_token', 'client_secret', 'code', 'auth_token'
+)
+RECORDED_HEADERS = (
+    'Content-Type', 'Retry-After',
+    'X-RateLimit-Limit', 'X-RateLimit-Remaining', 'X-RateLimit-Reset'
+)
+
+
+class CassetteMissError(Exception):
+    """Raised in replay mode for a request that is not in the cassette"""
+    pass
+
+
+def redact(data):
+    if isinstance(data, dict):
+        return {
+            key: REDACTED if key in SENSITIVE_KEYS else redact(value)
+            for key, value in data.items()
+        }
+
+    if isinstance(data, list):
+        return [redact(item) for item in data]
+
+    return data
+
+
+def redact_body(body):
+    """ redacted and normalized request or response body, json bodies and
+    form encoded oauth requests are supported """
+    if not body:
+        return ''
+
+    if isinstance(body, bytes):
+        body = body.decode('utf-8', 'replace')
+
+    try:
+        return json.dumps(redact(json.loads(body)), sort_keys=True)
+    except ValueError:
+        pass
+
+    fields = parse_qsl(body, keep_blank_values=True)
+    if fields:
+        return urlencode(sorted(redact(dict(fields)).items()))
+
+    return body
+
+
+def request_key(request):
+    """ requests are matched on method, path, query and redacted body,
+    so a cassette recorded on one api_uri can be replayed on another """
+    url = urlsplit(request.url)
+    query = urlencode(sorted(parse_qsl(url.query, keep_blank_values=True)))
+    return '{} {}?{} {}'.format(
+        request.method, url.path, query, redact_body(request.body)
+    )
+
+
+class RecordingAdapter(HTTPAdapter):
+    def __init__(self, cassette_file, **kwargs):
+        super().__init__(**kwargs)
+        self.cassette_file = cassette_file
+        self.cassette = gzip.open(cassette_file, 'at', encoding='utf-8')
+        self.lock = threading.Lock()
+        self.recorded = 0
+
+    def send(self, request, **kwargs):
+        start = time.monotonic()
+        response = super().send(request, **kwargs)
+        content = response.content
+        interaction = {
+            'request': request_key(request),
+            'status': response.status_code,
+            'headers': {
+                name: response.headers[name]
+                for name in RECORDED_HEADERS if name in response.headers
+            },
+            'body': redact_body(content),
+            'seconds': round(time.monotonic() - start, 4)
+        }
+        with self.lock:
+            self.cassette.write(json.dumps(interaction) + '\n')
+            self.recorded += 1
+
+        return response
+
+    def close(self):
+        super().close()
+        with self.lock:
+            if not self.cassette.closed:
+                self.cassette.close()
+                logger.info(
+                    f"recorded {self.recorded} teamleader calls in {self.cassette_file}"
+                )
+
+
+class ReplayAdapter(HTTPAdapter):
+    def __init__(self, cassette_file, time_scale=1.0, **kwargs):
+        super().__init__(**kwargs)
+        self.time_scale = time_scale
+        self.lock = threading.Lock()
+        self.interactions = {}
+        self.replayed = 0
+        with gzip.open(cassette_file, 'rt', encoding='utf-8') as cassette:
+            for line in cassette:
+                interaction = json.loads(line)
+                self.interactions.setdefault(
+                    interaction['request'], deque()
+                ).append(interaction)
+
+    def next_interaction(self, key):
+        """ recorded responses are served in order, the last one is repeated
+        when a request is sent more often than during recording """
+        with self.lock:
+            recorded = self.interactions.get(key)
+            if not recorded:
+                raise CassetteMissError(f"no recorded response for {key}")
+
+            self.replayed += 1
+            if len(recorded) > 1:
+                return recorded.popleft()
+            return recorded[0]
+
+    def send(self, request, **kwargs):
+        interaction = self.next_interaction(request_key(request))
+        if self.time_scale > 0:
+            time.sleep(interaction['seconds'] * self.time_scale)
+
+        response = Response()
+        response.status_code = interaction['status']
+        response.headers = CaseInsensitiveDict(interaction['headers'])
+        response._content = interaction['body'].encode('utf-8')
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        response.elapsed = timedelta(seconds=interaction['seconds'])
+        return response
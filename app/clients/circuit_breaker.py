@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   app/clients/circuit_breaker.py
+#
+#   CircuitBreaker around the Teamleader api. After failure_threshold server
+#   errors or connection failures in a row the circuit opens and calls fail
+#   fast with TeamleaderUnavailableError. After reset_timeout seconds it is
+#   half open: a single probe call is let through, when it succeeds the circuit
+#   closes again, when it fails it opens for another reset_timeout.
+#   The WebhookScheduler parks events while the circuit is open.
+#
+
+import threading
+import time
+
+from viaa.configuration import ConfigParser
+from viaa.observability import logging
+
+config = ConfigParser()
+logger = logging.get_logger(__name__, config=config)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class TeamleaderUnavailableError(Exception):
+    """Raised when Teamleader is down and the circuit breaker is open"""
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+        # stats
+        self.opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return CLOSED
+
+        if time.time() - self.opened_at >= self.reset_timeout:
+            return HALF_OPEN
+
+        return OPEN
+
+    def available(self):
+        """ False while open, events should be parked instead of executed """
+        return self.state != OPEN
+
+    def allow_request(self):
+        with self.lock:
+            state = self.state
+            if state == CLOSED:
+                return True
+
+            if state == HALF_OPEN and not self.probing:
+                logger.info("Teamleader circuit half open, sending probe request")
+                self.probing = True
+                return True
+
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                logger.info("Teamleader circuit closed, api is available again")
+
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    self.opened += 1
+                logger.warning(
+                    f"Teamleader circuit open after {self.failures} failures"
+                )
+                self.opened_at = time.time()
+                self.probing = False
+
+    def stats(self):
+        return {
+            'open': int(self.state != CLOSED),
+            'failures': self.failures,
+            'opened': self.opened,
+            'rejected': self.rejected
+        }
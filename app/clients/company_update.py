@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   app/clients/company_update.py
+#
+#   plan_company_update compares a company as fetched from Teamleader with the
+#   version our services changed and returns a companies.update payload with
+#   only the changed fields. Custom fields are compared by definition id and
+#   only changed ones are sent, lists like addresses and emails are sent as a
+#   whole when anything in them changed (Teamleader replaces these lists).
+#   When nothing changed there is no payload and no request needs to be made.
+#
+
+
+def custom_field_values(company):
+    """ custom field values by id, for both the companies.info format
+    {definition: {id}, value} and the update format {id, value}
+    """
+    values = {}
+    for f in company.get('custom_fields') or []:
+        if 'definition' in f:
+            values[f['definition']['id']] = f['value']
+        else:
+            values[f['id']] = f['value']
+
+    return values
+
+
+def plan_company_update(original, company):
+    """ returns (payload, unchanged) where payload is None when there is
+    nothing to update and unchanged is the number of fields left out
+    """
+    payload = {}
+    unchanged = 0
+
+    for key, value in company.items():
+        if key in ('id', 'custom_fields'):
+            continue
+
+        if key in original and original[key] == value:
+            unchanged += 1
+        elif value is not None or original.get(key) is not None:
+            payload[key] = value
+
+    original_fields = custom_field_values(original)
+    changed_fields = []
+    for field_id, value in custom_field_values(company).items():
+        if field_id in original_fields and original_fields[field_id] == value:
+            unchanged += 1
+        else:
+            changed_fields.append({'id': field_id, 'value': value})
+
+    if changed_fields:
+        payload['custom_fields'] = changed_fields
+
+    if not payload:
+        return (None, unchanged)
+
+    payload['id'] = company['id']
+    return (payload, unchanged)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   app/clients/custom_field_cache.py
+#
+#   CustomFieldCache keeps the TeamleaderCatalogue (all custom field definitions
+#   and business types) in memory for the whole process, so services no longer
+#   call customFieldDefinitions.list for every webhook event.
+#   After ttl seconds the stale catalogue is still returned while a background
+#   thread reloads it (stale-while-revalidate). Every load is also saved as a
+#   snapshot in redis, which is used on cold starts and by other replicas.
+#   The cache is warmed at startup and can be invalidated with /admin routes.
+#
+
+import json
+import threading
+import time
+
+from redis.exceptions import RedisError
+from app.clients.teamleader_catalogue import TeamleaderCatalogue, load_catalogue
+from viaa.configuration import ConfigParser
+from viaa.observability import logging
+
+config = ConfigParser()
+logger = logging.get_logger(__name__, config=config)
+
+
+class CustomFieldCache:
+    def __init__(self, ttl=3600, redis_cache=None):
+        self.ttl = ttl
+        self.redis = redis_cache
+        self.snapshot_key = 'skryv_tl_catalogue'
+        self.catalogue = None
+        self.lock = threading.Lock()
+        self.refreshing = False
+
+    def expired(self, catalogue):
+        return time.time() - catalogue.loaded_at > self.ttl
+
+    def read_snapshot(self):
+        if not self.redis:
+            return None
+
+        try:
+            snapshot = self.redis.get(self.snapshot_key)
+            if snapshot:
+                logger.info("loaded teamleader catalogue snapshot from redis")
+                return TeamleaderCatalogue.from_dict(json.loads(snapshot))
+        except (RedisError, ValueError, KeyError) as e:
+            logger.warning(f"ignoring teamleader catalogue snapshot: {e}")
+
+    def save_snapshot(self, catalogue):
+        if not self.redis:
+            return
+
+        try:
+            self.redis.save(self.snapshot_key, catalogue.to_dict())
+        except RedisError as e:
+            logger.warning(f"saving teamleader catalogue snapshot failed: {e}")
+
+    def load(self, tlc):
+        catalogue = load_catalogue(tlc)
+        self.catalogue = catalogue
+        self.save_snapshot(catalogue)
+        logger.info(
+            "loaded {} custom field definitions and {} business types".format(
+                len(catalogue.custom_fields),
+                len(catalogue.business_types)
+            )
+        )
+        return catalogue
+
+    def background_refresh(self, tlc):
+        try:
+            self.load(tlc)
+        except Exception as e:
+            # keep serving the stale catalogue, retried on next get
+            logger.warning(f"teamleader catalogue refresh failed: {e}")
+        finally:
+            self.refreshing = False
+
+    def refresh_async(self, tlc):
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+
+        threading.Thread(
+            target=self.background_refresh,
+            args=(tlc,),
+            daemon=True
+        ).start()
+
+    def warm_up(self, tlc):
+        try:
+            self.get(tlc)
+        except Exception as e:
+            logger.warning(f"teamleader catalogue warm up failed: {e}")
+
+    def warm(self, tlc):
+        # uses the redis snapshot when available, otherwise loads all pages
+        threading.Thread(target=self.warm_up, args=(tlc,), daemon=True).start()
+
+    def get(self, tlc):
+        # one reference read under the lock, invalidate can reset it any time
+        with self.lock:
+            catalogue = self.catalogue
+            if catalogue is None:
+                catalogue = self.catalogue = self.read_snapshot()
+            if catalogue is None:
+                return self.load(tlc)
+
+        if self.expired(catalogue):
+            self.refresh_async(tlc)
+
+        return catalogue
+
+    def invalidate(self):
+        with self.lock:
+            self.catalogue = None
+            if self.redis:
+                self.redis.delete(self.snapshot_key)
+
+
+custom_field_cache = CustomFieldCache()
@@ -9,6 +9,7 @@
 #
 
 import ldap3
+from app.comm.metrics import timed
 from viaa.configuration import ConfigParser
 from viaa.observability import logging
 
@@ -54,6 +55,7 @@ class LdapClient:
     def connection(self):
         return self.ldap_wrapper.connect()
 
+    @timed('ldap')
     def find_company_by_uuid(self, company_uuid):
         conn = self.connection()
         conn.search(
@@ -71,6 +73,7 @@ class LdapClient:
         else:
             return None
 
+    @timed('ldap')
     def find_company(self, or_id):
         conn = self.connection()
         conn.search(
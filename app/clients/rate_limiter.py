@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   app/clients/rate_limiter.py
+#
+#   RateLimiter implements GCRA (generic cell rate algorithm) which behaves
+#   like a token bucket that refills one token every interval seconds and
+#   holds at most burst tokens. The theoretical arrival time (tat) is stored
+#   in redis so that all workers and replicas share one budget.
+#   Callers reserve a slot and only sleep when the bucket is empty.
+#   When redis is not available we fall back to an in process bucket.
+#
+
+import time
+import threading
+
+from redis.exceptions import RedisError
+from app.clients.redis_cache import RedisCache
+from viaa.configuration import ConfigParser
+from viaa.observability import logging
+
+config = ConfigParser()
+logger = logging.get_logger(__name__, config=config)
+
+
+class RateLimiter:
+    def __init__(self, key, interval, burst=1, redis_cache: RedisCache = None):
+        self.key = key
+        self.interval = float(interval)
+        self.burst = max(int(burst), 1)
+        self.redis = redis_cache
+
+        # local fallback state, also used when no redis is passed
+        self.lock = threading.Lock()
+        self.tat = 0.0
+
+        # stats
+        self.calls = 0
+        self.waits = 0
+        self.waited_seconds = 0.0
+
+    @property
+    def tolerance(self):
+        # how far tat may run ahead of now before callers need to wait
+        return self.interval * (self.burst - 1)
+
+    def reserve_local(self, now):
+        with self.lock:
+            tat = max(self.tat, now)
+            wait = max(0.0, tat - self.tolerance - now)
+            self.tat = tat + self.interval
+            return wait
+
+    def reserve(self):
+        now = time.time()
+        if self.redis:
+            try:
+                return self.redis.reserve_rate_slot(
+                    self.key, self.interval, self.tolerance, now
+                )
+            except RedisError as e:
+                logger.warning(
+                    f"rate limiter {self.key} falling back to local bucket: {e}"
+                )
+
+        return self.reserve_local(now)
+
+    def acquire(self):
+        """ take a token, sleeps only when the shared bucket is empty """
+        wait = self.reserve()
+        with self.lock:
+            self.calls += 1
+            if wait > 0:
+                self.waits += 1
+                self.waited_seconds += wait
+
+        if wait > 0:
+            time.sleep(wait)
+
+        return wait
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'waits': self.waits,
+            'waited_seconds': round(self.waited_seconds, 3)
+        }
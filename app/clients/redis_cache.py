@@ -8,11 +8,76 @@
 
 import json
 import redis
+import time
+
+from redis.exceptions import ResponseError
+from app.comm.metrics import timed
+
+# GCRA slot reservation, executed atomically inside redis.
+# returns the seconds the caller needs to wait before using its slot
+RATE_SLOT_SCRIPT = """
+local now = tonumber(ARGV[3])
+local tat = tonumber(redis.call('GET', KEYS[1]))
+if not tat or tat < now then
+    tat = now
+end
+local wait = tat - tonumber(ARGV[2]) - now
+if wait < 0 then
+    wait = 0
+end
+local new_tat = tat + tonumber(ARGV[1])
+redis.call('SET', KEYS[1], tostring(new_tat), 'PX', math.ceil((new_tat - now) * 1000) + 1000)
+return tostring(wait)
+"""
+
+# lease keys hold the name of their owner, only the owner renews or releases.
+# A lease is taken when it is free, already ours or (ARGV[3]) offered
+# by its owner
+TAKE_LEASE_SCRIPT = """
+local owner = redis.call('GET', KEYS[1])
+if not owner or owner == ARGV[1] or owner == ARGV[3] then
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+    return 1
+end
+return 0
+"""
+RENEW_LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+OFFER_LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3]) and 1
+end
+return 0
+"""
+
+# members of a sorted set scored with their last heartbeat, members silent
+# for ARGV[3] seconds are dropped, returns the number of live members
+HEARTBEAT_SCRIPT = """
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', tonumber(ARGV[2]) - tonumber(ARGV[3]))
+return redis.call('ZCARD', KEYS[1])
+"""
 
 
 class RedisCache:
     def __init__(self) -> str:
         self.redis_cache = None
+        self.rate_slot_script = None
+        self.take_lease_script = None
+        self.renew_lease_script = None
+        self.release_lease_script = None
+        self.offer_lease_script = None
+        self.heartbeat_script = None
 
     def create_connection(self, redis_url):
         self.redis_cache = redis.Redis.from_url(redis_url)
@@ -20,11 +85,18 @@ class RedisCache:
     # async def _get(self, key) -> str:
     #     return await self.redis_cache.get(key)
 
+    @timed('redis')
     def get(self, key):
         return self.redis_cache.get(key)
 
-    def set(self, key, value):
-        self.redis_cache.set(key, value)
+    @timed('redis')
+    def set(self, key, value, ttl=None):
+        self.redis_cache.set(key, value, ex=ttl)
+
+    @timed('redis')
+    def set_if_absent(self, key, value, ttl):
+        """ sets key with a ttl in seconds, False when it already exists """
+        return bool(self.redis_cache.set(key, value, nx=True, ex=ttl))
 
     def auto_expire(self, key):
         # auto expire stale documents after a few minutes
@@ -33,9 +105,173 @@ class RedisCache:
         expiry_minutes = 5
         self.redis_cache.expire(key, 60*expiry_minutes)
 
+    @timed('redis')
     def delete(self, key):
         self.redis_cache.delete(key)
 
+    @timed('redis')
+    def hget(self, key, field):
+        return self.redis_cache.hget(key, field)
+
+    @timed('redis')
+    def hset(self, key, field, value):
+        self.redis_cache.hset(key, field, value)
+
+    @timed('redis')
+    def incr(self, key):
+        return self.redis_cache.incr(key)
+
+    @timed('redis')
+    def rpush(self, key, value):
+        return self.redis_cache.rpush(key, value)
+
+    @timed('redis')
+    def lpush(self, key, value):
+        return self.redis_cache.lpush(key, value)
+
+    @timed('redis')
+    def lpop(self, key):
+        return self.redis_cache.lpop(key)
+
+    @timed('redis')
+    def llen(self, key):
+        return self.redis_cache.llen(key)
+
+    @timed('redis')
+    def publish(self, channel, message):
+        self.redis_cache.publish(channel, message)
+
+    @timed('redis')
+    def xadd(self, stream, fields, maxlen=None):
+        return self.redis_cache.xadd(stream, fields, maxlen=maxlen)
+
+    def xgroup_create(self, stream, group):
+        # creates the stream as well, an existing group is fine
+        try:
+            self.redis_cache.xgroup_create(stream, group, id='0', mkstream=True)
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    @timed('redis')
+    def xreadgroup(self, stream, group, consumer, entry_id='>', count=1):
+        """ list of (entry_id, fields), entry_id '>' reads new entries
+        and '0' our own delivered but unacknowledged entries """
+        result = self.redis_cache.xreadgroup(
+            group, consumer, {stream: entry_id}, count=count
+        )
+        return result[0][1] if result else []
+
+    @timed('redis')
+    def xack(self, stream, group, entry_id):
+        return self.redis_cache.xack(stream, group, entry_id)
+
+    @timed('redis')
+    def xpending(self, stream, group, count=100):
+        return self.redis_cache.xpending_range(stream, group, '-', '+', count)
+
+    @timed('redis')
+    def xclaim(self, stream, group, consumer, min_idle_ms, entry_ids):
+        return self.redis_cache.xclaim(
+            stream, group, consumer, min_idle_ms, entry_ids
+        )
+
+    @timed('redis')
+    def xundelivered(self, stream, group):
+        """ True when the stream has entries not yet read by group """
+        last_id = self.redis_cache.xinfo_stream(stream)['last-generated-id']
+        for info in self.redis_cache.xinfo_groups(stream):
+            if info['name'] in (group, group.encode()):
+                return info['last-delivered-id'] != last_id
+        return True
+
+    def subscribe(self, channel, callback):
+        """ calls callback(data) for every message published on channel from
+        a background thread, returns the thread, use stop() to unsubscribe
+        """
+        pubsub = self.redis_cache.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{channel: lambda message: callback(message['data'])})
+        return pubsub.run_in_thread(sleep_time=1.0, daemon=True)
+
+    def lock(self, name, timeout, blocking_timeout):
+        # redis-py lock, acquire() returns False when it was not acquired
+        # within blocking_timeout, release() raises LockNotOwnedError once
+        # the lock expired after timeout seconds
+        return self.redis_cache.lock(
+            name,
+            timeout=timeout,
+            blocking_timeout=blocking_timeout
+        )
+
+    @timed('redis')
+    def reserve_rate_slot(self, key, interval, tolerance, now):
+        if not self.rate_slot_script:
+            self.rate_slot_script = self.redis_cache.register_script(
+                RATE_SLOT_SCRIPT
+            )
+
+        wait = self.rate_slot_script(
+            keys=[key],
+            args=[interval, tolerance, now]
+        )
+        return float(wait)
+
+    @timed('redis')
+    def take_lease(self, key, owner, ttl, offered=None):
+        """ takes a free lease for ttl seconds, or one that holds the
+        offered marker when given. True when the lease is ours """
+        if not self.take_lease_script:
+            self.take_lease_script = self.redis_cache.register_script(
+                TAKE_LEASE_SCRIPT
+            )
+
+        return bool(self.take_lease_script(keys=[key], args=[owner, ttl, offered or '']))
+
+    @timed('redis')
+    def renew_lease(self, key, owner, ttl):
+        """ extends the ttl of a lease we own, False when it is not ours """
+        if not self.renew_lease_script:
+            self.renew_lease_script = self.redis_cache.register_script(
+                RENEW_LEASE_SCRIPT
+            )
+
+        return bool(self.renew_lease_script(keys=[key], args=[owner, ttl]))
+
+    @timed('redis')
+    def release_lease(self, key, owner):
+        if not self.release_lease_script:
+            self.release_lease_script = self.redis_cache.register_script(
+                RELEASE_LEASE_SCRIPT
+            )
+
+        return bool(self.release_lease_script(keys=[key], args=[owner]))
+
+    @timed('redis')
+    def offer_lease(self, key, owner, offered, ttl):
+        """ replaces our lease with the offered marker for ttl seconds,
+        see take_lease """
+        if not self.offer_lease_script:
+            self.offer_lease_script = self.redis_cache.register_script(
+                OFFER_LEASE_SCRIPT
+            )
+
+        return bool(self.offer_lease_script(keys=[key], args=[owner, offered, ttl]))
+
+    @timed('redis')
+    def heartbeat(self, key, member, ttl):
+        """ marks member alive, returns the number of members seen in the
+        last ttl seconds """
+        if not self.heartbeat_script:
+            self.heartbeat_script = self.redis_cache.register_script(
+                HEARTBEAT_SCRIPT
+            )
+
+        return int(self.heartbeat_script(keys=[key], args=[member, time.time(), ttl]))
+
+    @timed('redis')
+    def zrem(self, key, member):
+        return self.redis_cache.zrem(key, member)
+
     def close(self):
         self.redis_cache.close()
 
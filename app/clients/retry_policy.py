@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   app/clients/retry_policy.py
+#
+#   RetryPolicy decides if a failed Teamleader call is retried and how long
+#   we wait before doing so. We honour Retry-After and the X-RateLimit-*
+#   headers from Teamleader and otherwise use exponential backoff with jitter.
+#   Reads are always retried, writes only when they are safe to repeat.
+#   All retries of one webhook event share a retry budget (reset_budget is
+#   called by the scheduler for every event) so that bursts result in slower
+#   throughput instead of dropped company updates, without retrying forever.
+#   Events are handled concurrently in worker threads, the budget is kept per
+#   thread so one event never resets or uses up the budget of another.
+#   Threads working for the same event share its budget with use_budget.
+#
+
+import random
+import threading
+import time
+
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# writes that give the same result when sent twice
+IDEMPOTENT_WRITES = (
+    '/companies.update',
+    '/contacts.update',
+    '/contacts.updateCompanyLink',
+)
+
+
+def header_delay(value, now=None):
+    """ seconds to wait for a Retry-After or X-RateLimit-Reset header value,
+    which is either a number of seconds, an epoch timestamp or a date """
+    if value is None:
+        return None
+
+    now = now or time.time()
+    try:
+        seconds = float(value)
+        if seconds > 1000000000:
+            # epoch timestamp
+            seconds = seconds - now
+        return max(seconds, 0.0)
+    except ValueError:
+        pass
+
+    try:
+        reset_at = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        try:
+            reset_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+
+    return max(reset_at.timestamp() - now, 0.0)
+
+
+class RetryPolicy:
+    def __init__(self, params: dict):
+        self.max_retries = int(params.get('max_retries', 3))
+        self.budget_size = int(params.get('retry_budget', 10))
+        self.backoff = float(params.get('retry_backoff', 1.0))
+        self.max_delay = float(params.get('retry_max_delay', 30.0))
+
+        self.lock = threading.Lock()
+        self.local = threading.local()     # event budget used by this thread
+        self.pause_until = 0.0
+
+        # stats
+        self.retries = 0
+        self.rate_limited = 0
+        self.server_errors = 0
+        self.budget_exhausted = 0
+        self.backoff_seconds = 0.0
+
+    def reset_budget(self):
+        self.local.event = {'budget': self.budget_size}
+
+    def event_budget(self):
+        """ budget of the event handled by this thread """
+        if not hasattr(self.local, 'event'):
+            self.reset_budget()
+        return self.local.event
+
+    def use_budget(self, event_budget):
+        """ retries in this thread use up event_budget of another thread """
+        self.local.event = event_budget
+
+    @property
+    def budget(self):
+        return self.event_budget()['budget']
+
+    def retryable(self, method, resource_path, status_code):
+        if status_code not in RETRY_STATUS_CODES:
+            return False
+
+        if method == 'GET' or status_code == 429:
+            # a 429 response means the request was not processed
+            return True
+
+        return resource_path in IDEMPOTENT_WRITES
+
+    def backoff_delay(self, attempt):
+        delay = self.backoff * (2 ** attempt)
+        return min(delay + random.uniform(0, self.backoff), self.max_delay)
+
+    def track_rate_limit(self, response):
+        """ when teamleader tells us the budget is used up, pause all calls
+        until the reset instead of running into 429 responses """
+        if response.headers.get('X-RateLimit-Remaining') != '0':
+            return
+
+        delay = header_delay(response.headers.get('X-RateLimit-Reset'))
+        if delay:
+            with self.lock:
+                self.pause_until = max(
+                    self.pause_until,
+                    time.time() + min(delay, self.max_delay)
+                )
+
+    def wait_for_reset(self):
+        wait = self.pause_until - time.time()
+        if wait > 0:
+            with self.lock:
+                self.backoff_seconds += wait
+            time.sleep(wait)
+
+    def retry_delay(self, method, resource_path, response, attempt):
+        """ returns seconds to wait before retrying, or None to give up """
+        self.track_rate_limit(response)
+        status_code = response.status_code
+        if not self.retryable(method, resource_path, status_code):
+            return None
+
+        with self.lock:
+            if status_code == 429:
+                self.rate_limited += 1
+            else:
+                self.server_errors += 1
+
+            if attempt >= self.max_retries or self.budget <= 0:
+                self.budget_exhausted += 1
+                return None
+
+            self.event_budget()['budget'] -= 1
+            self.retries += 1
+
+        delay = header_delay(response.headers.get('Retry-After'))
+        if delay is None and status_code == 429:
+            delay = header_delay(response.headers.get('X-RateLimit-Reset'))
+        if delay is None:
+            delay = self.backoff_delay(attempt)
+
+        delay = min(delay, self.max_delay)
+        with self.lock:
+            self.backoff_seconds += delay
+
+        return delay
+
+    def stats(self):
+        return {
+            'retries': self.retries,
+            'rate_limited': self.rate_limited,
+            'server_errors': self.server_errors,
+            'budget_exhausted': self.budget_exhausted,
+            'backoff_seconds': round(self.backoff_seconds, 3)
+        }
@@ -12,6 +12,7 @@ from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
 from urllib.error import URLError
 from app.models.dossier import Dossier
+from app.comm.metrics import timed
 from viaa.configuration import ConfigParser
 from viaa.observability import logging
 
@@ -45,10 +46,7 @@ class SlackWrapper:
                 self.previous_message = slack_text
                 return
 
-            self.client.chat_postMessage(
-                channel=self.channel,
-                text=slack_text
-            )
+            self.post_message(slack_text)
 
             self.previous_message = slack_text
 
@@ -57,6 +55,13 @@ class SlackWrapper:
                 f"SLACK ERROR: {e} => Please check config.yml and .env"
             )
 
+    @timed('slack', 'chat_postMessage')
+    def post_message(self, slack_text):
+        self.client.chat_postMessage(
+            channel=self.channel,
+            text=slack_text
+        )
+
 
 class SlackClient:
     def __init__(self, app_config: dict):
@@ -162,6 +167,13 @@ class SlackClient:
         )
         self.create_message(msg)
 
+    def teamleader_unavailable(self, error):
+        msg = "Teamleader API is unavailable: {}. {}.".format(
+            error,
+            'Webhook events are parked and replayed once Teamleader responds again'
+        )
+        self.create_message(msg)
+
     def invalid_ondertekenproces(self, dossier, error):
         msg = 'Errors in ondertekenproces for Skryv {} {} parsing error: {}'.format(
             f'contentpartner={dossier.label}',
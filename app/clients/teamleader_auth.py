@@ -7,9 +7,15 @@
 #
 #   TeamleaderAuth model class to store and load
 #   teamleader oauth tokens.
+#   refresh_lock is a redis lock shared by all workers, so only one of them
+#   refreshes the tokens and the others pick up the new ones.
+#   The expiry timestamp of the token is stored next to the tokens.
+#   Every save gets a new version number which is published on a redis channel,
+#   workers subscribe to it to swap to new tokens without polling redis.
 #
 
 import os
+import threading
 from app.clients.redis_cache import RedisCache
 from viaa.configuration import ConfigParser
 from viaa.observability import logging
@@ -23,23 +29,69 @@ class TeamleaderAuth():
 
     def __init__(self, tl_config: dict, redis_cache: RedisCache = None):
         self.token_key = 'skryv_tl_auth_tokens'
+        self.refresh_lock_key = 'skryv_tl_auth_refresh_lock'
+        self.version_key = 'skryv_tl_auth_version'
+        self.channel = 'skryv_tl_auth_updates'
+        self.refresh_timeout = int(tl_config.get('token_refresh_timeout', 30))
         self.redis = redis_cache
 
-    def save(self, code='', auth_token='', refresh_token=''):
+    def save(self, code='', auth_token='', refresh_token='', expires_at=None):
+        version = self.redis.incr(self.version_key)
         token_data = {
             'code': code,
             'token': auth_token,
-            'refresh_token': refresh_token
+            'refresh_token': refresh_token,
+            'expires_at': expires_at,
+            'version': version
         }
 
         logger.info(f"Saving tokens in REDIS key: {self.token_key}")
         self.redis.save(self.token_key, token_data)
+        self.redis.publish(self.channel, version)
+        return version
 
     def read(self):
         token_data = self.redis.load(self.token_key)
         logger.info(f"Read tokens from REDIS key: {self.token_key}")
         return token_data['code'], token_data['token'], token_data['refresh_token']
 
+    def read_all(self):
+        """ tokens, expiry and version from a single read, so they always
+        belong to the same save """
+        token_data = self.redis.load(self.token_key)
+        token_data.setdefault('expires_at', None)
+        token_data.setdefault('version', 0)
+        return token_data
+
+    def read_expiry(self):
+        # epoch timestamp, None when tokens were saved without expiry
+        return self.read_all()['expires_at']
+
+    def read_version(self):
+        return self.read_all()['version']
+
+    def subscribe(self, callback):
+        """ callback(version) is called whenever any worker saved tokens """
+        if not self.redis:
+            return None
+
+        return self.redis.subscribe(
+            self.channel,
+            lambda version: callback(int(version))
+        )
+
+    def refresh_lock(self):
+        if not self.redis:
+            # nothing to share with other workers
+            return threading.Lock()
+
+        # lock expires by itself if the worker holding it dies
+        return self.redis.lock(
+            self.refresh_lock_key,
+            timeout=self.refresh_timeout,
+            blocking_timeout=self.refresh_timeout + 5
+        )
+
     def reset(self):
         if self.redis:
             self.redis.delete(self.token_key)
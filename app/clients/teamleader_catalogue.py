@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   app/clients/teamleader_catalogue.py
+#
+#   TeamleaderCatalogue holds all custom field definitions and business types
+#   indexed in memory: definitions by id and select options as sets.
+#   load_catalogue walks all pages of customFieldDefinitions.list and
+#   businessTypes.list once. A snapshot is stored in redis so that cold starts
+#   and extra replicas can skip fetching it again.
+#
+
+import time
+
+
+class TeamleaderCatalogue:
+    def __init__(self, custom_fields, business_types, loaded_at=None):
+        self.custom_fields = custom_fields
+        self.business_types = business_types
+        self.loaded_at = loaded_at or time.time()
+
+        self.definitions = {f['id']: f for f in custom_fields}
+        self.field_options = {
+            f['id']: set((f.get('configuration') or {}).get('options') or [])
+            for f in custom_fields
+        }
+        self.business_type_ids = {bt['id'] for bt in business_types}
+
+    def __len__(self):
+        return len(self.custom_fields)
+
+    def definition(self, field_id):
+        return self.definitions.get(field_id)
+
+    def options(self, field_id):
+        return self.field_options.get(field_id, set())
+
+    def business_type_names(self, country='BE'):
+        """ maps lowercase names of business types to their id,
+        'BV/SRL' results in entries for 'bv/srl', 'bv' and 'srl'
+        """
+        names = {}
+        for bt in self.business_types:
+            if country and bt.get('country') != country:
+                continue
+
+            name = bt['name'].lower()
+            names[name] = bt['id']
+            for part in name.split('/'):
+                names.setdefault(part.strip(), bt['id'])
+
+        return names
+
+    def to_dict(self):
+        return {
+            'custom_fields': self.custom_fields,
+            'business_types': self.business_types,
+            'loaded_at': self.loaded_at
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data['custom_fields'],
+            data['business_types'],
+            data['loaded_at']
+        )
+
+
+def read_all_pages(list_method, page_size=50):
+    items = []
+    page = 1
+    while True:
+        page_items = list_method(page=page, page_size=page_size)
+        items.extend(page_items)
+        if len(page_items) < page_size:
+            return items
+        page += 1
+
+
+def load_catalogue(tlc):
+    return TeamleaderCatalogue(
+        read_all_pages(tlc.list_custom_fields),
+        read_all_pages(tlc.list_business_types)
+    )
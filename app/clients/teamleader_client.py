@@ -16,22 +16,85 @@
 #   This links needs to be pasted into a browser and will result in a
 #   code response that allows us to refetch a valid refresh_token from scratch using a new
 #   issued secret.
+#   The token expiry is stored as well, renew_token_if_expiring is called by a
+#   scheduler job to refresh the token before it expires.
+#   Tokens are kept in memory, when another worker saves new tokens we get
+#   notified through redis pub/sub and swap to them right away.
+#
+#   migrate.id results never change, they are cached permanently in a redis hash.
+#
+#   Every api call is recorded per endpoint in app/comm/metrics.py (latency,
+#   status codes, retries and time spent waiting on the rate limiters).
+#
+#   All calls go through a pooled keep-alive requests session, this avoids a new
+#   TCP+TLS handshake on every Teamleader call. Set keep_alive to false in
+#   the teamleader config to fall back to a new connection per request.
+#   cassette_mode record or replay mounts a cassette adapter on that session
+#   to record Teamleader traffic or replay it offline, see cassette.py
+#
+#   Requests are throttled by a read and a write RateLimiter whose state is
+#   shared in redis, so all workers use one Teamleader budget.
+#   429 and 5xx responses are retried with backoff, see retry_policy.py
+#   When update_company gets the original company only changed fields are
+#   sent, and nothing at all when no field changed, see company_update.py
+#   Every call has a connect_timeout and a read_timeout, so a slow or hung
+#   Teamleader raises requests.Timeout instead of blocking a handler thread.
+#   Server errors, connection failures and timeouts feed a CircuitBreaker, while it is
+#   open calls raise TeamleaderUnavailableError without reaching Teamleader
+#   and the scheduler parks incoming events, see circuit_breaker.py
 #
 
+import functools
 import requests
 import time
 import json
+import threading
 import urllib.parse
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from redis.exceptions import LockNotOwnedError, RedisError
+from requests.adapters import HTTPAdapter
 from app.clients.teamleader_auth import TeamleaderAuth
+from app.clients.circuit_breaker import CircuitBreaker, TeamleaderUnavailableError
+from app.clients.cassette import RecordingAdapter, ReplayAdapter
+from app.clients.company_update import plan_company_update
 from app.clients.redis_cache import RedisCache
+from app.clients.rate_limiter import RateLimiter
+from app.clients.retry_policy import RetryPolicy
+from app.comm.metrics import metrics
 from viaa.configuration import ConfigParser
 from viaa.observability import logging
 
 config = ConfigParser()
 logger = logging.get_logger(__name__, config=config)
 
+REQUEST_SECONDS = metrics.histogram(
+    'teamleader_request_duration_seconds',
+    'Duration of Teamleader api calls, without rate limit waits',
+    ('method', 'endpoint')
+)
+RESPONSES = metrics.counter(
+    'teamleader_responses_total',
+    'Teamleader api responses by status code',
+    ('method', 'endpoint', 'status')
+)
+RETRIES = metrics.counter(
+    'teamleader_retries_total',
+    'Teamleader api calls retried after a 429 or 5xx response',
+    ('endpoint', 'status')
+)
+MIGRATE_LOOKUPS = metrics.counter(
+    'teamleader_migrate_lookups_total',
+    'migrate.id lookups answered from the redis cache (hit) or the api (miss)',
+    ('result',)
+)
+RATE_LIMIT_SECONDS = metrics.counter(
+    'teamleader_rate_limit_wait_seconds_total',
+    'Seconds spent waiting on the read and write rate limiters',
+    ('budget',)
+)
+
 
 class TeamleaderAuthError(Exception):
     """Raised when authentication fails"""
@@ -44,8 +107,22 @@ class TeamleaderClient:
     def __init__(self, app_config: dict, redis_cache: RedisCache = None):
         params = app_config['teamleader']
 
-        # Avoid getting 429 Too Many Requests error
+        # Avoid getting 429 Too Many Requests error, default seconds between
+        # calls for the read and write budgets. Setting this to 0 disables
+        # throttling (used for fast tests).
         self.RATE_LIMIT = 0.4
+        self.read_limiter = RateLimiter(
+            'skryv_tl_rate_read',
+            params.get('read_rate_limit', self.RATE_LIMIT),
+            params.get('read_rate_burst', 1),
+            redis_cache
+        )
+        self.write_limiter = RateLimiter(
+            'skryv_tl_rate_write',
+            params.get('write_rate_limit', self.RATE_LIMIT),
+            params.get('write_rate_burst', 1),
+            redis_cache
+        )
 
         self.auth_uri = params['auth_uri']
         self.api_uri = params['api_uri']
@@ -57,15 +134,138 @@ class TeamleaderClient:
         self.redirect_uri = self.secure_route(params['redirect_uri'])
         self.redirect_uri_base = params['redirect_uri']
 
+        self.http = self.create_session(params)
+        self.timeout = (
+            float(params.get('connect_timeout', 5)),
+            float(params.get('read_timeout', 30))
+        )
+        self.retry_policy = RetryPolicy(params)
+        self.circuit_breaker = CircuitBreaker(
+            int(params.get('circuit_failure_threshold', 5)),
+            float(params.get('circuit_reset_timeout', 30))
+        )
+        self.refresh_lock = threading.Lock()
+        self.token_refreshes = {'refreshed': 0, 'collisions_avoided': 0}
+        self.contacts_concurrency = int(params.get('contacts_concurrency', 4))
+        self.migrate_warm_concurrency = int(params.get('migrate_warm_concurrency', 4))
+        self.company_writes = {'sent': 0, 'avoided': 0, 'fields_skipped': 0}
+        self.event = threading.local()      # stats of the event in this thread
+        self.event_lock = threading.Lock()
+        self.token_renew_margin = int(params.get('token_renew_margin', 300))
+        self.redis = redis_cache
+        self.migrate_key = 'skryv_tl_migrate_ids'
         self.token_store = TeamleaderAuth(params, redis_cache)
 
         if not self.token_store.tokens_available():
             self.code = params['code']
             self.token = params['auth_token']
             self.refresh_token = params['refresh_token']
-            self.token_store.save(self.code, self.token, self.refresh_token)
+            self.expires_at = None
+            self.token_version = self.token_store.save(
+                self.code, self.token, self.refresh_token
+            )
         else:
-            self.code, self.token, self.refresh_token = self.token_store.read()
+            self.load_tokens()
+
+        self.token_subscription = None
+        if params.get('token_pubsub', True):
+            self.token_subscription = self.token_store.subscribe(
+                self.tokens_updated
+            )
+
+    def load_tokens(self):
+        token_data = self.token_store.read_all()
+        logger.info(f"Read tokens version {token_data['version']} from redis")
+        self.code = token_data['code']
+        self.token = token_data['token']
+        self.refresh_token = token_data['refresh_token']
+        self.expires_at = token_data['expires_at']
+        self.token_version = token_data['version']
+
+    def tokens_updated(self, version):
+        """ called from the redis subscriber thread whenever a worker
+        (including ourselves) saved new tokens """
+        if version <= self.token_version:
+            return
+
+        self.load_tokens()
+        logger.info(f"Switched to teamleader tokens version {self.token_version}")
+
+    def create_session(self, params):
+        """ keep-alive session with a connection pool per host, pool_connections
+        is the number of hosts we keep pools for and pool_maxsize the number of
+        connections kept open per host. With pool_block enabled pool_maxsize is
+        also a hard limit on concurrent connections per host.
+        """
+        cassette_mode = params.get('cassette_mode') or 'off'
+        if not params.get('keep_alive', True) and cassette_mode == 'off':
+            # plain requests module, opens a new connection on every call
+            return requests
+
+        pool_params = {
+            'pool_connections': int(params.get('pool_connections', 2)),
+            'pool_maxsize': int(params.get('pool_maxsize', 10)),
+            'pool_block': bool(params.get('pool_block', False))
+        }
+        if cassette_mode == 'record':
+            logger.info(f"recording teamleader calls in {params['cassette_file']}")
+            adapter = RecordingAdapter(params['cassette_file'], **pool_params)
+        elif cassette_mode == 'replay':
+            logger.info(f"replaying teamleader calls from {params['cassette_file']}")
+            adapter = ReplayAdapter(
+                params['cassette_file'],
+                float(params.get('cassette_time_scale', 1.0)),
+                **pool_params
+            )
+        else:
+            adapter = HTTPAdapter(**pool_params)
+
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+        return session
+
+    def connection_stats(self):
+        """ connections opened versus requests sent through our pools,
+        every reused connection is a TCP+TLS handshake we did not need to do
+        """
+        opened = 0
+        sent = 0
+        # with keep_alive disabled self.http is the requests module
+        adapters = self.http.adapters if isinstance(self.http, requests.Session) else {}
+        for adapter in set(adapters.values()):
+            pools = adapter.poolmanager.pools
+            for pool_key in pools.keys():
+                pool = pools[pool_key]
+                opened += pool.num_connections
+                sent += pool.num_requests
+
+        return {
+            'connections': opened,
+            'requests': sent,
+            'reused': sent - opened
+        }
+
+    def rate_limit(self, limiter, budget):
+        start = time.monotonic()
+        self.retry_policy.wait_for_reset()
+        if self.RATE_LIMIT > 0:
+            limiter.acquire()
+        RATE_LIMIT_SECONDS.inc(time.monotonic() - start, budget=budget)
+
+    def rate_limit_stats(self):
+        return {
+            'read': self.read_limiter.stats(),
+            'write': self.write_limiter.stats()
+        }
+
+    def close(self):
+        if self.token_subscription:
+            self.token_subscription.stop()
+
+        if self.http is not requests:
+            self.http.close()
 
     def oauth_check(self):
         try:
@@ -118,8 +318,7 @@ class TeamleaderClient:
             'redirect_uri': self.redirect_uri,
             'grant_type': 'authorization_code'
         }
-        r = requests.post(req_uri, data=req_params)
-        time.sleep(self.RATE_LIMIT)
+        r = self.http.post(req_uri, data=req_params, timeout=self.timeout)
         self.handle_token_response(r)
 
     def handle_token_response(self, token_response):
@@ -127,7 +326,14 @@ class TeamleaderClient:
             response = token_response.json()
             self.token = response['access_token']  # expires in 1 hour
             self.refresh_token = response['refresh_token']
-            self.token_store.save(self.code, self.token, self.refresh_token)
+            expires_in = response.get('expires_in')
+            self.expires_at = time.time() + expires_in if expires_in else None
+            self.token_version = self.token_store.save(
+                self.code,
+                self.token,
+                self.refresh_token,
+                self.expires_at
+            )
         else:
             raise TeamleaderAuthError(token_response.text)
 
@@ -153,7 +359,7 @@ class TeamleaderClient:
 
     def auth_token_refresh(self):
         """ to be called whenever we get 401 from expiry on api calls """
-        r = requests.post(
+        r = self.http.post(
             self.auth_uri + '/oauth2/access_token',
             data={
                 'refresh_token': self.refresh_token,
@@ -161,28 +367,208 @@ class TeamleaderClient:
                 'client_secret': self.client_secret,
                 'redirect_uri': self.redirect_uri,
                 'grant_type': 'refresh_token'
-            }
+            },
+            timeout=self.timeout
         )
-        time.sleep(self.RATE_LIMIT)
         self.handle_token_response(r)
 
-    def request_endpoint(self, resource_path, params={}, headers={}):
+    def refresh_expired_token(self, expired_authorization):
+        """ concurrent calls can all get a 401 on the same expired token,
+        only the first one refreshes and the others reuse the new token.
+        The redis lock does the same for calls in other workers, a second
+        refresh would invalidate the refresh token we just received.
+        """
+        with self.refresh_lock:
+            if expired_authorization != "Bearer {}".format(self.token):
+                self.token_refreshes['collisions_avoided'] += 1
+                return
+
+            lock = self.token_store.refresh_lock()
+            if not lock.acquire():
+                # another worker holds the lock for too long, refreshing
+                # without it could spend the refresh token a second time
+                logger.warning("Timeout waiting for token refresh lock")
+                self.use_stored_tokens()
+                return
+
+            try:
+                self.refresh_token_once()
+            finally:
+                try:
+                    lock.release()
+                except LockNotOwnedError:
+                    # refresh took longer than token_refresh_timeout
+                    logger.warning("Token refresh lock expired before it was released")
+
+    def use_stored_tokens(self):
+        """ switch to tokens refreshed by another worker, True when they
+        differ from the tokens we have """
+        if not self.token_store.tokens_available():
+            return False
+
+        expired_token = self.token
+        self.load_tokens()
+        if self.token == expired_token:
+            return False
+
+        self.token_refreshes['collisions_avoided'] += 1
+        logger.info("Using tokens refreshed by another worker")
+        return True
+
+    def refresh_token_once(self):
+        # another worker may have refreshed while we waited for the lock
+        if self.use_stored_tokens():
+            return
+
+        self.auth_token_refresh()
+        self.token_refreshes['refreshed'] += 1
+
+    def renew_token_if_expiring(self):
+        """ called by a scheduler job, refreshes the token token_renew_margin
+        seconds before it expires so webhook calls don't wait on a refresh.
+        Returns True when the token was renewed.
+        """
+        if self.expires_at is None:
+            # expiry unknown until our first refresh
+            return False
+
+        if self.expires_at - time.time() > self.token_renew_margin:
+            return False
+
+        logger.info("Renewing teamleader token before it expires")
+        self.refresh_expired_token("Bearer {}".format(self.token))
+        return True
+
+    def token_refresh_stats(self):
+        return dict(self.token_refreshes)
+
+    def record_response(self, method, path, start, res):
+        endpoint = path[len(self.api_uri):]
+        REQUEST_SECONDS.observe(
+            time.monotonic() - start,
+            method=method,
+            endpoint=endpoint
+        )
+        RESPONSES.inc(method=method, endpoint=endpoint, status=res.status_code)
+        self.count_event('requests')
+        return res
+
+    def api_get(self, path, params, headers):
+        self.rate_limit(self.read_limiter, 'read')
+        start = time.monotonic()
+        res = self.http.get(path, params=params, headers=headers, timeout=self.timeout)
+        return self.record_response('GET', path, start, res)
+
+    def api_post(self, path, payload, headers):
+        self.rate_limit(self.write_limiter, 'write')
+        headers['Content-type'] = 'application/json'
+        start = time.monotonic()
+        res = self.http.post(path, data=json.dumps(payload), headers=headers, timeout=self.timeout)
+        return self.record_response('POST', path, start, res)
+
+    def api_request(self, method, resource_path, params=None, payload=None):
+        """ send a GET or POST to the api, on 401 we refresh our tokens once
+        and 429 or 5xx responses are retried following our retry_policy
+        """
         path = self.api_uri + resource_path
-        headers['Authorization'] = "Bearer {}".format(self.token)
-        res = requests.get(path, params=params, headers=headers)
+        token_refreshed = False
+        attempt = 0
+        while True:
+            if not self.circuit_breaker.allow_request():
+                raise TeamleaderUnavailableError(
+                    f"{method} {path} not sent, Teamleader circuit is open"
+                )
 
-        if res.status_code == 401:
-            self.auth_token_refresh()
             headers = {'Authorization': "Bearer {}".format(self.token)}
-            res = requests.get(path, params=params, headers=headers)
+            try:
+                if method == 'GET':
+                    res = self.api_get(path, params, headers)
+                else:
+                    res = self.api_post(path, payload, headers)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.circuit_breaker.record_failure()
+                raise TeamleaderUnavailableError(
+                    f"{method} {path} failed: {e}"
+                ) from e
+            except Exception:
+                # also ends a half open probe, otherwise the circuit stays half open
+                self.circuit_breaker.record_failure()
+                raise
+
+            if res.status_code >= 500:
+                self.circuit_breaker.record_failure()
+            else:
+                self.circuit_breaker.record_success()
+
+            if res.status_code == 401 and not token_refreshed:
+                self.refresh_expired_token(headers['Authorization'])
+                token_refreshed = True
+                continue
+
+            delay = self.retry_policy.retry_delay(
+                method, resource_path, res, attempt
+            )
+            if delay is None:
+                return res
+
+            logger.warning(
+                f"{method} {path} responded {res.status_code}, retry in {delay:.1f} seconds"
+            )
+            RETRIES.inc(endpoint=resource_path, status=res.status_code)
+            attempt += 1
+            time.sleep(delay)
+
+    def reset_retry_budget(self):
+        self.retry_policy.reset_budget()
+
+    def start_event(self):
+        """ called by the thread handling a webhook event, the retry budget
+        and event_stats are kept per thread so concurrent events don't mix """
+        self.reset_retry_budget()
+        self.event.stats = {'requests': 0, 'sent': 0, 'avoided': 0, 'fields_skipped': 0}
+
+    def in_event(self, function):
+        """ wraps function to count its calls in the event stats and retry
+        budget of the calling thread, for calls handed to our thread pools """
+        stats = getattr(self.event, 'stats', None)
+        budget = self.retry_policy.event_budget()
+
+        def call(*args, **kwargs):
+            self.event.stats = stats
+            self.retry_policy.use_budget(budget)
+            return function(*args, **kwargs)
 
-        time.sleep(self.RATE_LIMIT)
+        return call
+
+    def count_event(self, name, count=1):
+        stats = getattr(self.event, 'stats', None)
+        if stats is not None:
+            # pool threads of the event count in the same stats
+            with self.event_lock:
+                stats[name] += count
+
+    def event_stats(self):
+        """ teamleader requests and company writes of the current event """
+        return dict(getattr(self.event, 'stats', {}))
+
+    def retry_stats(self):
+        return self.retry_policy.stats()
+
+    def available(self):
+        """ False while the circuit breaker is open """
+        return self.circuit_breaker.available()
+
+    def circuit_breaker_stats(self):
+        return self.circuit_breaker.stats()
+
+    def request_endpoint(self, resource_path, params={}):
+        res = self.api_request('GET', resource_path, params=params)
 
         if res.status_code == 200:
             return res.json()['data']
         else:
             error_msg = 'GET {} failed:\n status={}\n response={}\n params={}\n'.format(
-                path,
+                self.api_uri + resource_path,
                 res.status_code,
                 res.text,
                 params
@@ -209,17 +595,10 @@ class TeamleaderClient:
 
     def request_item(self, resource_path, resource_id):
         path = self.api_uri + resource_path
-        headers = {'Authorization': "Bearer {}".format(self.token)}
         params = {}
         params['id'] = resource_id
 
-        res = requests.get(path, params=params, headers=headers)
-        if res.status_code == 401:
-            self.auth_token_refresh()
-            headers = {'Authorization': "Bearer {}".format(self.token)}
-            res = requests.get(path, params=params, headers=headers)
-
-        time.sleep(self.RATE_LIMIT)
+        res = self.api_request('GET', resource_path, params=params)
 
         if res.status_code == 200:
             return res.json()['data']
@@ -236,22 +615,7 @@ class TeamleaderClient:
 
     def post_item(self, resource_path, payload):
         path = self.api_uri + resource_path
-        headers = {
-            'Authorization': "Bearer {}".format(self.token),
-            'Content-type': 'application/json'
-        }
-
-        res = requests.post(path, data=json.dumps(payload), headers=headers)
-        if res.status_code == 401:
-            self.auth_token_refresh()
-            headers = {
-                'Authorization': "Bearer {}".format(self.token),
-                'Content-type': 'application/json'
-            }
-            res = requests.post(
-                path, data=json.dumps(payload), headers=headers)
-
-        time.sleep(self.RATE_LIMIT)
+        res = self.api_request('POST', resource_path, payload=payload)
 
         if res.status_code == 200 or res.status_code == 201:
             return res.json()['data']
@@ -266,6 +630,10 @@ class TeamleaderClient:
             raise ValueError(error_msg)
 
     def prepare_custom_fields(self, resource):
+        if 'custom_fields' not in resource:
+            # partial update without custom field changes
+            return resource
+
         custom_fields = resource['custom_fields']
         update_fields = []
         for f in custom_fields:
@@ -289,16 +657,84 @@ class TeamleaderClient:
             updated_since
         )
 
+    def iterate_pages(self, list_page, page_size=20):
+        """ generator over the items of all pages of a list call, list_page is
+        called with page and page_size. The next page is fetched in the background
+        while the current one is consumed, so at most two pages are held in memory.
+        When the consumer stops early we stop fetching pages.
+        """
+        list_page = self.in_event(list_page)
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            page = 1
+            next_page = pool.submit(list_page, page, page_size)
+            while next_page:
+                items = next_page.result()
+                next_page = None
+                if len(items) >= page_size:
+                    page += 1
+                    next_page = pool.submit(list_page, page, page_size)
+
+                for item in items:
+                    yield item
+
+    def iter_companies(self, updated_since: datetime = None, page_size=50):
+        return self.iterate_pages(
+            functools.partial(
+                self.list_companies, updated_since=updated_since
+            ),
+            page_size
+        )
+
+    def iter_contacts(self, updated_since: datetime = None, page_size=50):
+        return self.iterate_pages(
+            functools.partial(
+                self.list_contacts, updated_since=updated_since
+            ),
+            page_size
+        )
+
+    def iter_linked_contacts(self, company_id, page_size=20):
+        return self.iterate_pages(
+            functools.partial(self.linked_contacts, company_id),
+            page_size
+        )
+
+    def iter_custom_fields(self, page_size=50):
+        return self.iterate_pages(self.list_custom_fields, page_size)
+
     def get_company(self, uid):
         return self.request_item('/companies.info', uid)
 
-    def update_company(self, company):
+    def update_company(self, company, original=None):
+        """ original is the company as returned by get_company, when given
+        we only send the fields that changed and skip the request entirely
+        when nothing changed (returns None in that case)
+        """
+        if original is not None:
+            company_id = company['id']
+            company, unchanged = plan_company_update(original, company)
+            self.count_write('fields_skipped', unchanged)
+            if company is None:
+                self.count_write('avoided')
+                logger.info(
+                    f"company {company_id} unchanged, skipped companies.update"
+                )
+                return None
+
         if 'payment_term' in company and company['payment_term'] is None:
             del company['payment_term']
 
         company = self.prepare_custom_fields(company)
+        self.count_write('sent')
         return self.post_item('/companies.update', company)
 
+    def count_write(self, name, count=1):
+        self.company_writes[name] += count
+        self.count_event(name, count)
+
+    def company_write_stats(self):
+        return dict(self.company_writes)
+
     def list_contacts(self, page=1, page_size=20, updated_since: datetime = None):
         return self.request_page(
             '/contacts.list',
@@ -315,20 +751,18 @@ class TeamleaderClient:
         return self.request_endpoint('/contacts.list', params)
 
     def company_contacts(self, company_id):
-        # get all linked contact details by iterating pages
-        contacts = []
-        page_size = 20
-        page = 1
-        while True:
-            lc = self.linked_contacts(company_id, page, page_size)
-            page += 1
-            for c in lc:
-                contacts.append(self.get_contact(c['id']))
-
-            if len(lc) < page_size:
-                break
+        """ get all linked contact details by iterating pages. The contacts.info
+        calls run concurrently (bounded by contacts_concurrency and throttled by
+        the shared read limiter) while the next page is already being fetched.
+        """
+        get_contact = self.in_event(self.get_contact)
+        with ThreadPoolExecutor(max_workers=self.contacts_concurrency) as pool:
+            contact_calls = [
+                pool.submit(get_contact, c['id'])
+                for c in self.iter_linked_contacts(company_id)
+            ]
 
-        return contacts
+        return [call.result() for call in contact_calls]
 
     def get_contact(self, uid):
         return self.request_item('/contacts.info', uid)
@@ -372,24 +806,80 @@ class TeamleaderClient:
         else:
             return url
 
+    def cached_migrate_uuid(self, resource_type, old_external_id):
+        if not self.redis:
+            return None
+
+        try:
+            uuid = self.redis.hget(
+                self.migrate_key, f"{resource_type}:{old_external_id}"
+            )
+            return uuid.decode() if uuid else None
+        except RedisError as e:
+            logger.warning(f"migrate.id cache lookup failed: {e}")
+            return None
+
+    def save_migrate_uuid(self, resource_type, old_external_id, uuid):
+        if not self.redis:
+            return
+
+        try:
+            self.redis.hset(
+                self.migrate_key, f"{resource_type}:{old_external_id}", uuid
+            )
+        except RedisError as e:
+            logger.warning(f"migrate.id cache save failed: {e}")
+
+    def warm_migrate_uuid(self, resource_type, old_external_id):
+        """ None when the lookup failed, the other ids are still resolved """
+        try:
+            return self.get_migrate_uuid(resource_type, old_external_id)
+        except (TeamleaderUnavailableError, TeamleaderAuthError, ValueError,
+                requests.RequestException) as e:
+            logger.warning(f"migrate.id warm up of {resource_type} {old_external_id} failed: {e}")
+            return None
+
+    def warm_migrate_uuids(self, resource_type, old_external_ids):
+        """ resolves legacy ids that are not cached yet, concurrently (up to
+        migrate_warm_concurrency) and throttled by the shared read limiter """
+        old_ids = list(dict.fromkeys(old_external_ids))
+        missing = [
+            old_id for old_id in old_ids
+            if not self.cached_migrate_uuid(resource_type, old_id)
+        ]
+
+        with ThreadPoolExecutor(max_workers=self.migrate_warm_concurrency) as pool:
+            uuids = list(pool.map(
+                functools.partial(self.warm_migrate_uuid, resource_type),
+                missing
+            ))
+
+        failed = [old_id for old_id, uuid in zip(missing, uuids) if not uuid]
+        return {
+            'cached': len(old_ids) - len(missing),
+            'resolved': len(missing) - len(failed),
+            'failed': failed
+        }
+
     def get_migrate_uuid(self, resource_type, old_external_id):
         """resource_type == 'company', 'contact', ..."""
+        cached_uuid = self.cached_migrate_uuid(resource_type, old_external_id)
+        if cached_uuid:
+            MIGRATE_LOOKUPS.inc(result='hit')
+            return cached_uuid
+
+        MIGRATE_LOOKUPS.inc(result='miss')
         path = self.api_uri + '/migrate.id'
-        headers = {'Authorization': "Bearer {}".format(self.token)}
         params = {}
         params['id'] = old_external_id
         params['type'] = resource_type  # 'contact', 'company'
 
-        res = requests.get(path, params=params, headers=headers)
-        if res.status_code == 401:
-            self.auth_token_refresh()
-            headers = {'Authorization': "Bearer {}".format(self.token)}
-            res = requests.get(path, params=params, headers=headers)
-
-        time.sleep(self.RATE_LIMIT)
+        res = self.api_request('GET', '/migrate.id', params=params)
 
         if res.status_code == 200:
-            return res.json()['data']['id']
+            uuid = res.json()['data']['id']
+            self.save_migrate_uuid(resource_type, old_external_id, uuid)
+            return uuid
         else:
             logger.error('call to {} failed\n error code={}\n error response {}\n used params {}\n'.format(
                 path,
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   app/comm/idempotency.py
+#
+#   Skryv retries webhook deliveries, so the same process or milestone event
+#   can arrive several times. DeliveryKeys derives a key from the dossier,
+#   event type, action, milestone/process id and timestamp and stores it in
+#   redis with a ttl. Only the first delivery of a key is scheduled, the
+#   duplicates are acknowledged to Skryv and dropped.
+#
+
+from redis.exceptions import RedisError
+from viaa.configuration import ConfigParser
+from viaa.observability import logging
+
+from app.comm.metrics import metrics
+
+config = ConfigParser()
+logger = logging.get_logger(__name__, config=config)
+
+DUPLICATES = metrics.counter(
+    'skryv_webhook_duplicates_total',
+    'Duplicate Skryv webhook deliveries that were dropped',
+    ('event',)
+)
+
+
+def delivery_key(webhook, params):
+    """ identifies one Skryv event, retried deliveries get the same key """
+    if webhook == 'process_event':
+        event_id = params.process.id
+        timestamp = params.dossier.updatedAt
+    elif webhook == 'milestone_event':
+        event_id = params.milestone.id
+        timestamp = params.milestone.timestamp
+    else:
+        event_id = f'{params.document.id}:{params.document.version}'
+        timestamp = params.dossier.updatedAt
+
+    stamp = timestamp.isoformat() if timestamp else ''
+    return f'{params.dossier.id}:{webhook}:{params.action}:{event_id}:{stamp}'
+
+
+class DeliveryKeys:
+    def __init__(self, redis_cache, ttl=86400, prefix='skryv_delivery'):
+        self.redis = redis_cache
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def first_delivery(self, webhook, params):
+        """ True the first time an event is seen within ttl seconds,
+        when redis is unavailable every delivery is handled """
+        try:
+            first = self.redis.set_if_absent(
+                self.key(webhook, params), 1, self.ttl
+            )
+        except RedisError as e:
+            logger.error(f"unable to check webhook delivery key: {e}")
+            return True
+
+        if not first:
+            DUPLICATES.inc(event=webhook)
+            logger.info(
+                f"dropping duplicate {webhook} delivery for dossier {params.dossier.id}"
+            )
+        return first
+
+    def forget(self, webhook, params):
+        """ removes the key so a retry of an event we failed to queue is
+        accepted again """
+        try:
+            self.redis.delete(self.key(webhook, params))
+        except RedisError as e:
+            logger.error(f"unable to remove webhook delivery key: {e}")
+
+    def key(self, webhook, params):
+        return f'{self.prefix}:{delivery_key(webhook, params)}'
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   app/comm/keyed_executor.py
+#
+#   KeyedExecutor runs coroutines partitioned by a key. Coroutines with the
+#   same key run one after the other in submit order, different keys run
+#   concurrently up to max_concurrency. The WebhookScheduler uses the
+#   content partner (or dossier) as key so the events of one dossier stay
+#   ordered while unrelated content partners do not wait on each other.
+#   submit waits when max_pending coroutines are queued or running, so we
+#   only take events from the queue as fast as they are handled.
+#
+
+import asyncio
+
+
+class KeyedExecutor:
+    def __init__(self, max_concurrency=4, max_pending=None):
+        self.max_concurrency = max_concurrency
+        self.running = asyncio.Semaphore(max_concurrency)
+        self.pending = asyncio.Semaphore(max_pending or 4 * max_concurrency)
+        self.tails = {}     # last submitted task per key
+        self.tasks = set()
+
+    async def submit(self, key, coroutine_function):
+        """ schedules coroutine_function() after the earlier ones with the
+        same key, a key of None has no ordering constraint """
+        await self.pending.acquire()
+        previous = self.tails.get(key) if key is not None else None
+        task = asyncio.ensure_future(self.run_after(previous, coroutine_function))
+        self.tasks.add(task)
+        if key is not None:
+            self.tails[key] = task
+        task.add_done_callback(lambda done: self.task_done(key, done))
+        return task
+
+    async def run_after(self, previous, coroutine_function):
+        if previous is not None:
+            # the outcome of the previous event does not matter, only its order
+            await asyncio.wait([previous])
+
+        async with self.running:
+            return await coroutine_function()
+
+    def task_done(self, key, task):
+        self.tasks.discard(task)
+        if self.tails.get(key) is task:
+            del self.tails[key]
+        self.pending.release()
+
+    async def join(self):
+        """ waits until every submitted coroutine is done """
+        while self.tasks:
+            await asyncio.wait(list(self.tasks))
+
+    def stats(self):
+        return {
+            'partitions': len(self.tails),
+            'pending': len(self.tasks)
+        }
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   app/comm/metrics.py
+#
+#   Small in-process metrics registry rendered in the prometheus text format
+#   on the /metrics route. Counters and histograms are updated while handling
+#   webhooks, collectors are called on every scrape to copy the stats kept by
+#   our clients (rate limiters, retries, caches) into gauges.
+#   The timed decorator records latency and errors of LDAP, Redis and Slack calls.
+#
+
+import functools
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def format_labels(label_names, label_values, extra=''):
+    pairs = [
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in zip(label_names, label_values)
+    ]
+    if extra:
+        pairs.append(extra)
+
+    if not pairs:
+        return ''
+
+    return '{' + ','.join(pairs) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    metric_type = 'untyped'
+
+    def __init__(self, name, description, label_names=()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def label_key(self, labels):
+        return tuple(labels.get(name, '') for name in self.label_names)
+
+    def header(self):
+        return [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.metric_type}"
+        ]
+
+
+class Counter(Metric):
+    metric_type = 'counter'
+
+    def inc(self, value=1, **labels):
+        key = self.label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def get(self, **labels):
+        return self.values.get(self.label_key(labels), 0)
+
+    def render(self):
+        lines = self.header()
+        for key, value in sorted(self.values.items()):
+            lines.append('{}{} {}'.format(
+                self.name,
+                format_labels(self.label_names, key),
+                format_value(value)
+            ))
+        return lines
+
+
+class Gauge(Counter):
+    metric_type = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.label_key(labels)] = value
+
+
+class Histogram(Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, description, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, label_names)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self.label_key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value)
+
+    def count(self, **labels):
+        entry = self.values.get(self.label_key(labels))
+        return entry[0][-1] if entry else 0
+
+    def render(self):
+        lines = self.header()
+        for key, (counts, total) in sorted(self.values.items()):
+            for bound, count in zip(self.buckets, counts):
+                lines.append('{}_bucket{} {}'.format(
+                    self.name,
+                    format_labels(
+                        self.label_names, key,
+                        'le="{}"'.format(format_value(bound))
+                    ),
+                    count
+                ))
+            labels = format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {counts[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+
+    def register(self, metric):
+        # same name returns the existing metric, modules can be reloaded in tests
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, description, label_names=()):
+        return self.register(Counter(name, description, label_names))
+
+    def gauge(self, name, description, label_names=()):
+        return self.register(Gauge(name, description, label_names))
+
+    def histogram(self, name, description, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, description, label_names, buckets))
+
+    def add_collector(self, collector):
+        """ collector() is called before rendering to update gauges """
+        self.collectors.append(collector)
+
+    def render(self):
+        for collector in self.collectors:
+            collector()
+
+        lines = []
+        for name in sorted(self.metrics):
+            lines.extend(self.metrics[name].render())
+
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+
+EXTERNAL_CALL_SECONDS = metrics.histogram(
+    'skryv_external_call_duration_seconds',
+    'Duration of LDAP, Redis and Slack calls',
+    ('service', 'operation')
+)
+EXTERNAL_CALL_ERRORS = metrics.counter(
+    'skryv_external_call_errors_total',
+    'LDAP, Redis and Slack calls that raised an exception',
+    ('service', 'operation')
+)
+
+
+def timed(service, operation=None):
+    """ decorator recording latency and errors of a call to an external service """
+    def decorator(method):
+        name = operation or method.__name__
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            start = time.monotonic()
+            try:
+                return method(*args, **kwargs)
+            except Exception:
+                EXTERNAL_CALL_ERRORS.inc(service=service, operation=name)
+                raise
+            finally:
+                EXTERNAL_CALL_SECONDS.observe(
+                    time.monotonic() - start,
+                    service=service,
+                    operation=name
+                )
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   app/comm/parked_events.py
+#
+#   ParkedEvents keeps webhook events in a redis list while Teamleader is
+#   unavailable. Events are stored in arrival order as json and replayed
+#   by the WebhookScheduler once the circuit breaker lets calls through again.
+#
+
+import json
+
+from redis.exceptions import RedisError
+from viaa.configuration import ConfigParser
+from viaa.observability import logging
+
+from app.models.process_body import ProcessBody
+from app.models.milestone_body import MilestoneBody
+from app.models.document_body import DocumentBody
+
+config = ConfigParser()
+logger = logging.get_logger(__name__, config=config)
+
+EVENT_MODELS = {
+    'process_event': ProcessBody,
+    'milestone_event': MilestoneBody,
+    'document_event': DocumentBody
+}
+
+
+def serialize_event(name, params):
+    return json.dumps({'webhook': name, 'params': params.json()})
+
+
+def deserialize_event(data):
+    event = json.loads(data)
+    name = event['webhook']
+    return (name, EVENT_MODELS[name].parse_raw(event['params']))
+
+
+class ParkedEvents:
+    def __init__(self, redis_cache, key='skryv_parked_events'):
+        self.redis = redis_cache
+        self.key = key
+
+    def park(self, name, params):
+        """ append event at the end, returns the number of parked events """
+        return self.redis.rpush(self.key, serialize_event(name, params))
+
+    def park_front(self, name, params):
+        """ put back an event that failed during replay, keeps the order """
+        return self.redis.lpush(self.key, serialize_event(name, params))
+
+    def unpark(self):
+        """ oldest parked event as (name, params) or None """
+        data = self.redis.lpop(self.key)
+        if data is None:
+            return None
+
+        return deserialize_event(data)
+
+    def count(self):
+        try:
+            return self.redis.llen(self.key)
+        except RedisError as e:
+            logger.error(f"unable to count parked events: {e}")
+            return 0
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   app/comm/webhook_queue.py
+#
+#   Queue backends for the WebhookScheduler. MemoryWebhookQueue is the
+#   in-process queue, events are lost on a restart. StreamWebhookQueue keeps
+#   events in redis streams read through a consumer group, so several
+#   workers and pods share one queue:
+#     - events are partitioned over webhook_stream_partitions streams by
+#       content partner (or dossier), each partition is read by the single
+#       worker holding its lease, so events of one dossier never run
+#       concurrently on different workers
+#     - workers send a heartbeat and renew their leases every reclaim, each
+#       worker holds about partitions / live workers partitions. A worker
+#       above its share offers partitions without entries in progress to the
+#       others, a worker below its share takes offered and free partitions
+#     - a partition of a stopped or crashed worker is free once its lease
+#       expired and is taken by any worker, even above its share, so no
+#       partition stays unread
+#     - an entry is acknowledged once its event is handled, parked or failed
+#       (the failure is logged and reported like with the memory queue), so
+#       a failed event never runs again after newer events of its dossier
+#     - entries left pending by a crashed worker are claimed with its
+#       partition, our own entries stay pending only when their ack failed
+#       and are delivered again after claim_idle seconds. Entries are
+#       dropped with an error log once they were delivered max_deliveries
+#       times
+#     - every put is published on a redis channel to wake up all consumers
+#   Select the backend with webhook_queue in the skryv config.
+#   Skryv sends a document event for every save while a form is edited, only
+#   the newest version of a queued document is handled. The memory queue
+#   replaces the queued event, the stream queue keeps the newest version in
+#   redis, handles it at the position of the first entry of the document and
+#   skips the later entries.
+#
+
+import math
+import os
+import queue
+import socket
+import threading
+import zlib
+
+from collections import deque
+from viaa.configuration import ConfigParser
+from viaa.observability import logging
+
+from app.comm.metrics import metrics
+from app.comm.parked_events import serialize_event, deserialize_event
+
+config = ConfigParser()
+logger = logging.get_logger(__name__, config=config)
+
+COALESCED = metrics.counter(
+    'skryv_webhook_coalesced_total',
+    'Document events dropped because a newer version of the document was queued'
+)
+
+
+def partition_key(params):
+    """ events of one content partner, or else of one dossier, stay ordered """
+    dossier = getattr(params, 'dossier', None)
+    if dossier is None:
+        return None
+
+    return dossier.externalId or str(dossier.id)
+
+
+def document_key(webhook, params):
+    """ dossier and document id of a document event, None for other events """
+    if webhook != 'document_event':
+        return None
+
+    return f'{params.dossier.id}:{params.document.id}'
+
+
+class MemoryWebhookQueue:
+    def __init__(self):
+        self.entries = queue.Queue()
+        self.queued_documents = {}
+        self.lock = threading.Lock()
+
+    def put(self, webhook, params):
+        key = document_key(webhook, params)
+        with self.lock:
+            queued = self.queued_documents.get(key)
+            if queued:
+                # newest version replaces the queued event
+                if params.document.version >= queued['params'].document.version:
+                    queued['params'] = params
+                COALESCED.inc()
+                return
+
+            entry = {'id': None, 'webhook': webhook, 'params': params}
+            if key:
+                self.queued_documents[key] = entry
+            self.entries.put(entry)
+
+    def get(self):
+        with self.lock:
+            try:
+                entry = self.entries.get_nowait()
+            except queue.Empty:
+                return None
+
+            self.queued_documents.pop(
+                document_key(entry['webhook'], entry['params']), None
+            )
+            return entry
+
+    def ack(self, entry):
+        pass
+
+    def empty(self):
+        return self.entries.empty()
+
+    def reclaim(self):
+        return 0
+
+    def subscribe(self, callback):
+        return None
+
+    def close(self):
+        pass
+
+
+class StreamWebhookQueue:
+    OFFERED = 'offered'
+
+    def __init__(self, params, redis_cache, consumer=None):
+        self.redis = redis_cache
+        self.stream = params.get('webhook_stream', 'skryv_webhooks')
+        self.group = params.get('webhook_stream_group', 'skryv2teamleader')
+        self.channel = f'{self.stream}_added'
+        self.documents_key = f'{self.stream}_documents'
+        self.handled_key = f'{self.stream}_handled'
+        self.document_ttl = int(params.get('webhook_document_ttl', 86400))
+        self.maxlen = int(params.get('webhook_stream_maxlen', 10000))
+        self.claim_idle_ms = int(params.get('webhook_claim_idle', 300)) * 1000
+        self.max_deliveries = int(params.get('webhook_max_deliveries', 5))
+        self.partitions = int(params.get('webhook_stream_partitions', 8))
+        self.lease_ttl = int(params.get('webhook_partition_lease', 90))
+        self.workers_key = f'{self.stream}_workers'
+        self.streams = [f'{self.stream}:{n}' for n in range(self.partitions)]
+        self.consumer = consumer or f'{socket.gethostname()}-{os.getpid()}'
+        self.owned = []             # partition streams only we read
+        self.next_owned = 0         # owned streams are read round robin
+        self.claimed = deque()      # (stream, entry_id, fields) delivered first
+        self.in_progress = set()    # (stream, entry_id) delivered, not acked
+        # get, ack and reclaim run in executor threads of the scheduler
+        self.lock = threading.Lock()
+        for stream in self.streams:
+            self.redis.xgroup_create(stream, self.group)
+        self.acquire_partitions()
+
+    def partition_stream(self, params):
+        key = partition_key(params) or ''
+        return self.streams[zlib.crc32(key.encode()) % self.partitions]
+
+    def lease_key(self, stream):
+        return f'{stream}_owner'
+
+    def share(self):
+        """ number of partitions we should read, partitions / live workers """
+        workers = self.redis.heartbeat(self.workers_key, self.consumer, self.lease_ttl)
+        return math.ceil(self.partitions / max(workers, 1))
+
+    def busy(self, stream):
+        return any(s == stream for s, entry_id in self.in_progress) or \
+            any(c[0] == stream for c in self.claimed)
+
+    def offer_partitions(self, count):
+        """ offers count partitions to workers below their share, partitions
+        with entries in progress are kept so a dossier never runs on two
+        workers at once """
+        offered = []
+        for stream in reversed(self.owned):
+            if len(offered) >= count:
+                break
+
+            if not self.busy(stream) and \
+                    self.redis.offer_lease(self.lease_key(stream), self.consumer, self.OFFERED, self.lease_ttl):
+                logger.info(f"offering webhook partition {stream} to other workers")
+                offered.append(stream)
+
+        self.owned = [stream for stream in self.owned if stream not in offered]
+        return offered
+
+    def acquire_partitions(self):
+        """ renews the leases on our partitions and moves towards our share,
+        returns the number of entries claimed from their previous owner """
+        for stream in list(self.owned):
+            if not self.redis.renew_lease(self.lease_key(stream), self.consumer, self.lease_ttl):
+                logger.warning(f"lost ownership of webhook partition {stream}")
+                self.owned.remove(stream)
+                self.claimed = deque(c for c in self.claimed if c[0] != stream)
+
+        share = self.share()
+        offered = self.offer_partitions(len(self.owned) - share)
+
+        claimed = 0
+        for stream in self.streams:
+            if stream in self.owned or stream in offered:
+                continue
+
+            # offered partitions only while below our share, free ones (the
+            # lease of their owner expired) always. The lease can still be
+            # ours after a restart with the same name
+            below_share = len(self.owned) < share
+            if self.redis.take_lease(self.lease_key(stream), self.consumer, self.lease_ttl,
+                                     self.OFFERED if below_share else None):
+                logger.info(f"consuming webhook partition {stream}")
+                self.owned.append(stream)
+                # entries pending at the previous owner are delivered first
+                claimed += self.claim(stream, 0)
+
+        return claimed
+
+    def claim(self, stream, min_idle_ms):
+        """ claims pending entries idle for min_idle_ms, entries delivered
+        max_deliveries times are dropped """
+        stuck = []
+        queued = {entry_id for s, entry_id, f in self.claimed if s == stream}
+        queued.update(entry_id for s, entry_id in self.in_progress if s == stream)
+        for pending in self.redis.xpending(stream, self.group):
+            if pending['time_since_delivered'] < min_idle_ms or pending['message_id'] in queued:
+                continue
+
+            if pending['times_delivered'] >= self.max_deliveries:
+                logger.error(
+                    "dropping webhook entry {} after {} deliveries".format(
+                        pending['message_id'], pending['times_delivered']
+                    )
+                )
+                self.redis.xack(stream, self.group, pending['message_id'])
+                continue
+
+            stuck.append(pending['message_id'])
+
+        if not stuck:
+            return 0
+
+        claimed = self.redis.xclaim(
+            stream, self.group, self.consumer, min_idle_ms, stuck
+        )
+        self.claimed.extend(
+            (stream, entry_id, fields) for entry_id, fields in claimed
+        )
+        return len(claimed)
+
+    def put(self, webhook, params):
+        self.redis.xadd(
+            self.partition_stream(params),
+            {'event': serialize_event(webhook, params)},
+            maxlen=self.maxlen
+        )
+        key = document_key(webhook, params)
+        if key:
+            # recorded after xadd, a newer version is always in the stream
+            newest = self.newest_document(key)
+            if newest is None or newest.document.version < params.document.version:
+                self.redis.set(
+                    f'{self.documents_key}:{key}',
+                    serialize_event(webhook, params),
+                    self.document_ttl
+                )
+        self.redis.publish(self.channel, self.stream)
+
+    def newest_document(self, key):
+        data = self.redis.get(f'{self.documents_key}:{key}')
+        if data is None:
+            return None
+
+        return deserialize_event(data)[1]
+
+    def coalesce(self, entry_id, webhook, params):
+        """ like MemoryWebhookQueue the newest version of a document is handled
+        at the position of its first entry, so the order with the other events
+        of the dossier is kept. The later entries of that document are skipped,
+        None is returned for those """
+        key = document_key(webhook, params)
+        if not key:
+            return params
+
+        version = params.document.version
+        entry_id = entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+        handled = self.redis.get(f'{self.handled_key}:{key}')
+        if handled is not None:
+            if isinstance(handled, bytes):
+                handled = handled.decode()
+            handled_version, handler_id = handled.split(' ')
+            # a redelivered handler entry handles the newest version again
+            if version <= int(handled_version) and handler_id != entry_id:
+                return None
+
+        newest = self.newest_document(key)
+        if newest is None or newest.document.version <= version:
+            return params
+
+        self.redis.set(
+            f'{self.handled_key}:{key}',
+            f'{newest.document.version} {entry_id}',
+            self.document_ttl
+        )
+        return newest
+
+    def entry(self, stream, entry_id, fields):
+        """ entries that can not be parsed are acknowledged and skipped,
+        otherwise they would be claimed again forever """
+        if not fields:
+            # trimmed from the stream while pending
+            self.redis.xack(stream, self.group, entry_id)
+            return None
+
+        try:
+            webhook, params = deserialize_event(fields[b'event'])
+        except (KeyError, ValueError) as e:
+            logger.error(f"skipping invalid webhook entry {entry_id}: {e}")
+            self.redis.xack(stream, self.group, entry_id)
+            return None
+
+        newest = self.coalesce(entry_id, webhook, params)
+        if newest is None:
+            logger.info(
+                f"skipping document {params.document.id} version {params.document.version}, already handled"
+            )
+            COALESCED.inc()
+            self.redis.xack(stream, self.group, entry_id)
+            return None
+
+        return {'id': entry_id, 'stream': stream, 'webhook': webhook, 'params': newest}
+
+    def read_owned(self):
+        """ next new entry of our partitions as (stream, entry_id, fields) """
+        for n in range(len(self.owned)):
+            stream = self.owned[(self.next_owned + n) % len(self.owned)]
+            entries = self.redis.xreadgroup(stream, self.group, self.consumer)
+            if entries:
+                self.next_owned = (self.next_owned + n + 1) % len(self.owned)
+                entry_id, fields = entries[0]
+                return stream, entry_id, fields
+
+        return None
+
+    def get(self):
+        with self.lock:
+            while True:
+                if self.claimed:
+                    stream, entry_id, fields = self.claimed.popleft()
+                else:
+                    read = self.read_owned()
+                    if not read:
+                        return None
+                    stream, entry_id, fields = read
+
+                entry = self.entry(stream, entry_id, fields)
+                if entry:
+                    self.in_progress.add((stream, entry_id))
+                    return entry
+
+    def ack(self, entry):
+        try:
+            self.redis.xack(entry['stream'], self.group, entry['id'])
+        finally:
+            # when the ack failed the entry is claimed again after claim_idle
+            with self.lock:
+                self.in_progress.discard((entry['stream'], entry['id']))
+
+    def empty(self):
+        return not self.claimed and not any(
+            self.redis.xundelivered(stream, self.group) for stream in self.owned
+        )
+
+    def reclaim(self):
+        """ renews our partitions, rebalances them and claims entries that
+        stayed pending longer than claim_idle, returns the number of entries
+        claimed """
+        with self.lock:
+            claimed = self.acquire_partitions()
+            for stream in self.owned:
+                claimed += self.claim(stream, self.claim_idle_ms)
+
+        if claimed:
+            logger.warning(f"claimed {claimed} stuck webhook entries")
+        return claimed
+
+    def subscribe(self, callback):
+        return self.redis.subscribe(self.channel, lambda data: callback())
+
+    def close(self):
+        """ releases our partitions so other workers take them right away """
+        with self.lock:
+            for stream in self.owned:
+                self.redis.release_lease(self.lease_key(stream), self.consumer)
+            self.owned = []
+        self.redis.zrem(self.workers_key, self.consumer)
+
+
+def create_webhook_queue(params, redis_cache):
+    if params.get('webhook_queue', 'memory') == 'redis_stream':
+        return StreamWebhookQueue(params, redis_cache)
+
+    return MemoryWebhookQueue()
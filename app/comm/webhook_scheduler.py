@@ -6,9 +6,28 @@
 #   app/comm/webhook_scheduler.py
 #       we queue the incomming webrequests
 #       this fixes race conditions on ldap operations
+#       a consumer task wakes up as soon as an event is scheduled and drains
+#       the queue one event at a time, services run in a worker thread so the
+#       event loop keeps accepting webhooks while an event is handled
+#       the queue is in memory or a durable redis stream shared by all
+#       workers, see webhook_queue.py
+#       events of the same content partner run in order, different content
+#       partners run concurrently up to concurrency, see keyed_executor.py
+#       the blocking handle_event of each event type runs in its own sized
+#       thread pool (handler_threads), time spent waiting for a thread and
+#       running the handler is recorded per event type
+#       a second job renews the teamleader token before it expires
+#       while the teamleader circuit breaker is open events are parked in
+#       redis and replayed in order once it lets calls through again
+#       duplicate deliveries of an event are dropped before they are queued,
+#       see idempotency.py
 #
 
-import queue
+import asyncio
+import functools
+import time
+
+from concurrent.futures import ThreadPoolExecutor
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
 from viaa.configuration import ConfigParser
@@ -17,65 +36,298 @@ from viaa.observability import logging
 from app.services.process_service import ProcessService
 from app.services.document_service import DocumentService
 from app.services.milestone_service import MilestoneService
+from app.clients.circuit_breaker import TeamleaderUnavailableError
+from app.comm.parked_events import ParkedEvents, EVENT_MODELS
+from app.comm.idempotency import DeliveryKeys
+from app.comm.webhook_queue import MemoryWebhookQueue, partition_key
+from app.comm.keyed_executor import KeyedExecutor
+from app.comm.metrics import metrics
 
 # Initialize the logger and the configuration
 config = ConfigParser()
 logger = logging.get_logger(__name__, config=config)
 
+SERVICES = {
+    'process_event': ProcessService,
+    'milestone_event': MilestoneService,
+    'document_event': DocumentService
+}
+
+HANDLER_WAIT_SECONDS = metrics.histogram(
+    'skryv_event_handler_wait_seconds',
+    'Time events waited for a free handler thread',
+    ('event',)
+)
+HANDLER_SECONDS = metrics.histogram(
+    'skryv_event_handler_duration_seconds',
+    'Duration of the blocking handle_event call of our services',
+    ('event',)
+)
+
 
 class WebhookScheduler:
     def __init__(self):
         self.clients = None
-        self.webhook_queue = queue.Queue()
-        self.queue_limit = 5        # nr of entries per scheduler iteration
-        self.scheduler_interval = 1  # run webhook_processing every x seconds
+        self.webhook_queue = MemoryWebhookQueue()
+        self.queue_subscription = None
+        self.replay_limit = 2       # nr of parked events replayed per iteration
+        self.parked_events = None
+        self.delivery_keys = None
+        self.loop = None
+        self.wakeup = None
+        self.consumer = None
+        self.executor = None
+        self.handler_pools = {}
+        self.replay_interval = 1    # check for parked events every x seconds
         self.scheduler = AsyncIOScheduler()
         self.scheduler.add_job(
-            self.webhook_processing,
-            'interval', seconds=self.scheduler_interval
+            self.replay_check,
+            'interval', seconds=self.replay_interval
+        )
+        self.reclaim_interval = 30  # claim stuck entries of the stream queue
+        self.scheduler.add_job(
+            self.reclaim_check,
+            'interval', seconds=self.reclaim_interval
+        )
+        self.token_renewal_interval = 60
+        self.scheduler.add_job(
+            self.token_renewal,
+            'interval', seconds=self.token_renewal_interval
         )
 
-    def start(self, clients):
+    def start(self, clients, webhook_queue=None, concurrency=1, handler_threads=None,
+              delivery_ttl=0):
         self.clients = clients
+        for name, threads in (handler_threads or {}).items():
+            self.handler_pools[name] = ThreadPoolExecutor(
+                max_workers=int(threads),
+                thread_name_prefix=f'{name}_handler'
+            )
+        if webhook_queue:
+            self.webhook_queue = webhook_queue
+        self.parked_events = ParkedEvents(clients.redis)
+        if delivery_ttl:
+            self.delivery_keys = DeliveryKeys(clients.redis, delivery_ttl)
+        self.loop = asyncio.get_event_loop()
+        self.executor = KeyedExecutor(concurrency)
+        self.wakeup = asyncio.Event()
+        self.consumer = self.loop.create_task(self.consume())
+        # wakes us for events put on a shared queue by other workers
+        self.queue_subscription = self.webhook_queue.subscribe(self.wake)
         self.scheduler.start()
         logger.info(
-            "APScheduler started: interval seconds={} queue_limit={}".format(
-                self.scheduler_interval,
-                self.queue_limit
+            "Webhook consumer started, concurrency={} APScheduler replay interval seconds={}".format(
+                concurrency,
+                self.replay_interval
             )
         )
 
+    def stop(self):
+        if self.consumer:
+            self.consumer.cancel()
+            self.consumer = None
+        if self.queue_subscription:
+            self.queue_subscription.stop()
+            self.queue_subscription = None
+        self.webhook_queue.close()
+        for pool in self.handler_pools.values():
+            pool.shutdown(wait=False)
+        if self.scheduler.running:
+            self.scheduler.shutdown(wait=False)
+
     def schedule(self, webhook, parameters):
-        self.webhook_queue.put({
-            "webhook": webhook,
-            "params": parameters
-        })
+        """ queues the event, returns False for a duplicate delivery """
+        if self.delivery_keys:
+            if not self.delivery_keys.first_delivery(webhook, parameters):
+                return False
+
+        try:
+            self.webhook_queue.put(webhook, parameters)
+        except Exception:
+            # not queued, a retry of this delivery must not be dropped
+            if self.delivery_keys:
+                self.delivery_keys.forget(webhook, parameters)
+            raise
+
+        self.wake()
+        return True
+
+    def wake(self):
+        # schedule is called from the fastapi threadpool, not the event loop
+        if self.loop and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    async def consume(self):
+        while True:
+            await self.wakeup.wait()
+            # clear before draining, events scheduled meanwhile wake us again
+            self.wakeup.clear()
+            try:
+                await self.dispatch_events()
+            except Exception as e:
+                logger.error(f"webhook processing failed: {e}")
+
+    def log_event_stats(self, name):
+        """ logged from the handler thread, the counters are per event """
+        tlc = self.clients.teamleader
+        event = tlc.event_stats()
+        # connection reuse is shared by all events, see connection_stats in /metrics
+        logger.info("{} teamleader requests={}".format(name, event['requests']))
+        logger.info(
+            "{} company updates: sent={} avoided={} unchanged fields skipped={}".format(
+                name,
+                event['sent'],
+                event['avoided'],
+                event['fields_skipped']
+            )
+        )
 
     async def execute_webhook(self, name, params):
-        if name == 'process_event':
-            logger.info("handling process event")
-            ps = ProcessService(self.clients)
-            ps.handle_event(params)
-            return "process event is handled"
-        elif name == 'milestone_event':
-            logger.info("handling milestone event")
-            ms = MilestoneService(self.clients)
-            ms.handle_event(params)
-            return "milestone event is handled"
-        elif name == 'document_event':
-            logger.info("handling document event")
-            ds = DocumentService(self.clients)
-            ds.handle_event(params)
-            return "document event is handled"
-        else:
+        return await self.handle_webhook(name, params)
+
+    async def run_service(self, name, service_class, params):
+        """ services make blocking ldap and teamleader calls, even building
+        one can load the custom field catalogue. They are built and run in the
+        thread pool of their event type (or the default executor) """
+        submitted = time.monotonic()
+
+        def handle():
+            started = time.monotonic()
+            HANDLER_WAIT_SECONDS.observe(started - submitted, event=name)
+            # retries of one event share a budget, see RetryPolicy
+            self.clients.teamleader.start_event()
+            try:
+                service_class(self.clients).handle_event(params)
+            finally:
+                HANDLER_SECONDS.observe(time.monotonic() - started, event=name)
+                self.log_event_stats(name)
+
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(self.handler_pools.get(name), handle)
+
+    async def run_blocking(self, function, *args):
+        """ redis and slack calls outside of the services (parked events and
+        the stream queue), in the default executor so they don't block the
+        event loop """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, functools.partial(function, *args))
+
+    async def handle_webhook(self, name, params):
+        service_class = SERVICES.get(name)
+        if service_class is None:
             logger.warning(
                 f"invalid webhook: {name} received with params: {params}")
+            return
+
+        logger.info(f"handling {name.replace('_', ' ')}")
+        await self.run_service(name, service_class, params)
+        return f"{name.replace('_', ' ')} is handled"
+
+    def park_event(self, name, params, reason):
+        parked = self.parked_events.park(name, params)
+        logger.warning(f"{name} parked ({parked} waiting): {reason}")
+        if parked == 1:
+            # only notify once per outage, not for every parked event
+            self.clients.slack.teamleader_unavailable(reason)
+        return f"{name} is parked"
+
+    async def run_or_park(self, name, params):
+        if name not in EVENT_MODELS:
+            return await self.execute_webhook(name, params)
+
+        # keep events in order, later ones wait behind already parked events
+        if not self.clients.teamleader.available():
+            return await self.run_blocking(
+                self.park_event, name, params, 'teamleader circuit open'
+            )
+        if await self.run_blocking(self.parked_events.count) > 0:
+            return await self.run_blocking(
+                self.park_event, name, params, 'earlier events still parked'
+            )
+
+        try:
+            return await self.execute_webhook(name, params)
+        except TeamleaderUnavailableError as e:
+            return await self.run_blocking(self.park_event, name, params, str(e))
+
+    async def replay_parked_events(self):
+        for i in range(self.replay_limit):
+            if not self.clients.teamleader.available():
+                return
+
+            event = await self.run_blocking(self.parked_events.unpark)
+            if event is None:
+                return
+
+            name, params = event
+            logger.info(f"replaying parked {name}")
+            try:
+                await self.execute_webhook(name, params)
+            except TeamleaderUnavailableError as e:
+                logger.warning(f"replay of {name} failed, parked again: {e}")
+                await self.run_blocking(self.parked_events.park_front, name, params)
+                return
+
+    async def token_renewal(self):
+        if not self.clients:
+            return
+
+        # refresh is a blocking http call, keep it off the event loop
+        loop = asyncio.get_event_loop()
+        try:
+            await loop.run_in_executor(
+                None,
+                self.clients.teamleader.renew_token_if_expiring
+            )
+        except Exception as e:
+            # a 401 on the next webhook call will retry the refresh
+            logger.warning(f"teamleader token renewal failed: {e}")
+
+    async def replay_check(self):
+        # parked events do not schedule anything, wake the consumer for them
+        if await self.run_blocking(self.parked_events.count) > 0:
+            self.wake()
+
+    async def reclaim_check(self):
+        if await self.run_blocking(self.webhook_queue.reclaim) > 0:
+            self.wake()
+
+    def partition_key(self, params):
+        """ events of one content partner, or else of one dossier, stay ordered """
+        return partition_key(params)
+
+    async def process_entry(self, request_obj):
+        try:
+            await self.run_or_park(
+                request_obj['webhook'],
+                request_obj['params']
+            )
+        except Exception as e:
+            # acknowledged like a handled event, running it again later would
+            # overtake newer events of the same dossier
+            logger.error(f"{request_obj['webhook']} failed: {e}")
+
+        await self.run_blocking(self.webhook_queue.ack, request_obj)
+
+    async def dispatch_events(self):
+        """ hands queued events to the executor, submit waits while enough
+        events are in progress so we take events as fast as they are handled """
+        if await self.run_blocking(self.parked_events.count) > 0:
+            # parked events are older than anything in progress
+            await self.executor.join()
+            await self.replay_parked_events()
+
+        while True:
+            request_obj = await self.run_blocking(self.webhook_queue.get)
+            if request_obj is None:
+                return
+
+            await self.executor.submit(
+                self.partition_key(request_obj['params']),
+                functools.partial(self.process_entry, request_obj)
+            )
 
     async def webhook_processing(self):
-        for i in range(self.queue_limit):
-            if not self.webhook_queue.empty():
-                request_obj = self.webhook_queue.get_nowait()
-                await self.execute_webhook(
-                    request_obj['webhook'],
-                    request_obj['params']
-                )
+        """ drains the queue and waits until all events are handled """
+        await self.dispatch_events()
+        await self.executor.join()
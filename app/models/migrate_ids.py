@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   app/models/migrate_ids.py
+#
+#   Legacy Teamleader ids to resolve with migrate.id, used by the admin warm up call
+#
+
+from typing import List
+from pydantic import BaseModel, Field
+
+
+class MigrateIds(BaseModel):
+    type: str = Field(
+        ..., description="resource type ex. company or contact"
+    )
+    ids: List[str] = Field(
+        ..., description="old (numeric) teamleader ids"
+    )
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "type": "company",
+                "ids": ["12345", "12346"]
+            }
+        }
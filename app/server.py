@@ -29,11 +29,11 @@ app.include_router(api_router)
 config = ConfigParser()
 log = logging.get_logger(__name__, config=config)
 
-# we disable logging of health calls
+# we disable logging of health and metrics calls
 app.add_middleware(
     RouteLoggerMiddleware,
     logger=log,
-    skip_routes=['/health']
+    skip_routes=['/health', '/metrics']
 )
 
 
@@ -42,11 +42,14 @@ def startup_event():
     redis_url = config.app_cfg['teamleader']['redis_url']
     main_app.redis_cache.create_connection(redis_url)
     main_app.start_clients()
+    main_app.warm_caches()
     main_app.clients.slack.server_started_message()
 
 
 @app.on_event('shutdown')
 async def shutdown_event():
+    main_app.whs.stop()
+    main_app.clients.teamleader.close()
     main_app.redis_cache.close()
 
 
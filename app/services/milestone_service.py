@@ -9,11 +9,15 @@
 #   This updates teamleader company status (custom fields section 2)
 #   This also adds and updates linked company contacts in teamleader from the document
 #   received in a previous document_service webhook call.
-#   The VAT number is updated in a seperate teamleader update call so that if it fails
-#   the previous changes are not lost.
+#   The VAT number is saved in the same teamleader update call. Only when that call
+#   fails we retry without the VAT number, so that the other changes are not lost.
+#   With combine_vat_update disabled the VAT number is saved in a seperate call.
+#   Only fields that differ from the fetched company are sent to teamleader.
 #   In case of validation errors or other connection errors slack messages are generated
 #
 
+import copy
+
 from app.models.milestone_body import MilestoneBody
 from app.models.document_body import DocumentBody
 from app.services.skryv_base import SkryvBase
@@ -591,23 +595,31 @@ class MilestoneService(SkryvBase):
 
         return company
 
-    def update_btw(self, document_body, company):
-        # update vat number seperately in teamleader
+    def get_vat_number(self, document_body):
         dvals = document_body.document.document.value
         if 'adres_en_contactgegevens' not in dvals:
-            return
+            return None
 
         ac = dvals['adres_en_contactgegevens']
-        if 'btwnummer' in ac:
-            vat_number = ac['btwnummer'].upper()
-            if 'BE' not in vat_number:
-                vat_number = "BE {}".format(vat_number)
-            company['vat_number'] = vat_number
-        else:
+        if 'btwnummer' not in ac:
+            return None
+
+        vat_number = ac['btwnummer'].upper()
+        if 'BE' not in vat_number:
+            vat_number = "BE {}".format(vat_number)
+
+        return vat_number
+
+    def update_btw(self, document_body, company):
+        # update vat number seperately in teamleader
+        original = copy.deepcopy(company)
+        vat_number = self.get_vat_number(document_body)
+        if not vat_number:
             return
 
+        company['vat_number'] = vat_number
         try:
-            self.tlc.update_company(company)
+            self.tlc.update_company(company, original)
             logger.info(
                 f"Saved VAT number on company {company['id']}")
         except ValueError as e:
@@ -619,9 +631,9 @@ class MilestoneService(SkryvBase):
                 self.dossier
             )
 
-    def save_company(self, company):
+    def save_company(self, company, original):
         try:
-            self.tlc.update_company(company)
+            self.tlc.update_company(company, original)
             logger.info(f"Saved company {company['id']} to teamleader.")
         except ValueError as e:
             logger.info(f"Errors when updating company {company['id']}")
@@ -631,6 +643,46 @@ class MilestoneService(SkryvBase):
                 self.dossier
             )
 
+    def vat_number_rejected(self, error):
+        """ teamleader answers 400 naming the field for an invalid vat number """
+        message = str(error)
+        return 'status=400' in message and 'vat_number' in message
+
+    def save_company_with_btw(self, document_body, company, original):
+        # save vat number in the same call, one teamleader write instead of two
+        vat_number = self.get_vat_number(document_body)
+        if not vat_number or vat_number == original.get('vat_number'):
+            self.save_company(company, original)
+            return
+
+        company['vat_number'] = vat_number
+        try:
+            self.tlc.update_company(company, original)
+            logger.info(
+                f"Saved company {company['id']} with VAT number to teamleader.")
+            return
+        except ValueError as e:
+            error = e
+
+        if self.vat_number_rejected(error):
+            # save the other changes without the rejected vat number
+            logger.info(
+                f"VAT number rejected for company {company['id']}, saving company without it")
+            company['vat_number'] = original.get('vat_number')
+            try:
+                self.tlc.update_company(company, original)
+                logger.info(f"Saved company {company['id']} to teamleader.")
+            except ValueError as e:
+                error = e
+        else:
+            logger.info(f"Errors when updating company {company['id']}")
+
+        self.slack.update_company_failed(
+            company['id'],
+            error,
+            self.dossier
+        )
+
     def update_company_and_contacts(self):
         if self.dossier.dossierDefinition != self.SKRYV_DOSSIER_CP_ID:
             logger.warning(
@@ -649,6 +701,7 @@ class MilestoneService(SkryvBase):
             self.slack.company_not_found(company_id, self.or_id)
             return
 
+        original = copy.deepcopy(company)
         status_changed, company = self.status_update(
             company,
             self.milestone.status
@@ -671,8 +724,11 @@ class MilestoneService(SkryvBase):
                     doc_body, company
                 )
 
-                self.save_company(company)
-                self.update_btw(doc_body, company)
+                if self.skryv_config.get('combine_vat_update', True):
+                    self.save_company_with_btw(doc_body, company, original)
+                else:
+                    self.save_company(company, original)
+                    self.update_btw(doc_body, company)
             except ValidationError as e:
                 logger.warning(
                     f"Missing or malformed dossier for milestone company_update: {self.dossier.id} error: {e}"
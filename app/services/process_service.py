@@ -16,6 +16,8 @@
 #   that might have been saved by a previous process or milestone.
 #
 
+import copy
+
 from app.models.process_body import ProcessBody
 from app.models.document_body import DocumentBody
 from app.clients.teamleader_client import TeamleaderAuthError
@@ -145,9 +147,10 @@ class ProcessService(SkryvBase):
             self.slack.company_not_found(company_id, self.or_id)
             return
 
+        original = copy.deepcopy(company)
         company = status_update_method(company)
         try:
-            self.tlc.update_company(company)
+            self.tlc.update_company(company, original)
             logger.info(f"Saved changes to teamleader company {company['id']}")
         except ValueError as e:
             logger.info(
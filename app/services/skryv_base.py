@@ -9,9 +9,12 @@
 #   variables and have a mapping of custom fields.
 #   We also add some shared helpers to set custom fields here in order to save back
 #   to teamleader
+#   Custom field definitions and business types come from the process wide
+#   custom_field_cache which holds an indexed TeamleaderCatalogue
 #
 
 import uuid
+from app.clients.custom_field_cache import custom_field_cache
 from viaa.configuration import ConfigParser
 from viaa.observability import logging
 
@@ -27,6 +30,7 @@ class SkryvBase:
             self.skryv_config['dossier_content_partner_id']
         )
 
+        self.catalogue = custom_field_cache.get(self.tlc)
         self.custom_fields = self.custom_field_mapping(
             config.app_cfg['custom_field_ids']
         )
@@ -36,7 +40,10 @@ class SkryvBase:
         )
 
     def get_business_types(self, bt_ids):
-        return {
+        # configured ids take precedence, other belgian business types
+        # are looked up by name in the teamleader catalogue
+        mapping = self.catalogue.business_type_names()
+        mapping.update({
             'ag': bt_ids['ag'],
             'bvba': bt_ids['bvba'],
             'cvba': bt_ids['cvba'],
@@ -54,17 +61,22 @@ class SkryvBase:
             'vzw': bt_ids['vzw'],
             'vereniging': bt_ids['vereniging'],
             'overige': None
-        }
+        })
+
+        return mapping
 
     def custom_field_mapping(self, field_ids):
         self.custom_fields = {}
-        for f in self.tlc.list_custom_fields():
-            for f_label, f_id in field_ids.items():
-                if f['id'] == f_id:
-                    self.custom_fields[f_label] = f
+        for f_label, f_id in field_ids.items():
+            definition = self.catalogue.definition(f_id)
+            if definition:
+                self.custom_fields[f_label] = definition
 
         return self.custom_fields
 
+    def allowed_options(self, field_name):
+        return self.catalogue.options(self.custom_fields[field_name]['id'])
+
     def get_custom_field(self, resource, field_name):
         for f in resource['custom_fields']:
             if f['definition']['id'] == self.custom_fields[field_name]['id']:
@@ -143,8 +155,7 @@ class SkryvBase:
         # 'Specifieke voorwaarden'
         # 'Topstukkenaddendum'
 
-        allowed_addenda = self.custom_fields.get(
-            'swo_addenda')['configuration']['options']
+        allowed_addenda = self.allowed_options('swo_addenda')
         for d in addenda_list:
             if d not in allowed_addenda:
                 logger.warning(
@@ -188,7 +199,7 @@ class SkryvBase:
         value = skryv_to_tl_mapping.get(value, value)
 
         # if this fails, we just log a warning and return contact without category set
-        allowed_categories = self.custom_fields['functie_category']['configuration']['options']
+        allowed_categories = self.allowed_options('functie_category')
         if value not in allowed_categories:
             contact_info = 'id={} name={}{} emails={}'.format(
                 contact.get('id'),
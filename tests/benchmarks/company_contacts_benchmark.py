@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   tests/benchmarks/company_contacts_benchmark.py
+#
+#   Compares TeamleaderClient.company_contacts against the previous serial
+#   loop (one contacts.info call at a time followed by a fixed 0.4s sleep).
+#   Teamleader responses are mocked with a simulated latency per call.
+#   run with: make contacts_benchmark
+#
+
+import sys
+import time
+import requests_mock
+
+from app.clients.teamleader_client import TeamleaderClient
+from tests.unit.mock_redis_cache import MockRedisCache
+from tests.unit.testing_config import tst_app_config
+
+API_URL = 'https://api.teamleader.eu'
+COMPANY_ID = 'benchmark_company_uuid'
+PAGE_SIZE = 20
+
+
+def delayed(latency, data):
+    def callback(request, context):
+        time.sleep(latency)
+        return {'data': data}
+
+    return callback
+
+
+def mock_teamleader(mocker, nr_contacts, latency):
+    contact_ids = [f'contact_{i}' for i in range(nr_contacts)]
+    pages = [
+        contact_ids[i:i + PAGE_SIZE]
+        for i in range(0, nr_contacts + 1, PAGE_SIZE)
+    ]
+    for page_nr, page in enumerate(pages, start=1):
+        mocker.get(
+            '{}/contacts.list?filter%5Bcompany_id%5D={}&page%5Bnumber%5D={}&page%5Bsize%5D={}'.format(
+                API_URL, COMPANY_ID, page_nr, PAGE_SIZE
+            ),
+            json=delayed(latency, [{'id': cid} for cid in page])
+        )
+
+    for cid in contact_ids:
+        mocker.get(
+            f'{API_URL}/contacts.info?id={cid}',
+            json=delayed(latency, {'id': cid})
+        )
+
+
+def serial_company_contacts(tlc, company_id, rate_limit=0.4):
+    """ the company_contacts loop as it was, with the old fixed sleeps """
+    contacts = []
+    page = 1
+    while True:
+        lc = tlc.linked_contacts(company_id, page, PAGE_SIZE)
+        time.sleep(rate_limit)
+        page += 1
+        for c in lc:
+            contacts.append(tlc.get_contact(c['id']))
+            time.sleep(rate_limit)
+
+        if len(lc) < PAGE_SIZE:
+            break
+
+    return contacts
+
+
+def run_benchmark(nr_contacts=30, latency=0.15):
+    app_config = tst_app_config()
+    # same read budget as config.yml
+    app_config['teamleader']['read_rate_limit'] = 0.4
+    app_config['teamleader']['read_rate_burst'] = 5
+    tlc = TeamleaderClient(app_config, MockRedisCache())
+
+    with requests_mock.Mocker() as mocker:
+        mock_teamleader(mocker, nr_contacts, latency)
+
+        # old behaviour: no limiter, fixed sleep after every call
+        tlc.RATE_LIMIT = 0.0
+        start = time.time()
+        serial = serial_company_contacts(tlc, COMPANY_ID)
+        serial_seconds = time.time() - start
+
+        # new behaviour: concurrent fetches throttled by the read limiter
+        tlc.RATE_LIMIT = 0.4
+        start = time.time()
+        parallel = tlc.company_contacts(COMPANY_ID)
+        parallel_seconds = time.time() - start
+
+    assert [c['id'] for c in serial] == [c['id'] for c in parallel]
+
+    print(f"contacts={nr_contacts} latency={latency}s")
+    print(f"serial   : {serial_seconds:.2f}s")
+    print(f"parallel : {parallel_seconds:.2f}s")
+    print(f"speedup  : {serial_seconds / parallel_seconds:.1f}x")
+    print(f"read limiter: {tlc.rate_limit_stats()['read']}")
+
+
+if __name__ == '__main__':
+    args = [float(a) for a in sys.argv[1:]]
+    if len(args) > 0:
+        args[0] = int(args[0])
+    run_benchmark(*args)
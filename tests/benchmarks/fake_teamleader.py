@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   tests/benchmarks/fake_teamleader.py
+#
+#   FakeTeamleader is a local stand-in for the Teamleader api and oauth
+#   server, seeded from tests/fixtures/teamleader. Unlike the mocks in
+#   tests/unit it talks real HTTP/1.1 with keep-alive, so the TeamleaderClient
+#   connection pooling, rate limiters, retries and token refreshes can be
+#   measured offline. It simulates:
+#     - response latency, drawn per call from a latency function
+#     - Teamleader's request budget with X-RateLimit-* headers and 429
+#       responses with Retry-After, plus injected 429's (inject_rate_limited)
+#     - access tokens that expire after token_ttl seconds (401 afterwards)
+#
+#   run standalone with: make fake_teamleader
+#   and point TL_API_URI and TL_AUTH_URI at it.
+#
+
+import argparse
+import copy
+import json
+import math
+import os
+import random
+import threading
+import time
+import uuid
+
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qsl
+
+FIXTURES = 'tests/fixtures/teamleader'
+
+
+def fixed_latency(seconds):
+    return lambda rnd: seconds
+
+
+def uniform_latency(low, high):
+    return lambda rnd: rnd.uniform(low, high)
+
+
+def lognormal_latency(median, sigma=0.5, max_seconds=10.0):
+    """ long tailed latency like real api calls, half the calls take less
+    than median seconds """
+    mu = math.log(median)
+    return lambda rnd: min(rnd.lognormvariate(mu, sigma), max_seconds)
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name)) as f:
+        data = json.load(f)
+    return data if isinstance(data, list) else [data]
+
+
+def info_custom_fields(custom_fields):
+    """ update format {id, value} to the companies.info format """
+    return [
+        f if 'definition' in f else {
+            'definition': {'type': 'customFieldDefinition', 'id': f['id']},
+            'value': f['value']
+        }
+        for f in custom_fields
+    ]
+
+
+class FakeTeamleaderHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'   # keep-alive, like the real api
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.fake.new_connection()
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_params(self):
+        url = urlparse(self.path)
+        params = dict(parse_qsl(url.query))
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            body = self.rfile.read(length).decode()
+            if 'json' in (self.headers.get('Content-Type') or ''):
+                params.update(json.loads(body))
+            else:
+                params.update(parse_qsl(body))
+        return url.path, params
+
+    def handle_call(self):
+        path, params = self.read_params()
+        status, data, headers = self.server.fake.call(
+            path,
+            params,
+            self.headers.get('Authorization')
+        )
+        body = b'' if data is None else json.dumps(data).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, str(value))
+        if data is not None:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.handle_call()
+
+    def do_POST(self):
+        self.handle_call()
+
+
+class FakeTeamleader:
+    def __init__(self, latency=None, rate_limit=None, rate_window=60.0,
+                 token_ttl=3600, seed=None, port=0):
+        """ latency: function(random) returning seconds per call, or a dict
+        with such functions per endpoint and a 'default' entry.
+        rate_limit: number of api calls allowed per rate_window seconds,
+        None disables the budget.
+        """
+        if not isinstance(latency, dict):
+            latency = {'default': latency or fixed_latency(0.0)}
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.token_ttl = token_ttl
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+        self.calls = deque()
+        self.inject_429 = 0
+        self.tokens = {}
+        self.refresh_tokens = set()
+        self.stats = {
+            'connections': 0, 'requests': 0,
+            'rate_limited': 0, 'unauthorized': 0, 'tokens_issued': 0
+        }
+        self.endpoint_calls = {}
+        self.seed()
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), FakeTeamleaderHandler)
+        self.server.daemon_threads = True
+        self.server.fake = self
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def seed(self):
+        self.companies = {}
+        for name in ('test_company.json', 'company_updated_addendums.json'):
+            for company in load_fixture(name):
+                self.companies[company['id']] = company
+
+        self.contacts = {}
+        for name in ('test_contacts.json', 'test_contact_administratie.json',
+                     'test_contact_directie.json', 'test_contact_extra1.json',
+                     'test_contact_extra2.json', 'existing_company_contacts.json',
+                     'contact_linked_example.json'):
+            for contact in load_fixture(name):
+                self.contacts[contact['id']] = contact
+
+        self.custom_fields = load_fixture('custom_fields.json')
+        self.business_types = load_fixture('business_types.json')
+
+    def add_company(self, company):
+        self.companies[company['id']] = copy.deepcopy(company)
+
+    def add_contact(self, contact):
+        self.contacts[contact['id']] = copy.deepcopy(contact)
+
+    def issue_token(self, ttl=None):
+        token = f'fake_token_{uuid.uuid4().hex}'
+        refresh_token = f'fake_refresh_{uuid.uuid4().hex}'
+        with self.lock:
+            self.tokens[token] = time.time() + (ttl or self.token_ttl)
+            self.refresh_tokens.add(refresh_token)
+            self.stats['tokens_issued'] += 1
+        return token, refresh_token
+
+    def expire_tokens(self):
+        with self.lock:
+            self.tokens = {token: 0 for token in self.tokens}
+
+    def inject_rate_limited(self, count):
+        """ the next count api calls are answered with 429 """
+        with self.lock:
+            self.inject_429 += count
+
+    def new_connection(self):
+        with self.lock:
+            self.stats['connections'] += 1
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self.server.serve_forever,
+            kwargs={'poll_interval': 0.05},
+            daemon=True
+        )
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def call_latency(self, endpoint):
+        latency = self.latency.get(endpoint, self.latency['default'])
+        with self.lock:
+            return latency(self.random)
+
+    def rate_limit_check(self):
+        """ returns (limited, headers) following the Teamleader rate limit headers """
+        with self.lock:
+            if self.inject_429 > 0:
+                self.inject_429 -= 1
+                self.stats['rate_limited'] += 1
+                return True, {'Retry-After': 1}
+
+            if not self.rate_limit:
+                return False, {}
+
+            now = time.time()
+            while self.calls and self.calls[0] <= now - self.rate_window:
+                self.calls.popleft()
+
+            reset = math.ceil(self.calls[0] + self.rate_window - now) if self.calls else 0
+            if len(self.calls) >= self.rate_limit:
+                self.stats['rate_limited'] += 1
+                return True, {
+                    'Retry-After': max(reset, 1),
+                    'X-RateLimit-Limit': self.rate_limit,
+                    'X-RateLimit-Remaining': 0,
+                    'X-RateLimit-Reset': max(reset, 1)
+                }
+
+            self.calls.append(now)
+            return False, {
+                'X-RateLimit-Limit': self.rate_limit,
+                'X-RateLimit-Remaining': self.rate_limit - len(self.calls),
+                'X-RateLimit-Reset': max(reset, 1)
+            }
+
+    def authorized(self, authorization):
+        token = (authorization or '').replace('Bearer ', '')
+        with self.lock:
+            return self.tokens.get(token, 0) > time.time()
+
+    def call(self, path, params, authorization):
+        """ returns (status, json data or None, headers) """
+        endpoint = path.rsplit('/', 1)[-1]
+        time.sleep(self.call_latency(endpoint))
+        with self.lock:
+            self.stats['requests'] += 1
+            self.endpoint_calls[endpoint] = self.endpoint_calls.get(endpoint, 0) + 1
+
+        if path == '/oauth2/access_token':
+            return self.access_token(params)
+
+        limited, headers = self.rate_limit_check()
+        if limited:
+            return 429, {'errors': [{'title': 'Too Many Requests'}]}, headers
+
+        if not self.authorized(authorization):
+            with self.lock:
+                self.stats['unauthorized'] += 1
+            return 401, {'errors': [{'title': 'Access token expired'}]}, headers
+
+        handler = ENDPOINTS.get(endpoint)
+        if handler is None:
+            return 404, {'errors': [{'title': f'unknown endpoint {endpoint}'}]}, headers
+
+        with self.lock:
+            status, data = handler(self, params)
+        return status, data, headers
+
+    def access_token(self, params):
+        grant_type = params.get('grant_type')
+        if grant_type == 'refresh_token':
+            with self.lock:
+                if params.get('refresh_token') not in self.refresh_tokens:
+                    return 400, {'errors': [{'title': 'invalid refresh token'}]}, {}
+                # refresh tokens can only be used once
+                self.refresh_tokens.discard(params['refresh_token'])
+        elif grant_type != 'authorization_code':
+            return 400, {'errors': [{'title': f'invalid grant_type {grant_type}'}]}, {}
+
+        token, refresh_token = self.issue_token()
+        return 200, {
+            'token_type': 'Bearer',
+            'access_token': token,
+            'refresh_token': refresh_token,
+            'expires_in': self.token_ttl
+        }, {}
+
+    def paged(self, items, params):
+        number = int(params.get('page[number]', 1))
+        size = int(params.get('page[size]', 20))
+        since = params.get('filter[updated_since]')
+        if since:
+            items = [i for i in items if (i.get('updated_at') or '') >= since]
+        return 200, {'data': copy.deepcopy(items[(number - 1) * size:number * size])}
+
+    def info(self, store, params):
+        item = store.get(params.get('id'))
+        if item is None:
+            return 404, {'errors': [{'title': 'not found'}]}
+        return 200, {'data': copy.deepcopy(item)}
+
+    def update(self, store, params):
+        item = store.get(params.get('id'))
+        if item is None:
+            return 404, {'errors': [{'title': 'not found'}]}
+
+        for key, value in params.items():
+            if key == 'custom_fields':
+                fields = {
+                    f['definition']['id']: f
+                    for f in item.get('custom_fields', [])
+                }
+                for f in info_custom_fields(value):
+                    fields[f['definition']['id']] = f
+                item['custom_fields'] = list(fields.values())
+            else:
+                item[key] = value
+        return 204, None
+
+    def companies_list(self, params):
+        return self.paged(list(self.companies.values()), params)
+
+    def companies_info(self, params):
+        return self.info(self.companies, params)
+
+    def companies_update(self, params):
+        return self.update(self.companies, params)
+
+    def contacts_list(self, params):
+        contacts = list(self.contacts.values())
+        company_id = params.get('filter[company_id]')
+        if company_id:
+            contacts = [
+                c for c in contacts
+                if any(link['company']['id'] == company_id for link in c.get('companies', []))
+            ]
+        return self.paged(contacts, params)
+
+    def contacts_info(self, params):
+        return self.info(self.contacts, params)
+
+    def contacts_update(self, params):
+        return self.update(self.contacts, params)
+
+    def contacts_add(self, params):
+        contact = dict(params)
+        contact['id'] = str(uuid.uuid4())
+        contact['companies'] = []
+        contact['custom_fields'] = info_custom_fields(contact.get('custom_fields', []))
+        self.contacts[contact['id']] = contact
+        return 201, {'data': {'type': 'contact', 'id': contact['id']}}
+
+    def contacts_delete(self, params):
+        if self.contacts.pop(params.get('id'), None) is None:
+            return 404, {'errors': [{'title': 'not found'}]}
+        return 204, None
+
+    def contacts_link(self, params):
+        contact = self.contacts.get(params.get('id'))
+        if contact is None or params.get('company_id') not in self.companies:
+            return 404, {'errors': [{'title': 'not found'}]}
+
+        links = contact.setdefault('companies', [])
+        links[:] = [link for link in links if link['company']['id'] != params['company_id']]
+        links.append({
+            'position': params.get('position'),
+            'decision_maker': params.get('decision_maker', False),
+            'company': {'type': 'company', 'id': params['company_id']}
+        })
+        return 204, None
+
+    def contacts_update_link(self, params):
+        contact = self.contacts.get(params.get('id'))
+        links = [
+            link for link in (contact or {}).get('companies', [])
+            if link['company']['id'] == params.get('company_id')
+        ]
+        if not links:
+            return 404, {'errors': [{'title': 'contact not linked to company'}]}
+
+        for key in ('position', 'decision_maker'):
+            if key in params:
+                links[0][key] = params[key]
+        return 204, None
+
+    def custom_fields_list(self, params):
+        return self.paged(self.custom_fields, params)
+
+    def business_types_list(self, params):
+        return self.paged(self.business_types, params)
+
+    def migrate_id(self, params):
+        old_id = '{}:{}'.format(params.get('type'), params.get('id'))
+        return 200, {'data': {
+            'type': params.get('type'),
+            'id': str(uuid.uuid5(uuid.NAMESPACE_URL, old_id))
+        }}
+
+
+ENDPOINTS = {
+    'companies.list': FakeTeamleader.companies_list,
+    'companies.info': FakeTeamleader.companies_info,
+    'companies.update': FakeTeamleader.companies_update,
+    'contacts.list': FakeTeamleader.contacts_list,
+    'contacts.info': FakeTeamleader.contacts_info,
+    'contacts.add': FakeTeamleader.contacts_add,
+    'contacts.update': FakeTeamleader.contacts_update,
+    'contacts.delete': FakeTeamleader.contacts_delete,
+    'contacts.linkToCompany': FakeTeamleader.contacts_link,
+    'contacts.updateCompanyLink': FakeTeamleader.contacts_update_link,
+    'customFieldDefinitions.list': FakeTeamleader.custom_fields_list,
+    'businessTypes.list': FakeTeamleader.business_types_list,
+    'migrate.id': FakeTeamleader.migrate_id,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='fake Teamleader api server')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.1,
+                        help='median latency in seconds (lognormal)')
+    parser.add_argument('--rate-limit', type=int, default=200,
+                        help='api calls per minute, 0 disables')
+    parser.add_argument('--token-ttl', type=int, default=3600)
+    args = parser.parse_args()
+
+    fake = FakeTeamleader(
+        latency=lognormal_latency(args.latency) if args.latency else None,
+        rate_limit=args.rate_limit or None,
+        token_ttl=args.token_ttl,
+        port=args.port
+    )
+    token, refresh_token = fake.issue_token()
+    print(f"fake teamleader on {fake.url}")
+    print(f"TL_AUTH_TOKEN={token}")
+    print(f"TL_REFRESH_TOKEN={refresh_token}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        fake.server.server_close()
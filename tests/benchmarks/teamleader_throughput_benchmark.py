@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   tests/benchmarks/teamleader_throughput_benchmark.py
+#
+#   Runs the Teamleader calls of a milestone event (companies.info,
+#   linked contacts, companies.update and a contacts.update) against the
+#   FakeTeamleader server with simulated latency, request budget and token
+#   expiry, and reports events per second together with the client stats.
+#   run with: make throughput_benchmark
+#   or: python -m tests.benchmarks.teamleader_throughput_benchmark events latency rate_limit workers
+#
+
+import copy
+import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from app.clients.teamleader_client import TeamleaderClient
+from tests.benchmarks.fake_teamleader import FakeTeamleader, lognormal_latency
+from tests.unit.mock_redis_cache import MockRedisCache
+from tests.unit.testing_config import tst_app_config
+
+COMPANY_ID = '1b2ab41a-7f59-103b-8cd4-1fcdd5140767'
+
+
+def milestone_event(tlc, nr):
+    company = tlc.get_company(COMPANY_ID)
+    original = copy.deepcopy(company)
+    contacts = tlc.company_contacts(COMPANY_ID)
+
+    company['website'] = f'www.benchmark{nr}.be'
+    tlc.update_company(company, original)
+
+    contact = contacts[nr % len(contacts)]
+    tlc.update_contact({
+        'id': contact['id'],
+        'first_name': contact['first_name'],
+        'last_name': contact['last_name'],
+        'custom_fields': contact.get('custom_fields', [])
+    })
+
+
+def run_benchmark(nr_events=20, latency=0.08, rate_limit=200, workers=1):
+    fake = FakeTeamleader(
+        latency=lognormal_latency(latency),
+        rate_limit=rate_limit,
+        token_ttl=5,    # expire a few times during the run
+        seed=42
+    )
+    token, refresh_token = fake.issue_token()
+
+    app_config = tst_app_config()
+    params = app_config['teamleader']
+    params['api_uri'] = fake.url
+    params['auth_uri'] = fake.url
+    params['auth_token'] = token
+    params['refresh_token'] = refresh_token
+    params['token_pubsub'] = False
+    # same budgets as config.yml
+    params['read_rate_limit'] = 0.2
+    params['read_rate_burst'] = 5
+    params['write_rate_limit'] = 0.4
+    params['write_rate_burst'] = 2
+
+    with fake:
+        tlc = TeamleaderClient(app_config, MockRedisCache())
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(lambda nr: milestone_event(tlc, nr), range(nr_events)))
+        seconds = time.time() - start
+
+    print(f"events={nr_events} workers={workers} latency={latency}s rate_limit={rate_limit}/min")
+    print(f"duration : {seconds:.2f}s")
+    print(f"events/s : {nr_events / seconds:.2f}")
+    print(f"server   : {fake.stats}")
+    print(f"endpoints: {fake.endpoint_calls}")
+    print(f"client connections: {tlc.connection_stats()}")
+    print(f"client retries    : {tlc.retry_stats()}")
+    print(f"client rate limit : {tlc.rate_limit_stats()}")
+    print(f"client tokens     : {tlc.token_refresh_stats()}")
+    tlc.close()
+
+
+if __name__ == '__main__':
+    args = [float(a) for a in sys.argv[1:]]
+    for i in (0, 2, 3):
+        if len(args) > i:
+            args[i] = int(args[i])
+    run_benchmark(*args)
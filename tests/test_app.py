@@ -61,11 +61,31 @@ class TestAppRequests:
         assert response.status_code == 200
         assert response.text == '"OK"'
 
+    def test_metrics(self, app_client):
+        response = app_client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers['content-type'].startswith('text/plain')
+        assert '# TYPE teamleader_client_stats gauge' in response.text
+        assert 'teamleader_client_stats{group="retries",name="retries"} 0' in response.text
+
     def test_oauth_check(self, app_client):
         response = app_client.get("/health/oauth")
         assert response.status_code == 200
         assert response.json()['status'] == 'ok'
 
+    def test_invalidate_custom_fields(self, app_client):
+        response = app_client.post("/admin/custom_fields/invalidate")
+        assert response.status_code == 200
+        assert response.json()['custom_fields'] >= 31
+
+    def test_warm_migrate_ids(self, app_client):
+        response = app_client.post(
+            "/admin/migrate_ids/warm",
+            json={'type': 'company', 'ids': ['12345', '12346']}
+        )
+        assert response.status_code == 200
+        assert response.json()['resolved'] == 2
+
     def test_oauth_rejection(self, app_client):
         response = app_client.get("/skryv/oauth")
         assert response.status_code == 422
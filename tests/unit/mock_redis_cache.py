@@ -1,10 +1,23 @@
+import threading
+import time
 from app.clients.redis_cache import RedisCache
 # import json
 
 
+class MockSubscription:
+    def __init__(self, callbacks, callback):
+        self.callbacks = callbacks
+        self.callback = callback
+
+    def stop(self):
+        self.callbacks.remove(self.callback)
+
+
 class MockRedisCache(RedisCache):
     def __init__(self) -> str:
         self.redis_cache = {}
+        self.locks = {}
+        self.subscribers = {}
 
     def create_connection(self, redis_url):
         print(
@@ -13,8 +26,15 @@ class MockRedisCache(RedisCache):
     def get(self, key):
         return self.redis_cache.get(key)
 
-    def set(self, key, value):
+    def set(self, key, value, ttl=None):
+        self.redis_cache[key] = value
+
+    def set_if_absent(self, key, value, ttl):
+        # ttl is ignored, keys never expire in the mock
+        if key in self.redis_cache:
+            return False
         self.redis_cache[key] = value
+        return True
 
     def auto_expire(self, key):
         # nothing to do here, is only needed in real redis to maintenance/cleanup
@@ -24,6 +44,155 @@ class MockRedisCache(RedisCache):
         if self.redis_cache.get(key):
             self.redis_cache.pop(key)
 
+    def hget(self, key, field):
+        value = self.redis_cache.get(key, {}).get(field)
+        return value.encode() if value is not None else None
+
+    def hset(self, key, field, value):
+        self.redis_cache.setdefault(key, {})[field] = value
+
+    def incr(self, key):
+        self.redis_cache[key] = int(self.redis_cache.get(key) or 0) + 1
+        return self.redis_cache[key]
+
+    def rpush(self, key, value):
+        self.redis_cache.setdefault(key, []).append(value)
+        return len(self.redis_cache[key])
+
+    def lpush(self, key, value):
+        self.redis_cache.setdefault(key, []).insert(0, value)
+        return len(self.redis_cache[key])
+
+    def lpop(self, key):
+        values = self.redis_cache.get(key)
+        if not values:
+            return None
+        return values.pop(0).encode()
+
+    def llen(self, key):
+        return len(self.redis_cache.get(key) or [])
+
+    def xadd(self, stream, fields, maxlen=None):
+        data = self.redis_cache.setdefault(
+            stream, {'entries': [], 'groups': {}, 'seq': 0}
+        )
+        data['seq'] += 1
+        entry_id = f"{data['seq']}-0".encode()
+        data['entries'].append((
+            entry_id,
+            {k.encode(): str(v).encode() for k, v in fields.items()}
+        ))
+        if maxlen:
+            del data['entries'][:-maxlen]
+        return entry_id
+
+    def xgroup_create(self, stream, group):
+        data = self.redis_cache.setdefault(
+            stream, {'entries': [], 'groups': {}, 'seq': 0}
+        )
+        data['groups'].setdefault(group, {'last': 0, 'pending': {}})
+
+    def xreadgroup(self, stream, group, consumer, entry_id='>', count=1):
+        data = self.redis_cache[stream]
+        state = data['groups'][group]
+        fields = dict(data['entries'])
+        if entry_id == '0':
+            return [
+                (eid, fields.get(eid))
+                for eid, (owner, at, times) in state['pending'].items()
+                if owner == consumer
+            ][:count]
+
+        result = []
+        for eid, entry_fields in data['entries']:
+            seq = int(eid.split(b'-')[0])
+            if seq > state['last'] and len(result) < (count or len(data['entries'])):
+                state['last'] = seq
+                state['pending'][eid] = [consumer, time.time(), 1]
+                result.append((eid, entry_fields))
+        return result
+
+    def xack(self, stream, group, entry_id):
+        pending = self.redis_cache[stream]['groups'][group]['pending']
+        return 1 if pending.pop(entry_id, None) else 0
+
+    def xpending(self, stream, group, count=100):
+        pending = self.redis_cache[stream]['groups'][group]['pending']
+        return [
+            {
+                'message_id': eid,
+                'consumer': owner.encode(),
+                'time_since_delivered': int((time.time() - at) * 1000),
+                'times_delivered': times
+            }
+            for eid, (owner, at, times) in pending.items()
+        ][:count]
+
+    def xclaim(self, stream, group, consumer, min_idle_ms, entry_ids):
+        data = self.redis_cache[stream]
+        pending = data['groups'][group]['pending']
+        fields = dict(data['entries'])
+        claimed = []
+        for eid in entry_ids:
+            owner, at, times = pending[eid]
+            if (time.time() - at) * 1000 >= min_idle_ms:
+                pending[eid] = [consumer, time.time(), times + 1]
+                claimed.append((eid, fields.get(eid)))
+        return claimed
+
+    def xundelivered(self, stream, group):
+        data = self.redis_cache[stream]
+        return data['seq'] > data['groups'][group]['last']
+
+    def publish(self, channel, message):
+        # delivered right away instead of from a subscriber thread
+        for callback in list(self.subscribers.get(channel, [])):
+            callback(str(message).encode())
+
+    def subscribe(self, channel, callback):
+        self.subscribers.setdefault(channel, []).append(callback)
+        return MockSubscription(self.subscribers[channel], callback)
+
+    def lock(self, name, timeout, blocking_timeout):
+        return self.locks.setdefault(name, threading.Lock())
+
+    def reserve_rate_slot(self, key, interval, tolerance, now):
+        tat = max(float(self.redis_cache.get(key) or now), now)
+        self.redis_cache[key] = tat + interval
+        return max(0.0, tat - tolerance - now)
+
+    def take_lease(self, key, owner, ttl, offered=None):
+        if self.redis_cache.get(key) not in (None, owner, offered):
+            return False
+        self.redis_cache[key] = owner
+        return True
+
+    def renew_lease(self, key, owner, ttl):
+        return self.redis_cache.get(key) == owner
+
+    def release_lease(self, key, owner):
+        if self.redis_cache.get(key) == owner:
+            self.redis_cache.pop(key)
+            return True
+        return False
+
+    def offer_lease(self, key, owner, offered, ttl):
+        if self.redis_cache.get(key) == owner:
+            self.redis_cache[key] = offered
+            return True
+        return False
+
+    def heartbeat(self, key, member, ttl):
+        members = self.redis_cache.setdefault(key, {})
+        members[member] = time.time()
+        for name, seen in list(members.items()):
+            if seen < time.time() - ttl:
+                del members[name]
+        return len(members)
+
+    def zrem(self, key, member):
+        return 1 if self.redis_cache.get(key, {}).pop(member, None) else 0
+
     def close(self):
         print("mocked redis cache closing connection")
         # self.redis_cache = {}
@@ -21,19 +21,68 @@ class MockTlClient(MockClient):
     def __init__(self):
         super().__init__()
         self.webhook_url = 'webhook_url_mock'
+        self.circuit_open = False
         # self.mock_id = 'teamleader api mock'
         # self.webhook_url = 'http://localhost:8080'
 
+    def connection_stats(self):
+        return {'connections': 0, 'requests': 0, 'reused': 0}
+
+    def reset_retry_budget(self):
+        pass
+
+    def start_event(self):
+        pass
+
+    def event_stats(self):
+        return {'requests': 0, 'sent': 0, 'avoided': 0, 'fields_skipped': 0}
+
+    def available(self):
+        return not self.circuit_open
+
+    def circuit_breaker_stats(self):
+        return {'open': int(self.circuit_open), 'failures': 0,
+                'opened': 0, 'rejected': 0}
+
+    def renew_token_if_expiring(self):
+        super().method_call("renew_token_if_expiring")
+        return False
+
+    def retry_stats(self):
+        return {'retries': 0, 'rate_limited': 0, 'server_errors': 0,
+                'budget_exhausted': 0, 'backoff_seconds': 0.0}
+
+    def rate_limit_stats(self):
+        limiter_stats = {'calls': 0, 'waits': 0, 'waited_seconds': 0.0}
+        return {'read': limiter_stats, 'write': dict(limiter_stats)}
+
+    def token_refresh_stats(self):
+        return {'refreshed': 0, 'collisions_avoided': 0}
+
+    def company_write_stats(self):
+        return {'sent': 0, 'avoided': 0, 'fields_skipped': 0}
+
     def oauth_check(self):
         return {"status": "ok"}
 
-    def list_custom_fields(self):
+    def list_custom_fields(self, page=1, page_size=50):
         # super().method_call(f"list_custom_fields")
+        if page > 1:
+            return []
+
         fields_fixture = open(
             'tests/fixtures/teamleader/custom_fields.json').read()
         return json.loads(fields_fixture)
 
-    def update_company(self, company):
+    def list_business_types(self, page=1, page_size=50):
+        if page > 1:
+            return []
+
+        types_fixture = open(
+            'tests/fixtures/teamleader/business_types.json').read()
+        return json.loads(types_fixture)
+
+    def update_company(self, company, original=None):
         super().method_call({'update_company': company})
 
     def add_contact(self, contact):
@@ -82,6 +131,14 @@ class MockTlClient(MockClient):
             company = json.loads(company_fixture)
             return company
 
+    def iter_companies(self, updated_since=None, page_size=50):
+        super().method_call(f"iter_companies: {page_size}")
+        return (company for company in [{'id': 'company_1'}, {'id': 'company_2'}])
+
+    def warm_migrate_uuids(self, resource_type, old_external_ids):
+        super().method_call({'warm_migrate_uuids': old_external_ids})
+        return {'cached': 0, 'resolved': len(old_external_ids), 'failed': []}
+
     def list_webhooks(self):
         super().method_call("list_webhooks")
 
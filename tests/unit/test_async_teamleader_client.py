@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   tests/unit/test_async_teamleader_client.py
+#
+
+import pytest
+
+from app.clients.async_teamleader_client import AsyncTeamleaderClient
+from mock_teamleader_client import MockTlClient
+
+
+class TestAsyncTeamleaderClient:
+    @pytest.fixture
+    def mock_tlc(self):
+        return MockTlClient()
+
+    @pytest.mark.asyncio
+    async def test_get_company(self, mock_tlc):
+        atlc = AsyncTeamleaderClient(mock_tlc)
+        company = await atlc.get_company('some_company_uuid')
+        assert company['name'] == 'S.M.A.K.'
+        assert mock_tlc.method_called('get_company: some_company_uuid')
+
+    @pytest.mark.asyncio
+    async def test_update_company(self, mock_tlc):
+        atlc = AsyncTeamleaderClient(mock_tlc)
+        await atlc.update_company({'id': 'some_company_uuid'})
+        assert mock_tlc.last_method_called() == {
+            'update_company': {'id': 'some_company_uuid'}
+        }
+
+    @pytest.mark.asyncio
+    async def test_company_contacts(self, mock_tlc):
+        atlc = AsyncTeamleaderClient(mock_tlc)
+        contacts = await atlc.company_contacts('unknown_company')
+        assert contacts == []
+
+    @pytest.mark.asyncio
+    async def test_oauth_check(self, mock_tlc):
+        atlc = AsyncTeamleaderClient(mock_tlc)
+        result = await atlc.oauth_check()
+        assert result['status'] == 'ok'
+
+    @pytest.mark.asyncio
+    async def test_iter_companies(self, mock_tlc):
+        atlc = AsyncTeamleaderClient(mock_tlc)
+        companies = [c['id'] async for c in atlc.iter_companies(page_size=2)]
+        assert companies == ['company_1', 'company_2']
+        assert mock_tlc.method_called('iter_companies: 2')
+
+    @pytest.mark.asyncio
+    async def test_warm_migrate_uuids(self, mock_tlc):
+        atlc = AsyncTeamleaderClient(mock_tlc)
+        result = await atlc.warm_migrate_uuids('company', ['1', '2'])
+        assert result['resolved'] == 2
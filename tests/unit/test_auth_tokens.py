@@ -10,6 +10,16 @@ from app.clients.teamleader_auth import TeamleaderAuth
 from mock_redis_cache import MockRedisCache
 
 
+class CountingRedisCache(MockRedisCache):
+    def __init__(self):
+        super().__init__()
+        self.loads = 0
+
+    def load(self, key):
+        self.loads += 1
+        return super().load(key)
+
+
 class TestTeamleaderAuth:
     def test_token_saving(self):
         ta = TeamleaderAuth(
@@ -27,3 +37,45 @@ class TestTeamleaderAuth:
     def test_redis_not_passed(self):
         ta = TeamleaderAuth({}, None)
         assert ta.tokens_available() is False
+
+    def test_refresh_lock(self):
+        ta = TeamleaderAuth({}, MockRedisCache())
+        with ta.refresh_lock():
+            assert ta.redis.locks[ta.refresh_lock_key].locked()
+
+        assert not ta.redis.locks[ta.refresh_lock_key].locked()
+
+    def test_refresh_lock_without_redis(self):
+        ta = TeamleaderAuth({}, None)
+        with ta.refresh_lock():
+            assert ta.tokens_available() is False
+
+    def test_token_expiry(self):
+        ta = TeamleaderAuth({}, MockRedisCache())
+        ta.save('somecode', 'some_auth', 'some_refresh', 1700000000.0)
+        assert ta.read() == ('somecode', 'some_auth', 'some_refresh')
+        assert ta.read_expiry() == 1700000000.0
+
+        ta.save('somecode', 'some_auth', 'some_refresh')
+        assert ta.read_expiry() is None
+
+    def test_token_versions_published(self):
+        ta = TeamleaderAuth({}, MockRedisCache())
+        versions = []
+        ta.subscribe(versions.append)
+
+        assert ta.save('somecode', 'some_auth', 'some_refresh') == 1
+        assert ta.save('somecode', 'new_auth', 'new_refresh') == 2
+        assert ta.read_version() == 2
+        assert versions == [1, 2]
+
+    def test_read_all_single_read(self):
+        redis = CountingRedisCache()
+        ta = TeamleaderAuth({}, redis)
+        ta.save('somecode', 'new_auth', 'new_refresh', 1700000000.0)
+
+        token_data = ta.read_all()
+        assert redis.loads == 1
+        assert token_data['token'] == 'new_auth'
+        assert token_data['expires_at'] == 1700000000.0
+        assert token_data['version'] == 1
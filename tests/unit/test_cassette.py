@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   tests/unit/test_cassette.py
+#
+
+import gzip
+import json
+import pytest
+
+from app.clients.cassette import redact_body, request_key, CassetteMissError
+from app.clients.teamleader_client import TeamleaderClient
+from tests.benchmarks.fake_teamleader import FakeTeamleader, fixed_latency
+from tests.unit.mock_redis_cache import MockRedisCache
+from testing_config import tst_app_config
+
+COMPANY_ID = '1b2ab41a-7f59-103b-8cd4-1fcdd5140767'
+CONTACT_ID = '93a20358-4b37-071f-8975-bde813530b50'
+
+
+class RequestMock:
+    def __init__(self, method, url, body=None):
+        self.method = method
+        self.url = url
+        self.body = body
+
+
+class TestCassette:
+    def client_config(self, fake_tl, cassette_file, mode, time_scale=0.0):
+        app_config = tst_app_config()
+        params = app_config['teamleader']
+        params['api_uri'] = fake_tl.url
+        params['auth_uri'] = fake_tl.url
+        params['auth_token'], params['refresh_token'] = fake_tl.issue_token()
+        params['read_rate_limit'] = 0
+        params['write_rate_limit'] = 0
+        params['token_pubsub'] = False
+        params['cassette_mode'] = mode
+        params['cassette_file'] = str(cassette_file)
+        params['cassette_time_scale'] = time_scale
+        return app_config
+
+    def test_redact_body(self):
+        assert json.loads(redact_body(
+            '{"access_token": "secret", "expires_in": 3600}'
+        )) == {'access_token': 'REDACTED', 'expires_in': 3600}
+
+        assert redact_body(
+            'refresh_token=secret&grant_type=refresh_token'
+        ) == 'grant_type=refresh_token&refresh_token=REDACTED'
+
+    def test_request_key(self):
+        first = RequestMock('GET', 'https://api.teamleader.eu/contacts.list?b=2&a=1')
+        second = RequestMock('GET', 'http://127.0.0.1:8765/contacts.list?a=1&b=2')
+        assert request_key(first) == request_key(second)
+
+        post = RequestMock('POST', 'https://app.teamleader.eu/oauth2/access_token',
+                           'refresh_token=one&grant_type=refresh_token')
+        other_token = RequestMock('POST', 'https://app.teamleader.eu/oauth2/access_token',
+                                  'refresh_token=two&grant_type=refresh_token')
+        assert request_key(post) == request_key(other_token)
+
+    def test_record_and_replay(self, tmp_path):
+        cassette_file = tmp_path / 'cassette.jsonl.gz'
+        fake_tl = FakeTeamleader(latency=fixed_latency(0.01)).start()
+        tlc = TeamleaderClient(
+            self.client_config(fake_tl, cassette_file, 'record'),
+            MockRedisCache()
+        )
+        fake_tl.expire_tokens()
+        recorded_company = tlc.get_company(COMPANY_ID)
+        recorded_contact = tlc.get_contact(CONTACT_ID)
+        tlc.close()
+        fake_tl.stop()
+
+        with gzip.open(cassette_file, 'rt') as cassette:
+            recorded = cassette.read()
+        assert 'fake_token' not in recorded
+        assert 'fake_refresh' not in recorded
+        assert len(recorded.splitlines()) == 4   # 401, token refresh, retry, contact
+
+        # replay without the fake teamleader running
+        tlc = TeamleaderClient(
+            self.client_config(fake_tl, cassette_file, 'replay'),
+            MockRedisCache()
+        )
+        assert tlc.get_company(COMPANY_ID) == recorded_company
+        assert tlc.get_contact(CONTACT_ID) == recorded_contact
+        assert tlc.token_refresh_stats()['refreshed'] == 1
+
+        with pytest.raises(CassetteMissError):
+            tlc.get_contact('not_recorded')
+        tlc.close()
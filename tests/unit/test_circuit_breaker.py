@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   tests/unit/test_circuit_breaker.py
+#
+
+from app.clients.circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+
+
+class TestCircuitBreaker:
+    def test_opens_after_threshold(self):
+        cb = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+        cb.record_failure()
+        cb.record_failure()
+        assert cb.state == CLOSED
+        assert cb.allow_request()
+
+        cb.record_failure()
+        assert cb.state == OPEN
+        assert not cb.available()
+        assert not cb.allow_request()
+        assert cb.stats() == {'open': 1, 'failures': 3, 'opened': 1, 'rejected': 1}
+
+    def test_success_resets_failures(self):
+        cb = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+        cb.record_failure()
+        cb.record_success()
+        cb.record_failure()
+        assert cb.state == CLOSED
+
+    def test_half_open_single_probe(self):
+        cb = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+        cb.record_failure()
+        cb.opened_at -= 31
+
+        assert cb.state == HALF_OPEN
+        assert cb.available()
+        assert cb.allow_request()
+        assert not cb.allow_request()
+
+        cb.record_success()
+        assert cb.state == CLOSED
+        assert cb.allow_request()
+
+    def test_failed_probe_opens_again(self):
+        cb = CircuitBreaker(failure_threshold=5, reset_timeout=30)
+        for i in range(5):
+            cb.record_failure()
+        cb.opened_at -= 31
+
+        assert cb.allow_request()
+        cb.record_failure()
+        assert cb.state == OPEN
+        assert cb.stats()['opened'] == 1
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   tests/unit/test_company_update.py
+#
+
+import copy
+import json
+
+from app.clients.company_update import plan_company_update
+
+
+class TestCompanyUpdate:
+    CP_STATUS_ID = 'afe9268c-c6dd-0053-bc5d-d4da5e723daa'
+    TOESTEMMING_ID = '1d0cc259-4b07-01b8-aa5b-100344423db0'
+
+    def company_fixture(self):
+        with open('tests/fixtures/teamleader/test_company.json') as f:
+            return json.loads(f.read())
+
+    def test_nothing_changed(self):
+        original = self.company_fixture()
+        company = copy.deepcopy(original)
+
+        payload, unchanged = plan_company_update(original, company)
+        assert payload is None
+        assert unchanged > 0
+
+    def test_changed_custom_field(self):
+        original = self.company_fixture()
+        company = copy.deepcopy(original)
+        for f in company['custom_fields']:
+            if f['definition']['id'] == self.TOESTEMMING_ID:
+                f['value'] = True
+            if f['definition']['id'] == self.CP_STATUS_ID:
+                f['value'] = 'ja'
+
+        payload, unchanged = plan_company_update(original, company)
+        assert payload == {
+            'id': company['id'],
+            'custom_fields': [{'id': self.TOESTEMMING_ID, 'value': True}]
+        }
+
+    def test_added_custom_field(self):
+        original = self.company_fixture()
+        company = copy.deepcopy(original)
+        company['custom_fields'].append({'id': 'new_field_id', 'value': 'x'})
+
+        payload, unchanged = plan_company_update(original, company)
+        assert payload['custom_fields'] == [{'id': 'new_field_id', 'value': 'x'}]
+
+    def test_changed_list_sent_whole(self):
+        original = self.company_fixture()
+        company = copy.deepcopy(original)
+        company['addresses'][2]['address']['addressee'] = 'Meemoo'
+        company['website'] = 'www.meemoo.be'
+
+        payload, unchanged = plan_company_update(original, company)
+        assert payload['website'] == 'www.meemoo.be'
+        assert len(payload['addresses']) == 3
+        assert 'emails' not in payload
+        assert 'custom_fields' not in payload
+
+    def test_new_field(self):
+        original = self.company_fixture()
+        original.pop('telephones')
+        company = copy.deepcopy(original)
+        company['telephones'] = [{'type': 'phone', 'number': '031234567'}]
+        company['payment_term'] = None
+
+        payload, unchanged = plan_company_update(original, company)
+        assert payload['telephones'][0]['number'] == '031234567'
+        assert 'payment_term' not in payload
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   tests/unit/test_custom_field_cache.py
+#
+
+import pytest
+
+from app.clients.custom_field_cache import CustomFieldCache
+from mock_teamleader_client import MockTlClient
+from mock_redis_cache import MockRedisCache
+
+
+class CountingTlClient(MockTlClient):
+    def list_custom_fields(self, page=1, page_size=50):
+        super().method_call('list_custom_fields')
+        return super().list_custom_fields(page, page_size)
+
+
+class TestCustomFieldCache:
+    def test_loaded_once(self):
+        tlc = CountingTlClient()
+        cache = CustomFieldCache(ttl=3600)
+
+        catalogue = cache.get(tlc)
+        cache.get(tlc)
+        cache.get(tlc)
+
+        assert len(catalogue.custom_fields) >= 31
+        assert tlc.all_method_calls().count('list_custom_fields') == 1
+
+    def test_stale_while_revalidate(self):
+        tlc = CountingTlClient()
+        cache = CustomFieldCache(ttl=0)
+
+        catalogue = cache.get(tlc)
+        catalogue.loaded_at = 0.0
+
+        # expired: stale catalogue is returned while reloading
+        assert cache.get(tlc) is catalogue
+
+    def test_invalidate(self):
+        tlc = CountingTlClient()
+        cache = CustomFieldCache()
+        cache.get(tlc)
+
+        cache.invalidate()
+        assert cache.catalogue is None
+
+        cache.get(tlc)
+        assert tlc.all_method_calls().count('list_custom_fields') == 2
+
+    def test_invalidate_during_get(self):
+        tlc = CountingTlClient()
+        cache = CustomFieldCache()
+        loaded = cache.get(tlc)
+
+        def expired_and_invalidated(catalogue):
+            # admin route invalidates while another event is in get
+            cache.invalidate()
+            return False
+
+        cache.expired = expired_and_invalidated
+        assert cache.get(tlc) is loaded
+
+    def test_redis_snapshot(self):
+        redis_cache = MockRedisCache()
+        CustomFieldCache(redis_cache=redis_cache).get(CountingTlClient())
+
+        # a second replica starts from the snapshot
+        tlc = CountingTlClient()
+        catalogue = CustomFieldCache(redis_cache=redis_cache).get(tlc)
+        assert len(catalogue.custom_fields) >= 31
+        assert not tlc.method_called('list_custom_fields')
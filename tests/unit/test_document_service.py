@@ -6,6 +6,7 @@
 #   tests/unit/test_document_service.py
 #
 
+import asyncio
 import pytest
 import uuid
 import requests_mock
@@ -16,6 +17,7 @@ from app.clients.teamleader_client import TeamleaderClient
 from app.clients.slack_client import SlackClient
 from app.clients.skryv_client import SkryvClient
 from app.clients.common_clients import CommonClients
+from app.clients.custom_field_cache import custom_field_cache
 from app.models.document_body import DocumentBody
 from app.services.document_service import DocumentService
 
@@ -44,6 +46,15 @@ class TestDocumentService:
             MockRedisCache()
         )
 
+    @pytest.fixture
+    async def ws(self, mock_clients):
+        """ started scheduler, stopped again so its consumer task ends """
+        scheduler = WebhookScheduler()
+        scheduler.start(mock_clients)
+        yield scheduler
+        scheduler.stop()
+        await asyncio.sleep(0)
+
     @pytest.fixture
     def mock_client_requests(self):
         slack_client = SlackClient(tst_app_config())
@@ -55,6 +66,8 @@ class TestDocumentService:
         )
         # switch off rate limiting for fast tests
         tlc.RATE_LIMIT = 0.0
+        # custom field definitions are cached process wide, warm from fixtures
+        custom_field_cache.get(MockTlClient())
 
         return CommonClients(
             tlc,
@@ -65,10 +78,7 @@ class TestDocumentService:
         )
 
     @pytest.mark.asyncio
-    async def test_document_update(self, mock_clients):
-        ws = WebhookScheduler()
-        ws.start(mock_clients)
-
+    async def test_document_update(self, ws):
         doc = open("tests/fixtures/document/updated_example.json", "r")
         test_doc = DocumentBody.parse_raw(doc.read())
         doc.close()
@@ -76,10 +86,7 @@ class TestDocumentService:
         assert res == 'document event is handled'
 
     @pytest.mark.asyncio
-    async def test_document_update_addendum(self, mock_clients):
-        ws = WebhookScheduler()
-        ws.start(mock_clients)
-
+    async def test_document_update_addendum(self, ws):
         doc = open("tests/fixtures/document/updated_addendums.json", "r")
         test_doc = DocumentBody.parse_raw(doc.read())
         doc.close()
@@ -87,10 +94,7 @@ class TestDocumentService:
         assert res == 'document event is handled'
 
     @pytest.mark.asyncio
-    async def test_document_briefing(self, mock_clients):
-        ws = WebhookScheduler()
-        ws.start(mock_clients)
-
+    async def test_document_briefing(self, ws):
         doc = open("tests/fixtures/document/updated_addendums.json", "r")
         test_doc = DocumentBody.parse_raw(doc.read())
         test_doc.dossier.dossierDefinition = uuid.UUID(
@@ -101,10 +105,7 @@ class TestDocumentService:
         assert res == 'document event is handled'
 
     @pytest.mark.asyncio
-    async def test_create_document_with_valid_or_id(self, mock_clients):
-        ws = WebhookScheduler()
-        ws.start(mock_clients)
-
+    async def test_create_document_with_valid_or_id(self, ws):
         doc = open("tests/fixtures/document/updated_addendums.json", "r")
         test_doc = DocumentBody.parse_raw(doc.read())
         test_doc.action = 'created'
@@ -113,10 +114,7 @@ class TestDocumentService:
         assert res == 'document event is handled'
 
     @pytest.mark.asyncio
-    async def test_document_create_without_or_id(self, mock_clients):
-        ws = WebhookScheduler()
-        ws.start(mock_clients)
-
+    async def test_document_create_without_or_id(self, ws):
         doc = open("tests/fixtures/document/updated_example.json", "r")
         test_doc = DocumentBody.parse_raw(doc.read())
         doc.close()
@@ -125,6 +123,9 @@ class TestDocumentService:
         assert res == 'document event is handled'
 
     def test_document_service_with_unauthorized_teamleader_api(self, mock_client_requests, requests_mock):
+        # force loading the custom field definitions from teamleader
+        custom_field_cache.invalidate()
+
         requests_mock.get(
             f'{self.API_URL}/customFieldDefinitions.list',
             json={'data': []},
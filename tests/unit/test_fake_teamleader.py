@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   tests/unit/test_fake_teamleader.py
+#
+#   TeamleaderClient against the FakeTeamleader http server
+#
+
+import pytest
+
+from app.clients.teamleader_client import TeamleaderClient
+from tests.benchmarks.fake_teamleader import FakeTeamleader
+from tests.unit.mock_redis_cache import MockRedisCache
+from testing_config import tst_app_config
+
+COMPANY_ID = '1b2ab41a-7f59-103b-8cd4-1fcdd5140767'
+
+
+class TestFakeTeamleader:
+    @pytest.fixture
+    def fake_tl(self):
+        with FakeTeamleader(seed=1) as fake:
+            yield fake
+
+    @pytest.fixture
+    def tlc(self, fake_tl):
+        token, refresh_token = fake_tl.issue_token()
+        app_config = tst_app_config()
+        params = app_config['teamleader']
+        params['api_uri'] = fake_tl.url
+        params['auth_uri'] = fake_tl.url
+        params['auth_token'] = token
+        params['refresh_token'] = refresh_token
+        params['read_rate_limit'] = 0
+        params['write_rate_limit'] = 0
+        params['retry_backoff'] = 0
+        params['token_pubsub'] = False
+
+        tlc = TeamleaderClient(app_config, MockRedisCache())
+        yield tlc
+        tlc.close()
+
+    def test_company_from_fixtures(self, tlc):
+        company = tlc.get_company(COMPANY_ID)
+        assert company['name'] == 'Testorganisatie voor Walter'
+        assert tlc.get_company('unknown_company') == []
+
+    def test_update_company(self, tlc, fake_tl):
+        company = tlc.get_company(COMPANY_ID)
+        company['website'] = 'www.meemoo.be'
+        tlc.update_company(company)
+
+        assert fake_tl.companies[COMPANY_ID]['website'] == 'www.meemoo.be'
+        assert fake_tl.endpoint_calls['companies.update'] == 1
+
+    def test_company_contacts(self, tlc, fake_tl):
+        contacts = tlc.company_contacts(COMPANY_ID)
+        assert len(contacts) == 4
+        assert fake_tl.endpoint_calls['contacts.info'] == 4
+
+    def test_keep_alive(self, tlc, fake_tl):
+        for i in range(5):
+            tlc.get_contact('93a20358-4b37-071f-8975-bde813530b50')
+
+        assert fake_tl.stats['requests'] == 5
+        assert fake_tl.stats['connections'] == 1
+
+    def test_token_expiry(self, tlc, fake_tl):
+        fake_tl.expire_tokens()
+        company = tlc.get_company(COMPANY_ID)
+
+        assert company['id'] == COMPANY_ID
+        assert fake_tl.stats['unauthorized'] == 1
+        assert fake_tl.stats['tokens_issued'] == 2
+        assert tlc.token_refresh_stats()['refreshed'] == 1
+
+    def test_rate_limited(self, tlc, fake_tl):
+        fake_tl.inject_rate_limited(1)
+        tlc.retry_policy.max_delay = 0.0
+
+        assert tlc.get_contact('93a20358-4b37-071f-8975-bde813530b50')
+        assert fake_tl.stats['rate_limited'] == 1
+        assert tlc.retry_stats()['rate_limited'] == 1
+
+    def test_request_budget(self, fake_tl):
+        fake_tl.rate_limit = 2
+        assert not fake_tl.rate_limit_check()[0]
+        limited, headers = fake_tl.rate_limit_check()
+        assert not limited
+        assert headers['X-RateLimit-Remaining'] == 0
+
+        limited, headers = fake_tl.rate_limit_check()
+        assert limited
+        assert headers['Retry-After'] >= 1
+
+    def test_migrate_id(self, tlc):
+        uuid = tlc.get_migrate_uuid('company', '1234')
+        assert uuid == tlc.get_migrate_uuid('company', '1234')
+        assert uuid != tlc.get_migrate_uuid('contact', '1234')
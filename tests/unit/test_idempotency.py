@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   tests/unit/test_idempotency.py
+#
+
+import pytest
+
+from redis.exceptions import RedisError
+from app.comm.idempotency import DeliveryKeys, delivery_key, DUPLICATES
+from app.models.milestone_body import MilestoneBody
+from app.models.process_body import ProcessBody
+from mock_redis_cache import MockRedisCache
+
+
+class FailingRedisCache(MockRedisCache):
+    def set_if_absent(self, key, value, ttl):
+        raise RedisError('connection refused')
+
+
+class TestIdempotency:
+    @pytest.fixture
+    def milestone(self):
+        return MilestoneBody.parse_obj(MilestoneBody.Config.schema_extra['example'])
+
+    @pytest.fixture
+    def process(self):
+        return ProcessBody.parse_obj(ProcessBody.Config.schema_extra['example'])
+
+    def test_delivery_key(self, milestone, process):
+        assert delivery_key('milestone_event', milestone) == delivery_key(
+            'milestone_event', milestone.copy(deep=True)
+        )
+
+        later = milestone.copy(deep=True)
+        later.milestone.timestamp = None
+        assert delivery_key('milestone_event', milestone) != delivery_key(
+            'milestone_event', later
+        )
+
+        created = process.copy(deep=True)
+        created.action = 'created'
+        assert delivery_key('process_event', process) != delivery_key(
+            'process_event', created
+        )
+
+    def test_duplicates_dropped(self, milestone):
+        keys = DeliveryKeys(MockRedisCache())
+        duplicates = DUPLICATES.get(event='milestone_event')
+
+        assert keys.first_delivery('milestone_event', milestone)
+        assert not keys.first_delivery('milestone_event', milestone)
+        assert not keys.first_delivery('milestone_event', milestone.copy(deep=True))
+        assert DUPLICATES.get(event='milestone_event') == duplicates + 2
+
+        keys.forget('milestone_event', milestone)
+        assert keys.first_delivery('milestone_event', milestone)
+
+    def test_redis_unavailable(self, process):
+        keys = DeliveryKeys(FailingRedisCache())
+        assert keys.first_delivery('process_event', process)
+        assert keys.first_delivery('process_event', process)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   tests/unit/test_keyed_executor.py
+#
+
+import asyncio
+import pytest
+
+from app.comm.keyed_executor import KeyedExecutor
+
+
+class TestKeyedExecutor:
+    def recorder(self, log, name, delay):
+        async def run():
+            log.append(f'{name} start')
+            await asyncio.sleep(delay)
+            log.append(f'{name} end')
+        return run
+
+    @pytest.mark.asyncio
+    async def test_same_key_in_order(self):
+        executor = KeyedExecutor(max_concurrency=4)
+        log = []
+        await executor.submit('OR-1', self.recorder(log, 'document', 0.03))
+        await executor.submit('OR-1', self.recorder(log, 'milestone', 0.01))
+        await executor.submit('OR-1', self.recorder(log, 'process', 0.0))
+        await executor.join()
+
+        assert log == [
+            'document start', 'document end',
+            'milestone start', 'milestone end',
+            'process start', 'process end'
+        ]
+        assert executor.stats() == {'partitions': 0, 'pending': 0}
+
+    @pytest.mark.asyncio
+    async def test_other_keys_do_not_wait(self):
+        executor = KeyedExecutor(max_concurrency=4)
+        log = []
+        await executor.submit('OR-slow', self.recorder(log, 'slow', 0.05))
+        await executor.submit('OR-fast', self.recorder(log, 'fast', 0.0))
+        await executor.join()
+
+        assert log.index('fast end') < log.index('slow end')
+
+    @pytest.mark.asyncio
+    async def test_max_concurrency(self):
+        executor = KeyedExecutor(max_concurrency=2)
+        running = []
+        peak = []
+
+        async def event():
+            running.append(1)
+            peak.append(len(running))
+            await asyncio.sleep(0.01)
+            running.pop()
+
+        for i in range(6):
+            await executor.submit(f'OR-{i}', event)
+        await executor.join()
+
+        assert max(peak) == 2
+
+    @pytest.mark.asyncio
+    async def test_failure_keeps_order(self):
+        executor = KeyedExecutor(max_concurrency=2)
+        log = []
+
+        async def failing():
+            log.append('failing')
+            raise ValueError('teamleader said no')
+
+        failed = await executor.submit('OR-1', failing)
+        await executor.submit('OR-1', self.recorder(log, 'next', 0.0))
+        await executor.join()
+
+        assert log == ['failing', 'next start', 'next end']
+        assert isinstance(failed.exception(), ValueError)
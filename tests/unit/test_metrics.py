@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   tests/unit/test_metrics.py
+#
+
+import pytest
+
+from app.comm.metrics import MetricsRegistry, timed, metrics
+
+
+class TestMetrics:
+    def test_counter(self):
+        registry = MetricsRegistry()
+        calls = registry.counter('test_calls_total', 'Test calls', ('endpoint',))
+        calls.inc(endpoint='/companies.info')
+        calls.inc(2, endpoint='/companies.info')
+
+        assert calls.get(endpoint='/companies.info') == 3
+        output = registry.render()
+        assert '# TYPE test_calls_total counter' in output
+        assert 'test_calls_total{endpoint="/companies.info"} 3' in output
+
+    def test_histogram(self):
+        registry = MetricsRegistry()
+        latency = registry.histogram(
+            'test_seconds', 'Test latency', ('endpoint',), buckets=(0.1, 1.0)
+        )
+        latency.observe(0.05, endpoint='/contacts.info')
+        latency.observe(0.5, endpoint='/contacts.info')
+
+        output = registry.render()
+        assert 'test_seconds_bucket{endpoint="/contacts.info",le="0.1"} 1' in output
+        assert 'test_seconds_bucket{endpoint="/contacts.info",le="1.0"} 2' in output
+        assert 'test_seconds_bucket{endpoint="/contacts.info",le="+Inf"} 2' in output
+        assert 'test_seconds_sum{endpoint="/contacts.info"} 0.55' in output
+        assert 'test_seconds_count{endpoint="/contacts.info"} 2' in output
+
+    def test_gauge_collector(self):
+        registry = MetricsRegistry()
+        size = registry.gauge('test_cache_size', 'Test cache size')
+        registry.add_collector(lambda: size.set(42))
+
+        assert 'test_cache_size 42' in registry.render()
+
+    def test_label_escaping(self):
+        registry = MetricsRegistry()
+        errors = registry.counter('test_errors_total', 'Test errors', ('error',))
+        errors.inc(error='say "hi"')
+
+        assert 'test_errors_total{error="say \\"hi\\""} 1' in registry.render()
+
+    def test_timed(self):
+        @timed('test_service')
+        def failing_call():
+            raise ValueError('connection lost')
+
+        with pytest.raises(ValueError):
+            failing_call()
+
+        output = metrics.render()
+        assert 'skryv_external_call_errors_total{service="test_service",operation="failing_call"} 1' in output
+        assert 'skryv_external_call_duration_seconds_count{service="test_service",operation="failing_call"} 1' in output
@@ -9,6 +9,7 @@
 import uuid
 import requests_mock
 import json
+import asyncio
 import pytest
 
 from app.comm.webhook_scheduler import WebhookScheduler
@@ -16,6 +17,7 @@ from app.clients.slack_client import SlackClient
 from app.clients.skryv_client import SkryvClient
 from app.clients.teamleader_client import TeamleaderClient
 from app.clients.common_clients import CommonClients
+from app.clients.custom_field_cache import custom_field_cache
 from app.models.milestone_body import MilestoneBody
 from app.models.document_body import DocumentBody
 from app.services.milestone_service import MilestoneService
@@ -28,6 +30,17 @@ from mock_redis_cache import MockRedisCache
 
 from testing_config import tst_app_config
 
+VAT_REJECTED = {'errors': [{
+    'code': 400,
+    'title': 'The vat number is invalid',
+    'source': {'pointer': '/vat_number'}
+}]}
+NAME_REJECTED = {'errors': [{
+    'code': 400,
+    'title': 'The name field is required',
+    'source': {'pointer': '/name'}
+}]}
+
 
 class TestMilestoneService():
     API_URL = 'https://api.teamleader.eu'
@@ -46,6 +59,15 @@ class TestMilestoneService():
             MockRedisCache()
         )
 
+    @pytest.fixture
+    async def ws(self, mock_clients):
+        """ started scheduler, stopped again so its consumer task ends """
+        scheduler = WebhookScheduler()
+        scheduler.start(mock_clients)
+        yield scheduler
+        scheduler.stop()
+        await asyncio.sleep(0)
+
     @pytest.fixture
     def mock_client_requests(self):
         slack_client = SlackClient(tst_app_config())
@@ -57,6 +79,8 @@ class TestMilestoneService():
         )
         # switch off rate limiting for fast tests
         tlc.RATE_LIMIT = 0.0
+        # custom field definitions are cached process wide, warm from fixtures
+        custom_field_cache.get(MockTlClient())
 
         return CommonClients(
             tlc,
@@ -66,6 +90,12 @@ class TestMilestoneService():
             MockRedisCache()
         )
 
+    def company_failed_messages(self, clients):
+        return len([
+            call for call in clients.slack.slack_wrapper.all_method_calls()
+            if 'when updating company' in call
+        ])
+
     def teamleader_fixture(self, json_file):
         f = open(f"tests/fixtures/teamleader/{json_file}")
         data = json.loads(f.read())
@@ -73,16 +103,33 @@ class TestMilestoneService():
         return data
 
     @pytest.mark.asyncio
-    async def test_milestone_akkoord(self, mock_clients):
-        ws = WebhookScheduler()
-        ws.start(mock_clients)
-
+    async def test_milestone_akkoord(self, ws):
         ms = open("tests/fixtures/milestone/milestone_opstart.json", "r")
         test_milestone = MilestoneBody.parse_raw(ms.read())
         ms.close()
         res = await ws.execute_webhook('milestone_event', test_milestone)
         assert res == 'milestone event is handled'
 
+    @pytest.mark.asyncio
+    async def test_milestone_vat_in_same_update(self, ws, mock_clients):
+        doc = open("tests/fixtures/document/update_contacts_itv.json", "r")
+        test_doc = DocumentBody.parse_raw(doc.read())
+        doc.close()
+        await ws.execute_webhook('document_event', test_doc)
+
+        ms = open("tests/fixtures/milestone/milestone_opstart.json", "r")
+        test_milestone = MilestoneBody.parse_raw(ms.read())
+        ms.close()
+        await ws.execute_webhook('milestone_event', test_milestone)
+
+        tlc = mock_clients.teamleader
+        company_updates = [
+            c['update_company'] for c in tlc.all_method_calls()
+            if isinstance(c, dict) and 'update_company' in c
+        ]
+        assert len(company_updates) == 1
+        assert company_updates[0]['vat_number'] == 'BE 0644.450.380'
+
     # we call the services directly here, allowing more fine grained testing
     def test_milestone_error_in_contacts(self, mock_client_requests, requests_mock):
         # send a document event, so mocked redis stores it for actual milestone call
@@ -184,11 +231,12 @@ class TestMilestoneService():
         assert 'companies.update' in requests_mock.last_request.url
         company_updated = requests_mock.last_request.body
 
-        # validate cp status is updated here
-        assert '"afe9268c-c6dd-0053-bc5d-d4da5e723daa", "value": "ja"' in company_updated
-        assert '"bcf9ceba-a988-0fc6-805f-9e087ea23dac", "value": "ingevuld"' in company_updated
-        assert '"05cf38ba-2d6f-01fe-a85f-dd84aad23dae", "value": true' in company_updated
+        # validate cp status is updated here, only toestemming starten changes
+        # cp status, intentieverklaring and swo already have these values
         assert '"1d0cc259-4b07-01b8-aa5b-100344423db0", "value": true' in company_updated
+        assert 'afe9268c-c6dd-0053-bc5d-d4da5e723daa' not in company_updated
+        assert 'bcf9ceba-a988-0fc6-805f-9e087ea23dac' not in company_updated
+        assert '05cf38ba-2d6f-01fe-a85f-dd84aad23dae' not in company_updated
 
     def test_milestone_error_in_contacts_link(self, mock_client_requests, requests_mock):
         requests_mock.get(
@@ -276,11 +324,12 @@ class TestMilestoneService():
         assert 'companies.update' in requests_mock.last_request.url
         company_updated = requests_mock.last_request.body
 
-        # validate cp status is updated here
-        assert '"afe9268c-c6dd-0053-bc5d-d4da5e723daa", "value": "ja"' in company_updated
-        assert '"bcf9ceba-a988-0fc6-805f-9e087ea23dac", "value": "ingevuld"' in company_updated
-        assert '"05cf38ba-2d6f-01fe-a85f-dd84aad23dae", "value": true' in company_updated
+        # validate cp status is updated here, only toestemming starten changes
+        # cp status, intentieverklaring and swo already have these values
         assert '"1d0cc259-4b07-01b8-aa5b-100344423db0", "value": true' in company_updated
+        assert 'afe9268c-c6dd-0053-bc5d-d4da5e723daa' not in company_updated
+        assert 'bcf9ceba-a988-0fc6-805f-9e087ea23dac' not in company_updated
+        assert '05cf38ba-2d6f-01fe-a85f-dd84aad23dae' not in company_updated
 
     def test_milestone_edge_cases_1(self, mock_client_requests, requests_mock):
         requests_mock.get(
@@ -391,11 +440,12 @@ class TestMilestoneService():
         assert 'companies.update' in requests_mock.last_request.url
         company_updated = requests_mock.last_request.body
 
-        # validate cp status is updated here
-        assert '"afe9268c-c6dd-0053-bc5d-d4da5e723daa", "value": "ja"' in company_updated
-        assert '"bcf9ceba-a988-0fc6-805f-9e087ea23dac", "value": "ingevuld"' in company_updated
-        assert '"05cf38ba-2d6f-01fe-a85f-dd84aad23dae", "value": true' in company_updated
+        # validate cp status is updated here, only toestemming starten changes
+        # cp status, intentieverklaring and swo already have these values
         assert '"1d0cc259-4b07-01b8-aa5b-100344423db0", "value": true' in company_updated
+        assert 'afe9268c-c6dd-0053-bc5d-d4da5e723daa' not in company_updated
+        assert 'bcf9ceba-a988-0fc6-805f-9e087ea23dac' not in company_updated
+        assert '05cf38ba-2d6f-01fe-a85f-dd84aad23dae' not in company_updated
 
     def test_milestone_edge_cases_2(self, mock_client_requests, requests_mock):
         requests_mock.get(
@@ -446,11 +496,12 @@ class TestMilestoneService():
         assert 'companies.update' in requests_mock.last_request.url
         company_updated = requests_mock.last_request.body
 
-        # validate cp status is updated here
-        assert '"afe9268c-c6dd-0053-bc5d-d4da5e723daa", "value": "ja"' in company_updated
-        assert '"bcf9ceba-a988-0fc6-805f-9e087ea23dac", "value": "ingevuld"' in company_updated
-        assert '"05cf38ba-2d6f-01fe-a85f-dd84aad23dae", "value": true' in company_updated
+        # validate cp status is updated here, only toestemming starten changes
+        # cp status, intentieverklaring and swo already have these values
         assert '"1d0cc259-4b07-01b8-aa5b-100344423db0", "value": true' in company_updated
+        assert 'afe9268c-c6dd-0053-bc5d-d4da5e723daa' not in company_updated
+        assert 'bcf9ceba-a988-0fc6-805f-9e087ea23dac' not in company_updated
+        assert '05cf38ba-2d6f-01fe-a85f-dd84aad23dae' not in company_updated
 
     def test_milestone_company_not_found(self, mock_client_requests, requests_mock):
         # send a document event, so mocked redis stores it for
@@ -501,7 +552,8 @@ class TestMilestoneService():
 
         assert 'companies.update' not in requests_mock.last_request.url
 
-    def test_milestone_edge_case_invalid_btw(self, mock_client_requests, requests_mock):
+    @pytest.mark.parametrize('rejected', [VAT_REJECTED, NAME_REJECTED])
+    def test_milestone_edge_case_invalid_btw(self, mock_client_requests, requests_mock, rejected):
         requests_mock.get(
             f'{self.API_URL}/customFieldDefinitions.list',
             json={'data': self.teamleader_fixture('custom_fields.json')}
@@ -521,6 +573,8 @@ class TestMilestoneService():
         test_company.pop('addresses')
         test_company.pop('emails')
         test_company.pop('telephones')
+        # vat number is not yet known in teamleader
+        test_company['vat_number'] = None
         requests_mock.get(
             f'{self.API_URL}/companies.info?id={company_id}',
             json={'data': test_company}
@@ -578,12 +632,12 @@ class TestMilestoneService():
             status_code=200
         )
 
-        # make second update request with vat number fail
+        # combined update with vat number fails, retry without it succeeds
         requests_mock.post(
             f'{self.API_URL}/companies.update',
             [
-                {'json': {'data': 'success'}, 'status_code': 200},
-                {'json': {'data': 'vat failed'}, 'status_code': 400}
+                {'json': rejected, 'status_code': 400},
+                {'json': {'data': 'success'}, 'status_code': 200}
             ]
         )
 
@@ -594,13 +648,21 @@ class TestMilestoneService():
         ms = MilestoneService(mock_client_requests)
         ms.handle_event(test_milestone)
 
-        assert 'companies.update' in requests_mock.last_request.url
-        company_updated = requests_mock.last_request.body
-
-        # validate cp status is updated here
-        assert '"afe9268c-c6dd-0053-bc5d-d4da5e723daa", "value": "ja"' in company_updated
-        assert '"bcf9ceba-a988-0fc6-805f-9e087ea23dac", "value": "ingevuld"' in company_updated
-        assert '"05cf38ba-2d6f-01fe-a85f-dd84aad23dae", "value": true' in company_updated
+        company_updates = [
+            r for r in requests_mock.request_history if 'companies.update' in r.url
+        ]
+        assert '"vat_number": "BE 0644.450.380"' in company_updates[0].body
+        assert self.company_failed_messages(mock_client_requests) == 1
+        if rejected is NAME_REJECTED:
+            # only a rejected vat number is retried without it
+            assert len(company_updates) == 1
+            return
+
+        assert len(company_updates) == 2
+        company_updated = company_updates[1].body
+
+        # second request saves the other changes without the vat number
+        assert 'vat_number' not in company_updated
         assert '"1d0cc259-4b07-01b8-aa5b-100344423db0", "value": true' in company_updated
 
     def test_facturatienaam_without_adresses(self, mock_client_requests, requests_mock):
@@ -617,10 +679,7 @@ class TestMilestoneService():
         assert updated_company['addresses'][0]['address']['addressee'] == 'some name'
 
     @pytest.mark.asyncio
-    async def test_milestone_geen_opstart(self, mock_clients):
-        ws = WebhookScheduler()
-        ws.start(mock_clients)
-
+    async def test_milestone_geen_opstart(self, ws):
         ms = open("tests/fixtures/milestone/milestone_geen_opstart.json", "r")
         test_milestone = MilestoneBody.parse_raw(ms.read())
         ms.close()
@@ -628,10 +687,7 @@ class TestMilestoneService():
         assert res == 'milestone event is handled'
 
     @pytest.mark.asyncio
-    async def test_milestone_later(self, mock_clients):
-        ws = WebhookScheduler()
-        ws.start(mock_clients)
-
+    async def test_milestone_later(self, ws, mock_clients):
         doc = open("tests/fixtures/document/updated_example.json", "r")
         test_doc = DocumentBody.parse_raw(doc.read())
         doc.close()
@@ -653,10 +709,7 @@ class TestMilestoneService():
         assert 'ingevuld' not in str(updated_company['custom_fields'])
 
     @pytest.mark.asyncio
-    async def test_milestone_geen_interesse(self, mock_clients):
-        ws = WebhookScheduler()
-        ws.start(mock_clients)
-
+    async def test_milestone_geen_interesse(self, ws, mock_clients):
         doc = open("tests/fixtures/document/updated_example.json", "r")
         test_doc = DocumentBody.parse_raw(doc.read())
         doc.close()
@@ -678,10 +731,7 @@ class TestMilestoneService():
         assert 'pending' not in str(updated_company['custom_fields'])
 
     @pytest.mark.asyncio
-    async def test_milestone_interesse(self, mock_clients):
-        ws = WebhookScheduler()
-        ws.start(mock_clients)
-
+    async def test_milestone_interesse(self, ws, mock_clients):
         doc = open("tests/fixtures/document/updated_example.json", "r")
         test_doc = DocumentBody.parse_raw(doc.read())
         doc.close()
@@ -703,10 +753,7 @@ class TestMilestoneService():
         assert 'ingevuld' not in str(updated_company['custom_fields'])
 
     @pytest.mark.asyncio
-    async def test_milestone_swo(self, mock_clients):
-        ws = WebhookScheduler()
-        ws.start(mock_clients)
-
+    async def test_milestone_swo(self, ws):
         ms = open("tests/fixtures/milestone/milestone_swo_akkoord.json", "r")
         test_milestone = MilestoneBody.parse_raw(ms.read())
         ms.close()
@@ -714,10 +761,7 @@ class TestMilestoneService():
         assert res == 'milestone event is handled'
 
     @pytest.mark.asyncio
-    async def test_milestone_missing_external_id(self, mock_clients):
-        ws = WebhookScheduler()
-        ws.start(mock_clients)
-
+    async def test_milestone_missing_external_id(self, ws):
         ms = open("tests/fixtures/milestone/milestone_opstart.json", "r")
         test_milestone = MilestoneBody.parse_raw(ms.read())
         test_milestone.dossier.externalId = None
@@ -726,10 +770,7 @@ class TestMilestoneService():
         assert res == 'milestone event is handled'
 
     @pytest.mark.asyncio
-    async def test_milestone_briefing(self, mock_clients):
-        ws = WebhookScheduler()
-        ws.start(mock_clients)
-
+    async def test_milestone_briefing(self, ws):
         ms = open("tests/fixtures/milestone/milestone_opstart.json", "r")
         test_milestone = MilestoneBody.parse_raw(ms.read())
         test_milestone.dossier.dossierDefinition = uuid.UUID(
@@ -740,10 +781,7 @@ class TestMilestoneService():
         assert res == 'milestone event is handled'
 
     @pytest.mark.asyncio
-    async def test_milestone_with_unknown_org(self, mock_clients):
-        ws = WebhookScheduler()
-        ws.start(mock_clients)
-
+    async def test_milestone_with_unknown_org(self, ws):
         # send a document event, so mocked redis stores it for
         # actual milestone call
         doc = open("tests/fixtures/document/updated_example.json", "r")
@@ -761,11 +799,7 @@ class TestMilestoneService():
         assert res == 'milestone event is handled'
 
     @pytest.mark.asyncio
-    async def test_milestone_some_contacts_sync(self, mock_clients):
-
-        ws = WebhookScheduler()
-        ws.start(mock_clients)
-
+    async def test_milestone_some_contacts_sync(self, ws, mock_clients):
         # send a document event, so mocked redis stores it for
         # actual milestone call
         doc = open("tests/fixtures/document/updated_example.json", "r")
@@ -785,11 +819,7 @@ class TestMilestoneService():
         assert tlc.method_called('update_company')
 
     @pytest.mark.asyncio
-    async def test_milestone_contacts_and_adresses_sync(self, mock_clients):
-
-        ws = WebhookScheduler()
-        ws.start(mock_clients)
-
+    async def test_milestone_contacts_and_adresses_sync(self, ws, mock_clients):
         # send a document event, so mocked redis stores it for
         # actual milestone call
         doc = open("tests/fixtures/document/update_contacts_itv.json", "r")
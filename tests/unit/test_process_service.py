@@ -6,6 +6,7 @@
 #   tests/unit/test_process_service.py
 #
 
+import asyncio
 import pytest
 import uuid
 import requests_mock
@@ -15,6 +16,7 @@ from app.comm.webhook_scheduler import WebhookScheduler
 from app.clients.slack_client import SlackClient
 from app.clients.skryv_client import SkryvClient
 from app.clients.common_clients import CommonClients
+from app.clients.custom_field_cache import custom_field_cache
 from app.clients.teamleader_client import TeamleaderClient
 from app.models.process_body import ProcessBody
 from app.models.document_body import DocumentBody
@@ -46,6 +48,15 @@ class TestProcessService:
             MockRedisCache()
         )
 
+    @pytest.fixture
+    async def ws(self, mock_clients):
+        """ started scheduler, stopped again so its consumer task ends """
+        scheduler = WebhookScheduler()
+        scheduler.start(mock_clients)
+        yield scheduler
+        scheduler.stop()
+        await asyncio.sleep(0)
+
     @pytest.fixture
     def mock_client_requests(self):
         slack_client = SlackClient(tst_app_config())
@@ -57,6 +68,8 @@ class TestProcessService:
         )
         # switch off rate limiting for fast tests
         tlc.RATE_LIMIT = 0.0
+        # custom field definitions are cached process wide, warm from fixtures
+        custom_field_cache.get(MockTlClient())
 
         return CommonClients(
             tlc,
@@ -73,10 +86,7 @@ class TestProcessService:
         return data
 
     @pytest.mark.asyncio
-    async def test_process_created_event(self, mock_clients):
-        ws = WebhookScheduler()
-        ws.start(mock_clients)
-
+    async def test_process_created_event(self, ws):
         proc = open("tests/fixtures/process/process_created.json", "r")
         test_process = ProcessBody.parse_raw(proc.read())
         proc.close()
@@ -84,10 +94,7 @@ class TestProcessService:
         assert res == 'process event is handled'
 
     @pytest.mark.asyncio
-    async def test_process_created_briefing(self, mock_clients):
-        ws = WebhookScheduler()
-        ws.start(mock_clients)
-
+    async def test_process_created_briefing(self, ws):
         proc = open("tests/fixtures/process/process_created.json", "r")
         test_process = ProcessBody.parse_raw(proc.read())
         test_process.dossier.dossierDefinition = uuid.UUID(
@@ -98,10 +105,7 @@ class TestProcessService:
         assert res == 'process event is handled'
 
     @pytest.mark.asyncio
-    async def test_process_created_without_external_id(self, mock_clients):
-        ws = WebhookScheduler()
-        ws.start(mock_clients)
-
+    async def test_process_created_without_external_id(self, ws):
         proc = open("tests/fixtures/process/process_created.json", "r")
         test_process = ProcessBody.parse_raw(proc.read())
         test_process.dossier.externalId = None
@@ -110,10 +114,7 @@ class TestProcessService:
         assert res == 'process event is handled'
 
     @pytest.mark.asyncio
-    async def test_process_ended(self, mock_clients):
-        ws = WebhookScheduler()
-        ws.start(mock_clients)
-
+    async def test_process_ended(self, ws):
         doc = open("tests/fixtures/document/updated_addendums.json", "r")
         test_doc = DocumentBody.parse_raw(doc.read())
         doc.close()
@@ -127,10 +128,7 @@ class TestProcessService:
         assert res == 'process event is handled'
 
     @pytest.mark.asyncio
-    async def test_process_ended_empty_addendums(self, mock_clients):
-        ws = WebhookScheduler()
-        ws.start(mock_clients)
-
+    async def test_process_ended_empty_addendums(self, ws):
         doc = open("tests/fixtures/document/updated_addendums.json", "r")
         test_doc = DocumentBody.parse_raw(doc.read())
         doc.close()
@@ -145,10 +143,7 @@ class TestProcessService:
         assert res == 'process event is handled'
 
     @pytest.mark.asyncio
-    async def test_process_missing_document(self, mock_clients):
-        ws = WebhookScheduler()
-        ws.start(mock_clients)
-
+    async def test_process_missing_document(self, ws):
         proc = open("tests/fixtures/process/process_ended.json", "r")
         test_process = ProcessBody.parse_raw(proc.read())
         proc.close()
@@ -156,10 +151,7 @@ class TestProcessService:
         assert res == 'process event is handled'
 
     @pytest.mark.asyncio
-    async def test_process_ended_unknown_org(self, mock_clients):
-        ws = WebhookScheduler()
-        ws.start(mock_clients)
-
+    async def test_process_ended_unknown_org(self, ws):
         doc = open("tests/fixtures/document/updated_addendums.json", "r")
         test_doc = DocumentBody.parse_raw(doc.read())
         doc.close()
@@ -175,10 +167,7 @@ class TestProcessService:
         assert res == 'process event is handled'
 
     @pytest.mark.asyncio
-    async def test_process_unknown_action(self, mock_clients):
-        ws = WebhookScheduler()
-        ws.start(mock_clients)
-
+    async def test_process_unknown_action(self, ws):
         proc = open("tests/fixtures/process/process_ended.json", "r")
         test_process = ProcessBody.parse_raw(proc.read())
         test_process.action = "something else"
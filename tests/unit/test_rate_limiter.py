@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   tests/unit/test_rate_limiter.py
+#
+
+import pytest
+
+from app.clients.rate_limiter import RateLimiter
+from mock_redis_cache import MockRedisCache
+
+
+class TestRateLimiter:
+    def test_burst_without_waiting(self):
+        rl = RateLimiter('test_rate', 10.0, burst=3)
+        assert rl.reserve() == 0
+        assert rl.reserve() == 0
+        assert rl.reserve() == 0
+
+        # bucket is empty now, next caller needs to wait about one interval
+        assert rl.reserve() > 9.0
+
+    def test_shared_budget_in_redis(self):
+        redis_cache = MockRedisCache()
+        worker1 = RateLimiter('test_rate', 10.0, 1, redis_cache)
+        worker2 = RateLimiter('test_rate', 10.0, 1, redis_cache)
+
+        assert worker1.reserve() == 0
+        assert worker2.reserve() > 9.0
+
+    def test_separate_budgets(self):
+        redis_cache = MockRedisCache()
+        reads = RateLimiter('test_rate_read', 10.0, 1, redis_cache)
+        writes = RateLimiter('test_rate_write', 10.0, 1, redis_cache)
+
+        assert reads.reserve() == 0
+        assert writes.reserve() == 0
+
+    def test_acquire_stats(self):
+        rl = RateLimiter('test_rate', 0.01, burst=1)
+        rl.acquire()
+        rl.acquire()
+
+        stats = rl.stats()
+        assert stats['calls'] == 2
+        assert stats['waits'] == 1
+        assert stats['waited_seconds'] > 0
@@ -21,7 +21,7 @@ class MockedRedis:
     def get(self, key):
         return self.data.get(key)
 
-    def set(self, key, value):
+    def set(self, key, value, ex=None):
         self.data[key] = value
 
     def expire(self, key, seconds):
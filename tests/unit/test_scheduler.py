@@ -6,10 +6,13 @@
 #   tests/unit/test_scheduler.py
 #
 
+import asyncio
 import pytest
+import threading
 import uuid
 
-from app.comm.webhook_scheduler import WebhookScheduler
+from app.comm.webhook_scheduler import WebhookScheduler, SERVICES, HANDLER_SECONDS, HANDLER_WAIT_SECONDS
+from app.comm.webhook_queue import StreamWebhookQueue
 from app.clients.slack_client import SlackClient
 from app.clients.skryv_client import SkryvClient
 from app.clients.common_clients import CommonClients
@@ -39,17 +42,33 @@ class TestScheduler:
             MockRedisCache()
         )
 
+    @pytest.fixture
+    async def ws(self):
+        """ started by the tests, always stopped so its consumer task ends """
+        scheduler = WebhookScheduler()
+        yield scheduler
+        scheduler.stop()
+        await asyncio.sleep(0)
+
     @pytest.mark.asyncio
-    async def test_invalid_webhook(self, mock_clients):
-        ws = WebhookScheduler()
+    async def test_invalid_webhook(self, ws, mock_clients):
         ws.start(mock_clients)
+        ws.stop()
         res = await ws.execute_webhook('something_bad', 'some_id')
         assert res is None
 
     @pytest.mark.asyncio
-    async def test_scheduling(self, mock_clients):
-        ws = WebhookScheduler()
+    async def test_token_renewal(self, ws, mock_clients):
         ws.start(mock_clients)
+        ws.stop()
+        await ws.token_renewal()
+        assert mock_clients.teamleader.method_called('renew_token_if_expiring')
+
+    @pytest.mark.asyncio
+    async def test_scheduling(self, ws, mock_clients):
+        ws.start(mock_clients)
+        # drive webhook_processing ourselves instead of the consumer task
+        ws.stop()
         assert ws.webhook_queue.empty()
 
         doc = open("tests/fixtures/document/updated_addendums.json", "r")
@@ -61,3 +80,206 @@ class TestScheduler:
 
         await ws.webhook_processing()
         assert ws.webhook_queue.empty()
+
+    @pytest.mark.asyncio
+    async def test_park_and_replay(self, ws, mock_clients):
+        ws.start(mock_clients)
+        ws.stop()
+        mock_clients.teamleader.circuit_open = True
+
+        doc = open("tests/fixtures/document/updated_addendums.json", "r")
+        test_doc = DocumentBody.parse_raw(doc.read())
+        doc.close()
+
+        # different documents, versions of one document are coalesced
+        for _ in range(3):
+            other_doc = test_doc.copy(deep=True)
+            other_doc.document.id = uuid.uuid4()
+            ws.schedule('document_event', other_doc)
+        await ws.webhook_processing()
+        assert ws.webhook_queue.empty()
+        assert ws.parked_events.count() == 3
+        assert mock_clients.slack.slack_wrapper.method_called('Teamleader API is unavailable')
+
+        # circuit closes, parked events are replayed replay_limit at a time
+        mock_clients.teamleader.circuit_open = False
+        await ws.webhook_processing()
+        assert ws.parked_events.count() == 1
+        await ws.webhook_processing()
+        assert ws.parked_events.count() == 0
+
+    @pytest.mark.asyncio
+    async def test_events_wait_behind_parked(self, ws, mock_clients):
+        ws.start(mock_clients)
+
+        doc = open("tests/fixtures/document/updated_addendums.json", "r")
+        test_doc = DocumentBody.parse_raw(doc.read())
+        doc.close()
+
+        ws.parked_events.park('document_event', test_doc)
+        res = await ws.run_or_park('document_event', test_doc)
+        assert res == 'document_event is parked'
+        assert ws.parked_events.count() == 2
+
+        name, params = ws.parked_events.unpark()
+        assert name == 'document_event'
+        assert params == test_doc
+
+    @pytest.mark.asyncio
+    async def test_consumer_wakes_on_schedule(self, ws, mock_clients):
+        ws.start(mock_clients)
+
+        doc = open("tests/fixtures/document/updated_addendums.json", "r")
+        test_doc = DocumentBody.parse_raw(doc.read())
+        doc.close()
+
+        # no webhook_processing call, the consumer drains the queue itself
+        for i in range(10):
+            ws.schedule('document_event', test_doc)
+
+        for i in range(100):
+            if ws.webhook_queue.empty() and mock_clients.redis.load_document(test_doc.dossier.id):
+                break
+            await asyncio.sleep(0.01)
+
+        assert ws.webhook_queue.empty()
+        assert mock_clients.redis.load_document(test_doc.dossier.id)
+        ws.stop()
+
+    @pytest.mark.asyncio
+    async def test_duplicate_delivery_not_queued(self, ws, mock_clients):
+        ws.start(mock_clients, delivery_ttl=3600)
+        ws.stop()
+
+        milestone = MilestoneBody.parse_obj(MilestoneBody.Config.schema_extra['example'])
+        assert ws.schedule('milestone_event', milestone)
+        assert not ws.schedule('milestone_event', milestone.copy(deep=True))
+
+        assert ws.webhook_queue.get()['params'] == milestone
+        assert ws.webhook_queue.get() is None
+
+    @pytest.mark.asyncio
+    async def test_stream_queue_ack(self, ws, mock_clients):
+        whq = StreamWebhookQueue({'webhook_claim_idle': 0}, mock_clients.redis)
+        ws.start(mock_clients, whq)
+
+        doc = open("tests/fixtures/document/updated_addendums.json", "r")
+        test_doc = DocumentBody.parse_raw(doc.read())
+        doc.close()
+
+        ws.schedule('document_event', test_doc)
+        ws.schedule('invalid_event', test_doc)
+        await ws.webhook_processing()
+
+        assert ws.webhook_queue.empty()
+        stream = whq.partition_stream(test_doc)
+        assert mock_clients.redis.xpending(stream, whq.group) == []
+        assert mock_clients.redis.load_document(test_doc.dossier.id)
+
+        # partitions are released for other workers on stop
+        ws.stop()
+        assert whq.owned == []
+        assert mock_clients.redis.get(whq.lease_key(stream)) is None
+
+    @pytest.mark.asyncio
+    async def test_stream_queue_acks_failed_event(self, ws, mock_clients, monkeypatch):
+        whq = StreamWebhookQueue({'webhook_claim_idle': 0}, mock_clients.redis)
+        ws.start(mock_clients, whq)
+
+        class FailingService:
+            def __init__(self, clients):
+                pass
+
+            def handle_event(self, params):
+                raise ValueError('companies.update failed')
+
+        monkeypatch.setitem(SERVICES, 'document_event', FailingService)
+        doc = open("tests/fixtures/document/updated_addendums.json", "r")
+        test_doc = DocumentBody.parse_raw(doc.read())
+        doc.close()
+
+        ws.schedule('document_event', test_doc)
+        await ws.webhook_processing()
+
+        # not delivered again after newer events of the dossier
+        stream = whq.partition_stream(test_doc)
+        assert mock_clients.redis.xpending(stream, whq.group) == []
+        assert whq.reclaim() == 0
+
+    @pytest.mark.asyncio
+    async def test_stream_queue_off_event_loop(self, ws, mock_clients):
+        whq = StreamWebhookQueue({'webhook_claim_idle': 0}, mock_clients.redis)
+        ws.start(mock_clients, whq)
+        threads = []
+
+        def recorded(name, method):
+            def call(*args):
+                threads.append((name, threading.current_thread()))
+                return method(*args)
+            return call
+
+        for name in ('get', 'ack', 'reclaim'):
+            setattr(whq, name, recorded(name, getattr(whq, name)))
+
+        doc = open("tests/fixtures/document/updated_addendums.json", "r")
+        test_doc = DocumentBody.parse_raw(doc.read())
+        doc.close()
+
+        ws.schedule('document_event', test_doc)
+        await ws.webhook_processing()
+        await ws.reclaim_check()
+
+        assert {name for name, thread in threads} == {'get', 'ack', 'reclaim'}
+        assert threading.main_thread() not in [thread for name, thread in threads]
+
+    @pytest.mark.asyncio
+    async def test_partition_key(self, ws, mock_clients):
+        ws.start(mock_clients, concurrency=2)
+        ws.stop()
+
+        doc = open("tests/fixtures/document/updated_addendums.json", "r")
+        test_doc = DocumentBody.parse_raw(doc.read())
+        doc.close()
+
+        assert ws.partition_key(test_doc) == test_doc.dossier.externalId
+        test_doc.dossier.externalId = None
+        assert ws.partition_key(test_doc) == str(test_doc.dossier.id)
+        assert ws.partition_key('some_id') is None
+
+    @pytest.mark.asyncio
+    async def test_handler_thread_pools(self, ws, mock_clients):
+        ws.start(mock_clients, handler_threads={'document_event': 1})
+        assert list(ws.handler_pools) == ['document_event']
+
+        doc = open("tests/fixtures/document/updated_addendums.json", "r")
+        test_doc = DocumentBody.parse_raw(doc.read())
+        doc.close()
+
+        handled_before = HANDLER_SECONDS.count(event='document_event')
+        waits_before = HANDLER_WAIT_SECONDS.count(event='document_event')
+        res = await ws.execute_webhook('document_event', test_doc)
+
+        assert res == 'document event is handled'
+        assert HANDLER_SECONDS.count(event='document_event') == handled_before + 1
+        assert HANDLER_WAIT_SECONDS.count(event='document_event') == waits_before + 1
+        ws.stop()
+
+    @pytest.mark.asyncio
+    async def test_service_built_in_handler_thread(self, ws, mock_clients, monkeypatch):
+        ws.start(mock_clients, handler_threads={'document_event': 1})
+        threads = []
+
+        class RecordingService:
+            def __init__(self, clients):
+                threads.append(threading.current_thread().name)
+
+            def handle_event(self, params):
+                threads.append(threading.current_thread().name)
+
+        monkeypatch.setitem(SERVICES, 'document_event', RecordingService)
+        await ws.execute_webhook('document_event', None)
+
+        # the constructor can load the custom field catalogue over http
+        assert len(threads) == 2
+        assert all(name.startswith('document_event_handler') for name in threads)
+        ws.stop()
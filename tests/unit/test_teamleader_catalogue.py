@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   tests/unit/test_teamleader_catalogue.py
+#
+
+import pytest
+
+from app.clients.teamleader_catalogue import TeamleaderCatalogue, load_catalogue, read_all_pages
+from mock_teamleader_client import MockTlClient
+
+CP_STATUS_ID = 'afe9268c-c6dd-0053-bc5d-d4da5e723daa'
+
+
+class TestTeamleaderCatalogue:
+    def test_load_catalogue(self):
+        catalogue = load_catalogue(MockTlClient())
+        assert len(catalogue.custom_fields) == 31
+        assert len(catalogue.business_types) == 50
+
+        assert catalogue.definition(CP_STATUS_ID)['label'] == '2.2 - CP status'
+        assert catalogue.options(CP_STATUS_ID) == {'ja', 'nee', 'pending'}
+        assert catalogue.options('unknown_field_id') == set()
+
+    def test_read_all_pages(self):
+        pages = {1: [1, 2], 2: [3, 4], 3: [5]}
+
+        def list_method(page, page_size):
+            return pages.get(page, [])
+
+        assert read_all_pages(list_method, page_size=2) == [1, 2, 3, 4, 5]
+
+    def test_business_type_names(self):
+        catalogue = load_catalogue(MockTlClient())
+        names = catalogue.business_type_names()
+        assert names['bv/srl'] == 'b15b229f-e73b-0d5f-bb26-1a0b294e71d4'
+        assert names['bv'] == 'b15b229f-e73b-0d5f-bb26-1a0b294e71d4'
+        assert 'vve' not in names
+
+    def test_snapshot_roundtrip(self):
+        catalogue = load_catalogue(MockTlClient())
+        restored = TeamleaderCatalogue.from_dict(catalogue.to_dict())
+        assert restored.loaded_at == catalogue.loaded_at
+        assert restored.options(CP_STATUS_ID) == catalogue.options(CP_STATUS_ID)
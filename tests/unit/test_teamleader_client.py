@@ -6,17 +6,37 @@
 #   tests/unit/test_teamleader_client.py
 #
 
+import copy
 import pytest
+import threading
+import time
 import uuid
 import json
+import requests
 import requests_mock
 from datetime import datetime
+from redis.exceptions import LockNotOwnedError
 
 from app.clients.teamleader_client import TeamleaderClient, TeamleaderAuthError
+from app.clients.teamleader_client import REQUEST_SECONDS, RESPONSES, RETRIES
+from app.clients.circuit_breaker import TeamleaderUnavailableError
 from testing_config import tst_app_config
 from tests.unit.mock_redis_cache import MockRedisCache
 
 
+class ExpiringLock:
+    """ redis lock that is not acquired in time or expires while held """
+
+    def __init__(self, acquired):
+        self.acquired = acquired
+
+    def acquire(self):
+        return self.acquired
+
+    def release(self):
+        raise LockNotOwnedError("Cannot release a lock that's no longer owned")
+
+
 class TestTeamleaderClient:
     API_URL = 'https://api.teamleader.eu'
     AUTH_URL = 'https://app.teamleader.eu'
@@ -538,3 +558,499 @@ class TestTeamleaderClient:
         )
         contact_uuid = tlc.get_migrate_uuid(resource_type, old_id)
         assert contact_uuid is None
+
+    def test_connection_stats(self, tlc, requests_mock):
+        requests_mock.get(
+            f'{self.API_URL}/companies.info?id=company_uuid',
+            json={'data': {}}
+        )
+        tlc.get_company('company_uuid')
+
+        # requests_mock bypasses the connection pools
+        stats = tlc.connection_stats()
+        assert stats == {'connections': 0, 'requests': 0, 'reused': 0}
+
+    def test_keep_alive_disabled(self, requests_mock):
+        app_config = tst_app_config()
+        app_config['teamleader']['keep_alive'] = False
+        tlc = TeamleaderClient(app_config, MockRedisCache())
+        tlc.RATE_LIMIT = 0.0
+
+        requests_mock.get(
+            f'{self.API_URL}/contacts.info?id=some_contact_uuid',
+            json={'data': {'id': 'mocked_contact_id'}}
+        )
+
+        result = tlc.get_contact('some_contact_uuid')
+        assert result['id'] == 'mocked_contact_id'
+        assert tlc.connection_stats()['reused'] == 0
+        tlc.close()
+
+    def test_get_company_retries_after_429(self, tlc, requests_mock):
+        requests_mock.get(
+            f'{self.API_URL}/companies.info?id=company_uuid',
+            [
+                {'json': {}, 'status_code': 429, 'headers': {'Retry-After': '0'}},
+                {'json': {'data': {'id': 'company_uuid'}}, 'status_code': 200}
+            ]
+        )
+
+        result = tlc.get_company('company_uuid')
+        assert result['id'] == 'company_uuid'
+        assert tlc.retry_stats()['retries'] == 1
+        assert tlc.retry_stats()['rate_limited'] == 1
+
+    def test_update_company_retries_server_error(self, tlc, requests_mock):
+        tlc.retry_policy.backoff = 0.0
+        requests_mock.post(
+            f'{self.API_URL}/companies.update',
+            [
+                {'json': {}, 'status_code': 503},
+                {'json': {'data': {'name': 'S.M.A.K.'}}, 'status_code': 200}
+            ]
+        )
+
+        result = tlc.update_company({'id': 'company_uuid', 'custom_fields': []})
+        assert result['name'] == 'S.M.A.K.'
+        assert tlc.retry_stats()['server_errors'] == 1
+
+    def test_add_contact_not_retried_on_server_error(self, tlc, requests_mock):
+        requests_mock.post(
+            f'{self.API_URL}/contacts.add',
+            [
+                {'json': {}, 'status_code': 503},
+                {'json': {'data': {'id': 'contact_uuid'}}, 'status_code': 200}
+            ]
+        )
+
+        with pytest.raises(ValueError):
+            tlc.add_contact({'first_name': 'test'})
+        assert tlc.retry_stats()['retries'] == 0
+
+    def test_retry_budget_exhausted(self, tlc, requests_mock):
+        tlc.retry_policy.budget_size = 1
+        tlc.reset_retry_budget()
+        requests_mock.get(
+            f'{self.API_URL}/contacts.info?id=some_contact_uuid',
+            json={},
+            status_code=429,
+            headers={'Retry-After': '0'}
+        )
+
+        with pytest.raises(ValueError):
+            tlc.get_contact('some_contact_uuid')
+
+        stats = tlc.retry_stats()
+        assert stats['retries'] == 1
+        assert stats['budget_exhausted'] == 1
+
+    def test_retry_budget_per_event_thread(self, tlc, requests_mock):
+        tlc.retry_policy.budget_size = 1
+        tlc.start_event()
+        requests_mock.get(
+            f'{self.API_URL}/contacts.info?id=some_contact_uuid',
+            json={},
+            status_code=429,
+            headers={'Retry-After': '0'}
+        )
+        with pytest.raises(ValueError):
+            tlc.get_contact('some_contact_uuid')
+        assert tlc.event_stats()['requests'] == 2
+
+        # an event starting in another thread has its own budget and stats
+        other_event = {}
+
+        def handle_other_event():
+            tlc.start_event()
+            other_event['budget'] = tlc.retry_policy.budget
+            other_event['stats'] = tlc.event_stats()
+
+        thread = threading.Thread(target=handle_other_event)
+        thread.start()
+        thread.join()
+        assert other_event['budget'] == 1
+        assert other_event['stats']['requests'] == 0
+        assert tlc.retry_policy.budget == 0
+        assert tlc.event_stats()['requests'] == 2
+
+    def test_company_contacts_multiple_pages(self, tlc, requests_mock):
+        COMPANY_ID = 'some_company_uuid'
+        contact_ids = [f'contact_{i}' for i in range(25)]
+        for page, ids in [(1, contact_ids[:20]), (2, contact_ids[20:])]:
+            requests_mock.get(
+                '{}/contacts.list?filter%5Bcompany_id%5D={}&page%5Bnumber%5D={}&page%5Bsize%5D=20'.format(
+                    self.API_URL,
+                    COMPANY_ID,
+                    page
+                ),
+                json={'data': [{'id': cid} for cid in ids]}
+            )
+
+        for cid in contact_ids:
+            requests_mock.get(
+                f'{self.API_URL}/contacts.info?id={cid}',
+                json={'data': {'id': cid}}
+            )
+
+        result = tlc.company_contacts(COMPANY_ID)
+        assert [c['id'] for c in result] == contact_ids
+
+    def test_company_contacts_count_in_event(self, tlc, requests_mock):
+        tlc.retry_policy.budget_size = 1
+        tlc.start_event()
+        requests_mock.get(
+            f'{self.API_URL}/contacts.list?filter%5Bcompany_id%5D=company_uuid',
+            json={'data': [{'id': 'contact_1'}, {'id': 'contact_2'}]}
+        )
+        requests_mock.get(
+            f'{self.API_URL}/contacts.info',
+            json={},
+            status_code=429,
+            headers={'Retry-After': '0'}
+        )
+
+        with pytest.raises(ValueError):
+            tlc.company_contacts('company_uuid')
+
+        # the pool threads share the budget and stats of the event
+        assert tlc.retry_stats()['retries'] == 1
+        assert tlc.retry_policy.budget == 0
+        assert tlc.event_stats()['requests'] == 4
+
+    def test_update_company_only_changed_fields(self, tlc, requests_mock):
+        requests_mock.post(f'{self.API_URL}/companies.update', status_code=204)
+        original = {
+            'id': 'company_uuid',
+            'name': 'S.M.A.K.',
+            'custom_fields': [
+                {'definition': {'type': 'customFieldDefinition', 'id': 'cf1'}, 'value': 'ja'},
+                {'definition': {'type': 'customFieldDefinition', 'id': 'cf2'}, 'value': False}
+            ]
+        }
+        company = copy.deepcopy(original)
+        company['custom_fields'][1]['value'] = True
+
+        tlc.update_company(company, original)
+
+        assert json.loads(requests_mock.last_request.body) == {
+            'id': 'company_uuid',
+            'custom_fields': [{'id': 'cf2', 'value': True}]
+        }
+        assert tlc.company_write_stats() == {
+            'sent': 1, 'avoided': 0, 'fields_skipped': 2
+        }
+
+    def test_update_company_unchanged_skipped(self, tlc, requests_mock):
+        original = {'id': 'company_uuid', 'name': 'S.M.A.K.', 'custom_fields': []}
+
+        result = tlc.update_company(copy.deepcopy(original), original)
+
+        assert result is None
+        assert requests_mock.call_count == 0
+        assert tlc.company_write_stats()['avoided'] == 1
+
+    def test_token_refreshed_by_other_worker(self, requests_mock):
+        # without pub/sub worker2 only notices the refresh on a 401
+        app_config = tst_app_config()
+        app_config['teamleader']['token_pubsub'] = False
+        shared_redis = MockRedisCache()
+        worker1 = TeamleaderClient(app_config, shared_redis)
+        worker2 = TeamleaderClient(app_config, shared_redis)
+        worker1.RATE_LIMIT = 0.0
+        worker2.RATE_LIMIT = 0.0
+
+        requests_mock.post(
+            f'{self.AUTH_URL}/oauth2/access_token',
+            json={
+                'access_token': 'new_access',
+                'refresh_token': 'new_refresh',
+            },
+            status_code=200
+        )
+        requests_mock.get(
+            f'{self.API_URL}/companies.info?id=company_uuid',
+            [
+                {'json': {'data': {}}, 'status_code': 401},
+                {'json': {'data': {'id': 'company_uuid'}}, 'status_code': 200}
+            ]
+        )
+
+        expired = "Bearer {}".format(worker1.token)
+        worker1.refresh_expired_token(expired)
+        worker2.get_company('company_uuid')
+
+        token_calls = [
+            r for r in requests_mock.request_history if 'oauth2' in r.url
+        ]
+        assert len(token_calls) == 1
+        assert worker2.token == 'new_access'
+        assert worker2.refresh_token == 'new_refresh'
+        assert worker1.token_refresh_stats()['refreshed'] == 1
+        assert worker2.token_refresh_stats() == {
+            'refreshed': 0, 'collisions_avoided': 1
+        }
+
+    def test_refresh_lock_timeout_does_not_refresh(self, tlc, requests_mock):
+        tlc.token_store.refresh_lock = lambda: ExpiringLock(acquired=False)
+
+        tlc.refresh_expired_token("Bearer {}".format(tlc.token))
+
+        assert requests_mock.call_count == 0
+        assert tlc.token_refresh_stats()['refreshed'] == 0
+
+    def test_refresh_lock_expired_refreshes_once(self, tlc, requests_mock):
+        tlc.token_store.refresh_lock = lambda: ExpiringLock(acquired=True)
+        requests_mock.post(
+            f'{self.AUTH_URL}/oauth2/access_token',
+            json={'access_token': 'new_access', 'refresh_token': 'new_refresh'}
+        )
+
+        tlc.refresh_expired_token("Bearer {}".format(tlc.token))
+
+        assert requests_mock.call_count == 1
+        assert tlc.token == 'new_access'
+        assert tlc.token_refresh_stats()['refreshed'] == 1
+
+    def test_token_refreshed_by_other_thread(self, tlc, requests_mock):
+        tlc.token = 'already_refreshed'
+
+        tlc.refresh_expired_token('Bearer test_teamleader_auth_token')
+
+        assert requests_mock.call_count == 0
+        assert tlc.token_refresh_stats()['collisions_avoided'] == 1
+
+    def test_token_expiry_saved(self, tlc, requests_mock):
+        requests_mock.post(
+            f'{self.AUTH_URL}/oauth2/access_token',
+            json={
+                'access_token': 'new_access',
+                'refresh_token': 'new_refresh',
+                'expires_in': 3600
+            }
+        )
+
+        tlc.auth_token_refresh()
+
+        assert tlc.expires_at > time.time() + 3500
+        assert tlc.token_store.read_expiry() == tlc.expires_at
+
+    def test_renew_token_before_expiry(self, tlc, requests_mock):
+        requests_mock.post(
+            f'{self.AUTH_URL}/oauth2/access_token',
+            json={
+                'access_token': 'new_access',
+                'refresh_token': 'new_refresh',
+                'expires_in': 3600
+            }
+        )
+
+        # unknown expiry or far from expiring, nothing to do
+        assert tlc.renew_token_if_expiring() is False
+        tlc.expires_at = time.time() + 3000
+        assert tlc.renew_token_if_expiring() is False
+        assert requests_mock.call_count == 0
+
+        tlc.expires_at = time.time() + 60
+        assert tlc.renew_token_if_expiring() is True
+        assert tlc.token == 'new_access'
+        assert tlc.token_refresh_stats()['refreshed'] == 1
+
+    def test_token_update_published(self, requests_mock):
+        shared_redis = MockRedisCache()
+        worker1 = TeamleaderClient(tst_app_config(), shared_redis)
+        worker2 = TeamleaderClient(tst_app_config(), shared_redis)
+        version = worker2.token_version
+
+        requests_mock.post(
+            f'{self.AUTH_URL}/oauth2/access_token',
+            json={
+                'access_token': 'new_access',
+                'refresh_token': 'new_refresh',
+            }
+        )
+        worker1.auth_token_refresh()
+
+        assert worker2.token == 'new_access'
+        assert worker2.refresh_token == 'new_refresh'
+        assert worker2.token_version == version + 1
+
+        # older notifications are ignored
+        worker1.token = 'stale_token'
+        worker1.tokens_updated(version)
+        assert worker1.token == 'stale_token'
+
+        worker2.close()
+        assert len(shared_redis.subscribers['skryv_tl_auth_updates']) == 1
+
+    def test_call_metrics(self, tlc, requests_mock):
+        requests_mock.get(
+            f'{self.API_URL}/contacts.info?id=metrics_contact',
+            [
+                {'json': {}, 'status_code': 503},
+                {'json': {'data': {'id': 'metrics_contact'}}, 'status_code': 200}
+            ]
+        )
+        tlc.retry_policy.backoff = 0.0
+        ok_before = RESPONSES.get(method='GET', endpoint='/contacts.info', status=200)
+        failed_before = RESPONSES.get(method='GET', endpoint='/contacts.info', status=503)
+        retries_before = RETRIES.get(endpoint='/contacts.info', status=503)
+        calls_before = REQUEST_SECONDS.count(method='GET', endpoint='/contacts.info')
+
+        tlc.get_contact('metrics_contact')
+
+        assert RESPONSES.get(method='GET', endpoint='/contacts.info', status=200) == ok_before + 1
+        assert RESPONSES.get(method='GET', endpoint='/contacts.info', status=503) == failed_before + 1
+        assert RETRIES.get(endpoint='/contacts.info', status=503) == retries_before + 1
+        assert REQUEST_SECONDS.count(method='GET', endpoint='/contacts.info') == calls_before + 2
+
+    def test_circuit_opens_on_server_errors(self, tlc, requests_mock):
+        tlc.retry_policy.backoff = 0.0
+        tlc.circuit_breaker.failure_threshold = 2
+        requests_mock.get(
+            f'{self.API_URL}/contacts.info?id=down_contact',
+            json={},
+            status_code=503
+        )
+
+        with pytest.raises(TeamleaderUnavailableError):
+            tlc.get_contact('down_contact')
+        assert not tlc.available()
+        assert requests_mock.call_count == 2
+
+        # open circuit fails fast without calling teamleader
+        with pytest.raises(TeamleaderUnavailableError):
+            tlc.get_contact('down_contact')
+        assert requests_mock.call_count == 2
+        assert tlc.circuit_breaker_stats()['rejected'] == 2
+
+    def test_circuit_closes_after_probe(self, tlc, requests_mock):
+        tlc.circuit_breaker.failure_threshold = 1
+        tlc.circuit_breaker.record_failure()
+        assert not tlc.available()
+
+        tlc.circuit_breaker.opened_at -= tlc.circuit_breaker.reset_timeout
+        requests_mock.get(
+            f'{self.API_URL}/contacts.info?id=probe_contact',
+            json={'data': {'id': 'probe_contact'}}
+        )
+        assert tlc.get_contact('probe_contact')['id'] == 'probe_contact'
+        assert tlc.available()
+        assert tlc.circuit_breaker_stats()['open'] == 0
+
+    def test_probe_error_reopens_circuit(self, tlc, requests_mock):
+        tlc.circuit_breaker.failure_threshold = 1
+        tlc.circuit_breaker.record_failure()
+        tlc.circuit_breaker.opened_at -= tlc.circuit_breaker.reset_timeout
+        requests_mock.get(
+            f'{self.API_URL}/contacts.info?id=probe_contact',
+            exc=requests.exceptions.ChunkedEncodingError
+        )
+        with pytest.raises(requests.exceptions.ChunkedEncodingError):
+            tlc.get_contact('probe_contact')
+
+        # probe failed, circuit is open again instead of stuck half open
+        assert not tlc.available()
+        tlc.circuit_breaker.opened_at -= tlc.circuit_breaker.reset_timeout
+        assert tlc.circuit_breaker.allow_request()
+
+    def test_connection_error_unavailable(self, tlc, requests_mock):
+        requests_mock.get(
+            f'{self.API_URL}/contacts.info?id=unreachable',
+            exc=requests.exceptions.ConnectTimeout
+        )
+        with pytest.raises(TeamleaderUnavailableError):
+            tlc.get_contact('unreachable')
+        assert tlc.circuit_breaker_stats()['failures'] == 1
+
+    def test_requests_have_timeouts(self, tlc, requests_mock):
+        requests_mock.get(f'{self.API_URL}/contacts.info?id=slow', exc=requests.exceptions.ReadTimeout)
+        requests_mock.post(f'{self.API_URL}/contacts.delete', status_code=204)
+        requests_mock.post(
+            f'{self.AUTH_URL}/oauth2/access_token',
+            json={'access_token': 'new_access', 'refresh_token': 'new_refresh'}
+        )
+
+        # a hung teamleader times out and counts as a failure
+        with pytest.raises(TeamleaderUnavailableError):
+            tlc.get_contact('slow')
+        assert tlc.circuit_breaker_stats()['failures'] == 1
+
+        tlc.delete_contact('contact_uuid')
+        tlc.auth_token_refresh()
+        assert all(r.timeout == (5.0, 30.0) for r in requests_mock.request_history)
+
+    def test_iter_companies(self, tlc, requests_mock):
+        since = datetime(2022, 6, 1, 12, 30, 15, 1234)
+        for page, ids in [(1, ['c1', 'c2']), (2, ['c3', 'c4']), (3, ['c5'])]:
+            requests_mock.get(
+                '{}/companies.list?page%5Bnumber%5D={}&page%5Bsize%5D=2'.format(
+                    self.API_URL, page
+                ),
+                json={'data': [{'id': cid} for cid in ids]}
+            )
+
+        result = [c['id'] for c in tlc.iter_companies(since, page_size=2)]
+
+        assert result == ['c1', 'c2', 'c3', 'c4', 'c5']
+        assert requests_mock.call_count == 3
+        updated_since = requests_mock.last_request.qs['filter[updated_since]']
+        assert updated_since[0].lower() == '2022-06-01t12:30:15'
+
+    def test_iter_stops_early(self, tlc, requests_mock):
+        for page in range(1, 6):
+            requests_mock.get(
+                '{}/contacts.list?page%5Bnumber%5D={}&page%5Bsize%5D=2'.format(
+                    self.API_URL, page
+                ),
+                json={'data': [{'id': f'p{page}_1'}, {'id': f'p{page}_2'}]}
+            )
+
+        contacts = tlc.iter_contacts(page_size=2)
+        first = [next(contacts)['id'], next(contacts)['id']]
+        contacts.close()
+
+        assert first == ['p1_1', 'p1_2']
+        # only the page after the one consumed was prefetched
+        assert requests_mock.call_count == 2
+
+    def test_migrate_uuid_cached(self, tlc, requests_mock):
+        requests_mock.get(
+            f'{self.API_URL}/migrate.id?id=56061444&type=company',
+            json={'data': {'id': 'new_company_uuid'}}
+        )
+
+        assert tlc.get_migrate_uuid('company', '56061444') == 'new_company_uuid'
+        assert tlc.get_migrate_uuid('company', '56061444') == 'new_company_uuid'
+        assert requests_mock.call_count == 1
+
+    def test_warm_migrate_uuids(self, tlc, requests_mock):
+        tlc.save_migrate_uuid('company', '1', 'uuid_1')
+        requests_mock.get(
+            f'{self.API_URL}/migrate.id?id=2&type=company',
+            json={'data': {'id': 'uuid_2'}}
+        )
+        requests_mock.get(
+            f'{self.API_URL}/migrate.id?id=3&type=company',
+            json={'errors': []},
+            status_code=404
+        )
+
+        result = tlc.warm_migrate_uuids('company', ['1', '2', '3', '2'])
+
+        assert result == {'cached': 1, 'resolved': 1, 'failed': ['3']}
+        assert requests_mock.call_count == 2
+        assert tlc.cached_migrate_uuid('company', '2') == 'uuid_2'
+
+    def test_warm_migrate_uuids_reports_errors_per_id(self, tlc, requests_mock):
+        requests_mock.get(
+            f'{self.API_URL}/migrate.id?id=1&type=company',
+            exc=requests.exceptions.ConnectTimeout
+        )
+        requests_mock.get(
+            f'{self.API_URL}/migrate.id?id=2&type=company',
+            json={'data': {'id': 'uuid_2'}}
+        )
+
+        result = tlc.warm_migrate_uuids('company', ['1', '2'])
+
+        assert result == {'cached': 0, 'resolved': 1, 'failed': ['1']}
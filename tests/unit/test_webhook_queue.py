@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  @Author: Walter Schreppers
+#
+#   tests/unit/test_webhook_queue.py
+#
+
+import pytest
+import uuid
+
+from app.comm.webhook_queue import (
+    StreamWebhookQueue, MemoryWebhookQueue, create_webhook_queue, COALESCED
+)
+from app.models.document_body import DocumentBody
+from app.models.milestone_body import MilestoneBody
+from mock_redis_cache import MockRedisCache
+
+STREAM_PARAMS = {
+    'webhook_queue': 'redis_stream',
+    'webhook_claim_idle': 0,
+    'webhook_stream_partitions': 1
+}
+
+
+class TestWebhookQueue:
+    @pytest.fixture
+    def document(self):
+        doc = open("tests/fixtures/document/updated_addendums.json", "r")
+        test_doc = DocumentBody.parse_raw(doc.read())
+        doc.close()
+        return test_doc
+
+    def test_create_webhook_queue(self):
+        assert isinstance(create_webhook_queue({}, None), MemoryWebhookQueue)
+        assert isinstance(
+            create_webhook_queue(STREAM_PARAMS, MockRedisCache()),
+            StreamWebhookQueue
+        )
+
+    def test_put_get_ack(self, document):
+        redis = MockRedisCache()
+        whq = StreamWebhookQueue(STREAM_PARAMS, redis)
+        assert whq.empty()
+
+        whq.put('document_event', document)
+        assert not whq.empty()
+
+        entry = whq.get()
+        assert entry['webhook'] == 'document_event'
+        assert entry['params'] == document
+        assert whq.empty()
+        assert whq.get() is None
+        assert len(redis.xpending(whq.streams[0], whq.group)) == 1
+
+        whq.ack(entry)
+        assert redis.xpending(whq.streams[0], whq.group) == []
+
+    def other_partition(self, whq, document):
+        """ copy of document for a dossier in another partition """
+        other = document.copy(deep=True)
+        n = 0
+        while whq.partition_stream(other) == whq.partition_stream(document):
+            n += 1
+            other.dossier.externalId = f'OR-other{n}'
+        return other
+
+    def test_partitions_shared_between_workers(self, document):
+        redis = MockRedisCache()
+        params = dict(STREAM_PARAMS, webhook_stream_partitions=2)
+        worker1 = StreamWebhookQueue(params, redis, 'worker1')
+        worker2 = StreamWebhookQueue(params, redis, 'worker2')
+        worker1.reclaim()
+        worker2.reclaim()
+        assert len(worker1.owned) == len(worker2.owned) == 1
+
+        other = self.other_partition(worker1, document)
+        second_document = document.copy(deep=True)
+        second_document.document.id = uuid.uuid4()
+        for params in (document, other, second_document):
+            worker1.put('document_event', params)
+
+        # all events of a dossier go to the worker owning its partition
+        first, second = (worker1, worker2) if worker1.partition_stream(document) in worker1.owned \
+            else (worker2, worker1)
+        assert first.get()['id'] == b'1-0'
+        assert first.get()['id'] == b'2-0'
+        assert first.get() is None
+        assert second.get()['params'] == other
+        assert second.get() is None
+
+    def test_partitions_rebalanced(self, document):
+        redis = MockRedisCache()
+        params = dict(STREAM_PARAMS, webhook_stream_partitions=8)
+        pod_a = StreamWebhookQueue(params, redis, 'pod_a')
+        assert len(pod_a.owned) == 8
+
+        # pod_a offers half of its partitions once pod_b is alive
+        pod_b = StreamWebhookQueue(params, redis, 'pod_b')
+        assert pod_b.owned == []
+        pod_a.reclaim()
+        pod_b.reclaim()
+        pod_a.reclaim()
+        assert len(pod_a.owned) == len(pod_b.owned) == 4
+        assert set(pod_a.owned).isdisjoint(pod_b.owned)
+
+        # partitions of a crashed pod are free once its leases expired,
+        # they are taken even above our share
+        for stream in pod_b.owned:
+            redis.delete(pod_b.lease_key(stream))
+        pod_a.reclaim()
+        assert len(pod_a.owned) == 8
+
+    def test_partition_in_progress_not_offered(self, document):
+        redis = MockRedisCache()
+        params = dict(STREAM_PARAMS, webhook_stream_partitions=2, webhook_claim_idle=300)
+        pod_a = StreamWebhookQueue(params, redis, 'pod_a')
+        pod_a.put('document_event', document)
+        pod_a.put('document_event', self.other_partition(pod_a, document))
+        first = pod_a.get()
+        assert pod_a.get()
+
+        StreamWebhookQueue(params, redis, 'pod_b')
+        pod_a.reclaim()
+        assert len(pod_a.owned) == 2
+
+        # offered once its entry is acknowledged
+        pod_a.ack(first)
+        pod_a.reclaim()
+        assert pod_a.owned == [s for s in pod_a.streams if s != first['stream']]
+
+    def test_close_releases_partitions(self):
+        redis = MockRedisCache()
+        pod_a = StreamWebhookQueue(STREAM_PARAMS, redis, 'pod_a')
+        pod_b = StreamWebhookQueue(STREAM_PARAMS, redis, 'pod_b')
+        pod_a.close()
+        assert pod_a.owned == []
+
+        pod_b.reclaim()
+        assert pod_b.owned == pod_b.streams
+
+    def test_reclaim_stuck_entry(self, document):
+        redis = MockRedisCache()
+        crashed = StreamWebhookQueue(STREAM_PARAMS, redis, 'crashed_worker')
+        crashed.put('document_event', document)
+        assert crashed.get()
+
+        # partition is taken over once the lease of the crashed worker expired
+        worker = StreamWebhookQueue(STREAM_PARAMS, redis)
+        assert worker.owned == []
+        assert worker.get() is None
+        redis.delete(crashed.lease_key(crashed.streams[0]))
+        assert worker.reclaim() == 1
+
+        entry = worker.get()
+        assert entry['params'] == document
+        worker.ack(entry)
+        assert redis.xpending(worker.streams[0], worker.group) == []
+
+    def test_lost_partition_not_read(self, document):
+        redis = MockRedisCache()
+        whq = StreamWebhookQueue(STREAM_PARAMS, redis)
+        whq.put('document_event', document)
+
+        # lease expired and was taken by another worker
+        redis.set(whq.lease_key(whq.streams[0]), 'other_worker')
+        assert whq.reclaim() == 0
+        assert whq.owned == []
+        assert whq.get() is None
+
+    def test_drop_after_max_deliveries(self, document):
+        redis = MockRedisCache()
+        params = dict(STREAM_PARAMS, webhook_max_deliveries=2)
+        whq = StreamWebhookQueue(params, redis)
+        whq.put('document_event', document)
+        assert whq.get()
+
+        # each restart delivers the entry left pending again
+        restarted = StreamWebhookQueue(params, redis)
+        assert restarted.get()
+        restarted = StreamWebhookQueue(params, redis)
+        assert restarted.get() is None
+        assert redis.xpending(whq.streams[0], whq.group) == []
+
+    def test_entry_in_progress_not_claimed(self, document):
+        redis = MockRedisCache()
+        whq = StreamWebhookQueue(STREAM_PARAMS, redis)
+        whq.put('document_event', document)
+        entry = whq.get()
+
+        # a slow event is not delivered a second time while it runs
+        assert whq.reclaim() == 0
+        assert whq.get() is None
+
+        # a pending entry whose ack failed is delivered again
+        redis.xack = lambda stream, group, entry_id: 1 / 0
+        with pytest.raises(ZeroDivisionError):
+            whq.ack(entry)
+        assert whq.reclaim() == 1
+        assert whq.get()['id'] == entry['id']
+
+    def test_restart_delivers_pending(self, document):
+        redis = MockRedisCache()
+        whq = StreamWebhookQueue(STREAM_PARAMS, redis)
+        whq.put('document_event', document)
+        assert whq.get()
+
+        restarted = StreamWebhookQueue(STREAM_PARAMS, redis)
+        assert restarted.get()['params'] == document
+
+    def test_put_wakes_subscribers(self, document):
+        redis = MockRedisCache()
+        whq = StreamWebhookQueue(STREAM_PARAMS, redis)
+        wakeups = []
+        subscription = whq.subscribe(lambda: wakeups.append(1))
+
+        whq.put('document_event', document)
+        assert wakeups == [1]
+        subscription.stop()
+
+    def document_version(self, document, version):
+        newer = document.copy(deep=True)
+        newer.document.version = version
+        return newer
+
+    def test_memory_coalesces_document_versions(self, document):
+        whq = MemoryWebhookQueue()
+        coalesced = COALESCED.get()
+        version = document.document.version
+
+        whq.put('document_event', document)
+        whq.put('document_event', self.document_version(document, version + 1))
+        whq.put('document_event', self.document_version(document, version - 1))
+        assert COALESCED.get() == coalesced + 2
+
+        assert whq.get()['params'].document.version == version + 1
+        assert whq.get() is None
+
+        # once taken from the queue a new version is queued again
+        whq.put('document_event', self.document_version(document, version + 2))
+        assert whq.get()['params'].document.version == version + 2
+
+    def test_stream_skips_superseded_documents(self, document):
+        redis = MockRedisCache()
+        whq = StreamWebhookQueue(STREAM_PARAMS, redis)
+        coalesced = COALESCED.get()
+        version = document.document.version
+
+        whq.put('document_event', document)
+        whq.put('document_event', self.document_version(document, version + 1))
+
+        # newest version is handled at the position of the first entry
+        entry = whq.get()
+        assert entry['params'].document.version == version + 1
+        whq.ack(entry)
+        assert whq.get() is None
+        assert COALESCED.get() == coalesced + 1
+        assert redis.xpending(whq.streams[0], whq.group) == []
+
+        # an older version arriving later is skipped, a newer one handled
+        whq.put('document_event', document)
+        assert whq.get() is None
+        whq.put('document_event', self.document_version(document, version + 2))
+        assert whq.get()['params'].document.version == version + 2
+
+    def test_redelivered_entry_handles_newest(self, document):
+        redis = MockRedisCache()
+        whq = StreamWebhookQueue(STREAM_PARAMS, redis)
+        version = document.document.version
+        whq.put('document_event', document)
+        whq.put('document_event', self.document_version(document, version + 1))
+
+        # the worker crashes while handling the first entry
+        assert whq.get()['params'].document.version == version + 1
+        assert whq.get() is None
+        restarted = StreamWebhookQueue(STREAM_PARAMS, redis)
+        assert restarted.get()['params'].document.version == version + 1
+
+    @pytest.mark.parametrize('stream', [False, True])
+    def test_coalescing_keeps_dossier_order(self, document, stream):
+        whq = StreamWebhookQueue(STREAM_PARAMS, MockRedisCache()) if stream else MemoryWebhookQueue()
+        milestone = MilestoneBody.parse_obj(MilestoneBody.Config.schema_extra['example'])
+        milestone.dossier = document.dossier
+        version = document.document.version
+
+        whq.put('document_event', document)
+        whq.put('milestone_event', milestone)
+        whq.put('document_event', self.document_version(document, version + 1))
+
+        handled = []
+        entry = whq.get()
+        while entry:
+            handled.append(entry)
+            whq.ack(entry)
+            entry = whq.get()
+
+        # the milestone needs the document of its dossier saved before it
+        assert [e['webhook'] for e in handled] == ['document_event', 'milestone_event']
+        assert handled[0]['params'].document.version == version + 1